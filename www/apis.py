@@ -33,6 +33,78 @@ class Page(object):
         self.has_previous = self.page_index > 1  # > 若页码大于1,说明有前页
 
 
+# CursorPage对象，用于keyset分页(按游标翻页)的页面信息，配合Model.findAll的seek参数使用：
+#   p = CursorPage(cursor)
+#   blogs = p.paginate((yield from Blog.findAll(seek=p.seek, limit=p.limit)))
+# 和Page不同，它不需要总数，也没有页码，只能翻到上一页或下一页
+# next_cursor和prev_cursor是不透明的字符串，客户端原样传回来即可
+class CursorPage(object):
+    '''Page object for keyset pagination.'''
+
+    def __init__(self, cursor=None, page_size=10):
+        '''init Pagination by cursor, page_size
+        cursor - 上一次返回的next_cursor或prev_cursor，为None或空字符串表示第一页
+        page_size - 一个页面最多显示的数目'''
+        self.page_size = page_size
+        self.cursor = cursor or None
+        self.next_cursor = None
+        self.prev_cursor = None
+        self.has_next = False
+        self.has_previous = False
+        # 游标不合法时这里就会抛出APIValueError
+        self.seek
+
+    # 传给Model.findAll的seek参数
+    @property
+    def seek(self):
+        if self.cursor is None:
+            return None
+        return decode_cursor(self.cursor)
+
+    # 传给Model.findAll的limit参数，多取一行用来判断后面还有没有数据
+    @property
+    def limit(self):
+        return self.page_size + 1
+
+    # 根据findAll的结果设置翻页信息，返回这一页的记录
+    def paginate(self, items):
+        items = list(items)
+        more = len(items) > self.page_size
+        seek = self.seek
+        if seek is not None and seek[0] == 'before':
+            # 往前翻页，多取的那一行在最前面
+            if more:
+                items = items[1:]
+            self.has_previous = more
+            self.has_next = True
+        else:
+            items = items[:self.page_size]
+            self.has_next = more
+            self.has_previous = seek is not None
+        if items:
+            if self.has_next:
+                self.next_cursor = encode_cursor('after', items[-1])
+            if self.has_previous:
+                self.prev_cursor = encode_cursor('before', items[0])
+        return items
+
+
+# 游标就是(方向, created_at, id)的JSON再做base64编码，对客户端来说是不透明的
+def encode_cursor(direction, item):
+    s = json.dumps([direction, item['created_at'], item['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(s.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        s = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        direction, created_at, pk = json.loads(s)
+        if direction not in ('after', 'before') or not isinstance(created_at, (int, float)):
+            raise ValueError(direction)
+    except (ValueError, TypeError, UnicodeError):
+        raise APIValueError('cursor', 'Invalid cursor.')
+    return direction, created_at, pk
+
 
 # 几个简单的api错误异常类，用于抛出异常
 
@@ -41,7 +113,7 @@ class Page(object):
 JSON API definition.
 '''
 
-import json, logging, inspect, functools
+import json, logging, inspect, functools, base64
 
 class APIError(Exception):
     '''
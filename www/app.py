@@ -1,9 +1,8 @@
 # logging模块定义了一些函数和模块，可以帮助我们对一个应用程序或库实现一个灵活的事件日志处理系统
 # logging模块可以纪录错误信息，并在错误信息记录完后继续执行
 import logging
-# 设置logging的默认level为INFO
 # 日志级别大小关系为：CRITICAL > ERROR > WARNING > INFO > DEBUG > NOTSET
-logging.basicConfig(level=logging.INFO)
+# 日志级别、输出位置和请求日志的抽样比例在配置文件的logging里设置，见logsetup.py
 # asyncio 内置了对异步IO的支持
 import asyncio
 # os模块提供了调用操作系统的接口函数
@@ -20,7 +19,13 @@ from aiohttp import web
 # Environment指的是jinjia2模板的配置环境，FileSystemLoader是文件系统加载器，用来加载模板路径
 from jinja2 import Environment, FileSystemLoader
 import orm
+import render
 from coroweb import add_routes, add_static
+from config import configs
+import logsetup
+
+# 要在导入handlers(以及models)之前配置好日志
+logsetup.setup(**configs.logging)
 
 from handlers import cookie2user, COOKIE_NAME
 
@@ -46,7 +51,7 @@ def init_jinja2(app, **kw):
         # os.path.dirname()取绝对目录的路径部分
         # os.path.join(path， name)把目录和名字组合
         path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
-    logging.info('set jinja2 template path: %s' % path)
+    logging.info('set jinja2 template path: %s', path)
     # loader=FileSystemLoader(path)指的是到哪个目录下加载模板文件， **options就是前面的options
     env = Environment(loader=FileSystemLoader(path), **options)
     filters = kw.get('filters', None)  # fillters=>过滤器
@@ -55,12 +60,16 @@ def init_jinja2(app, **kw):
             env.filters[name] = f  # 在env中添加过滤器
     app['__templating__'] = env  # 前面已经把jinjia2的环境配置都赋值给env了，这里再把env存入app的dict中，这样app就知道要去哪找模板，怎么解析模板
 
-# 这个函数的作用就是当http请求的时候，通过logging.info输出请求的信息，其中包括请求的方法和路径
+# 这个函数的作用就是当http请求的时候，输出请求的信息，其中包括请求的方法、路径和处理用时
+# 只记录抽样到的请求(见logsetup.sample_request)，没抽到的请求不做任何额外的事情
 async def logger_factory(app, handler):
     async def logger(request):
-        logging.info('Request: %s %s' % (request.method, request.path))
-        # await asyncio.sleep(0.3)
-        return (await handler(request))
+        if not logsetup.sample_request():
+            return (await handler(request))
+        start = time.time()
+        r = await handler(request)
+        logsetup.request_logger.info('%s %s (%.1fms)', request.method, request.path, (time.time() - start) * 1000)
+        return r
     return logger
 
 # 这个函数在day10中定义
@@ -70,13 +79,13 @@ async def logger_factory(app, handler):
 def auth_factory(app, handler):
     @asyncio.coroutine
     def auth(request):
-        logging.info('check user: %s %s' % (request.method, request.path))
+        logging.debug('check user: %s %s', request.method, request.path)
         request.__user__ = None  # 先把请求的__user__属性绑定None
         cookie_str = request.cookies.get(COOKIE_NAME)  # 通过cookie名取得加密cookie字符串，COOKIE_NAME是在headlers模块中定义的
         if cookie_str:
             user = yield from cookie2user(cookie_str)  # 验证cookie，并得到用户信息
             if user:
-                logging.info('set current user: %s' % user.email)
+                logging.debug('set current user: %s', user.email)
                 request.__user__ = user  # 将用户信息绑定到请求上
         # 如果请求路径是管理页面，但是用户不是管理员，将重定向到登陆页面
         if request.path.startswith('/manage/') and (request.__user__ is None or not request.__user__.admin):
@@ -90,16 +99,16 @@ async def data_factory(app, handler):
         if request.method == 'POST':
             if request.content_type.startswith('application/json'):
                 request.__data__ = await request.json()
-                logging.info('request json: %s' % str(request.__data__))
+                logging.debug('request json: %s', request.__data__)
             elif request.content_type.startswith('application/x-www-form-urlencoded'):
                 request.__data__ = await request.post()
-                logging.info('request form: %s' % str(request.__data__))
+                logging.debug('request form: %s', request.__data__)
         return (await handler(request))
     return parse_data
 
 async def response_factory(app, handler):
     async def response(request):
-        logging.info('Response handler...')
+        logging.debug('Response handler...')
         r = await handler(request)
         # 如果相应结果为StreamResponse，直接返回
         # #treamResponse是aiohttp定义response的基类,即所有响应类型都继承自该类
@@ -125,7 +134,8 @@ async def response_factory(app, handler):
             template = r.get('__template__')
             # 若不存在对应模板，则将字典调整为json格式返回，并设置响应类型为json
             if template is None:
-                resp = web.Response(body=json.dumps(r, ensure_ascii=False, default=lambda o: o.__dict__).encode('utf-8'))
+                # ModelRow这类用__slots__的对象没有__dict__，用它们的to_dict()
+                resp = web.Response(body=json.dumps(r, ensure_ascii=False, default=lambda o: o.to_dict() if hasattr(o, 'to_dict') else o.__dict__).encode('utf-8'))
                 resp.content_type = 'application/json;charset=utf-8'
                 return resp
             else:
@@ -169,8 +179,16 @@ def datetime_filter(t):
 
 # 调用asyncio实现异步IO
 async def init(loop):
-    # 创建数据库连接池
-    await orm.create_pool(loop=loop, host='127.0.0.1', port=3306, user='www', password='www', db='awesome')
+    # 创建数据库连接池，配置了从库时同时创建从库的连接池
+    await orm.create_pool(loop=loop, **configs.db)
+    # 统计每种SQL的耗时，记录慢查询
+    orm.init_query_stats(**configs.query_stats)
+    # 创建查询结果缓存，只有传了cache参数的查询才会使用
+    orm.init_cache(**configs.query_cache)
+    # 记录各个表的行数，首页和分页接口不用每次都count(*)整张表
+    orm.init_counts(loop, **configs.row_counts)
+    # 创建markdown渲染进程池，避免渲染长文章时阻塞事件循环
+    render.init_service(loop, **configs.render)
     # 创建app对象，同时传入上文定义的拦截器middlewares
     app = web.Application(loop=loop, middlewares=[
         logger_factory, auth_factory, response_factory
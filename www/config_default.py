@@ -13,9 +13,45 @@ configs = {
         'port': 3306,
         'user': 'www',
         'password': 'www',
-        'db': 'awesome'
+        'db': 'awesome',
+        # 从库列表，读请求按weight分配到健康的从库，没有写的参数和主库一样，比如：
+        #   [{'host': '10.0.0.2', 'weight': 2}, {'host': '10.0.0.3'}]
+        'replicas': [],
+        'health_interval': 5.0,  # 每隔多少秒检查一次从库是否可用
+        'acquire_timeout': None,  # 从连接池取连接最多等待多少秒，None表示一直等
+        # 根据取连接的等待时间自动调整最大连接数，None表示不调整，比如：
+        #   {'min_size': 5, 'max_size': 50, 'target_wait_ms': 5.0, 'interval': 10.0}
+        'autosize': None,
+        'warmup': 5,  # 启动时预先打开的连接数，0表示不预热
+        'warmup_query': 'select 1'  # 预热时检查连接是否可用的语句
+    },
+    'logging': {
+        'level': 'WARNING',  # 日志级别，调试时可以改成'INFO'或'DEBUG'
+        'queued': True,  # 在后台线程里格式化和写日志，不阻塞事件循环
+        'filename': None,  # 日志文件，None表示输出到stderr
+        'request_sample': 0.01  # 记录多少比例的请求(0到1)，不受level影响
     },
     'session': {
         'secret': 'Awesome'
+    },
+    'render': {
+        'workers': 2,  # markdown渲染进程池的进程数
+        'inline_threshold': 16384,  # 短于这个字符数的正文直接在事件循环里渲染
+        'timeout': 5.0,  # 进程池渲染超时(秒)，超时后降级为纯文本
+        'slow_ms': 200  # 渲染超过这个毫秒数时记录各阶段耗时，None表示不记录
+    },
+    'query_cache': {
+        'backend': 'memory',  # 查询结果缓存：'memory'为进程内缓存，'socket'为多个进程共享的缓存服务器，None表示不缓存
+        'socket': '/tmp/awesome-orm-cache.sock',  # 缓存服务器的unix socket，用python3 ormcache.py --socket ...启动
+        'max_entries': 1024,  # 进程内缓存最多保存的查询数
+        'ttl': 5.0  # 缓存的默认过期时间(秒)
+    },
+    'query_stats': {
+        'slow_ms': 100,  # 执行时间超过这个毫秒数的SQL记录到慢查询日志，None表示不记录
+        'explain': False  # 是否对慢的select语句执行EXPLAIN并记录到日志
+    },
+    'row_counts': {
+        'reconcile_interval': 60.0,  # Model.count()记录的行数每隔多少秒用count(*)校正一次，None表示不校正
+        'max_keys': 256  # 每张表最多记录多少个where条件的行数
     }
 }
@@ -182,7 +182,7 @@ class RequestHandler(object):
             # 若其key即存在于abstract math info又存在于kw中,发出重复参数警告
             for k, v in request.match_info.items():#不懂
                 if k in kw:
-                    logging.warning('Duplicate arg name in named arg and kw args: %s' % k)
+                    logging.warning('Duplicate arg name in named arg and kw args: %s', k)
                 kw[k] = v
 
         # 如果fn的参数有request，则再给kw中加上request的key和值
@@ -201,13 +201,10 @@ class RequestHandler(object):
         
 
         # 以下调用handler处理，并返回response        
-        logging.info('call with args: %s' % str(kw))
+        # 参数里可能有密码，只在DEBUG级别记录
+        logging.debug('call %s with args: %s', self._func.__name__, kw)
         try:
-            print("Aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa")
-            print(self._func)
-            print(self._func.__name__) 
             r = await self._func(**kw)  # 执行handler模块里的函数
-            print(r)
             return r
         except APIError as e:
             return dict(error=e.error, data=e.data, message=e.message)
@@ -221,7 +218,7 @@ def add_static(app):
     path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
     # app = web.Application(loop=loop)这是在app.py模块中定义的
     app.router.add_static('/static/', path)
-    logging.info('add static %s => %s' % ('/static/', path))
+    logging.info('add static %s => %s', '/static/', path)
 
 # 把请求处理函数注册到app
 # 处理将针对http method 和path进行
@@ -234,7 +231,7 @@ def add_route(app, fn):
     # 如果函数fn是不是一个协程或者生成器，就把这个函数编程协程
     if not asyncio.iscoroutinefunction(fn) and not inspect.isgeneratorfunction(fn):
         fn = asyncio.coroutine(fn)
-    logging.info('add route %s %s => %s(%s)' % (method, path, fn.__name__, ', '.join(inspect.signature(fn).parameters.keys())))
+    logging.info('add route %s %s => %s(%s)', method, path, fn.__name__, ', '.join(inspect.signature(fn).parameters.keys()))
     app.router.add_route(method, path, RequestHandler(app, fn))  # 注册request handler
 
 
@@ -6,19 +6,21 @@
 
 import re, time, json, logging, hashlib, base64, asyncio
 
-# markdown2模块是一个支持markdown文本输入的模块，是Trent Mick写的开源模块，我们将其拷贝在本文件夹中，在这里调用
-import markdown2  
+# markdown的渲染放在render模块中，渲染好的html会和博客一起保存到数据库
+import render
+import orm
 
 from aiohttp import web
 
 from coroweb import get, post
-from apis import APIValueError, APIResourceNotFoundError, APIError, APIPermissionError, Page
+from apis import APIValueError, APIResourceNotFoundError, APIError, APIPermissionError, Page, CursorPage
 
 from models import User, Comment, Blog, next_id
 from config import configs
 
 COOKIE_NAME = 'awesession'  # cookie名，用于设置cookie
 _COOKIE_KEY = configs.session.secret  # cookie密钥，作为加密cookie的原始字符串的一部分
+LIST_DEFERRED = ('content', 'html_content')  # 博客列表只显示标题和摘要，不需要查询正文
 
 
 # 这个函数在day11被定义
@@ -105,20 +107,41 @@ def cookie2user(cookie_str):
         logging.exception(e)
         return None
 
+# 把get_blog里重新渲染的html写回数据库
+# 渲染可能要等好几秒，这期间博客可能被修改过，所以只写html_content和content_hash两列，
+# 并且只在数据库里的content_hash还是渲染前的值时才写(<=>在两边都是NULL时也成立)，不会用读到的旧标题、摘要、正文覆盖新的修改
+@asyncio.coroutine
+def save_rendered_html(blog, old_hash):
+    rows = yield from orm.execute('update `%s` set `html_content`=?, `content_hash`=? where `%s`=? and `content_hash`<=>?' % (Blog.__table__, Blog.__primary_key__),
+                                  [blog.html_content, blog.content_hash, blog.id, old_hash])
+    if rows:
+        yield from orm.invalidate_cache(Blog.__table__)
+
 # ----------------------------------页面定义区--------------------------------
 
 # day14中定义
 # 页面：首页
 @get('/')
 @asyncio.coroutine
-def index(*, page='1'):
+def index(*, page=None, cursor=None):
+    # 首页的查询每秒会重复很多次，都走查询结果缓存，博客被修改时缓存会自动失效
+    if page is None:
+        # 默认按游标翻页，翻得再深也只需要读一页的数据，也不用count
+        # 带page参数时(比如以前的链接/?page=3)仍然按页码翻页
+        page = CursorPage(cursor)
+        blogs = page.paginate((yield from Blog.findAll(seek=page.seek, limit=page.limit, defer=LIST_DEFERRED, compact=True, cache=True)))
+        return {
+            '__template__': 'blogs.html',
+            'page': page,
+            'blogs': blogs
+        }
     page_index = get_page_index(page)
-    num = yield from Blog.findNumber('count(id)')
+    num = yield from Blog.count()
     page = Page(num, page_index)
     if num == 0:
         blogs = []
     else:
-        blogs = yield from Blog.findAll(orderBy='created_at desc', limit=(page.offset, page.limit))
+        blogs = yield from Blog.findAll(orderBy='created_at desc', limit=(page.offset, page.limit), defer=LIST_DEFERRED, compact=True, cache=True)
     # 返回一个模板，指示使用何种模板，模板的内容
     # app.py的response_factory将会对handler.py的返回值进行分类处理
     return {
@@ -139,8 +162,12 @@ def get_blog(id, request):
     # 将每条评论都转化成html格式
     for c in comments:
         c.html_content = text2html(c.content)
-    # blog也是markdown格式，将其转化成html格式
-    blog.html_content = markdown2.markdown(blog.content)
+    # blog的html在创建和修改时就已经渲染好了，这里直接使用
+    # 只有老数据或者渲染器升级后hash对不上时才重新渲染，并顺便写回数据库
+    if render.is_stale(blog):
+        old_hash = blog.content_hash
+        yield from render.render_blog(blog)
+        yield from save_rendered_html(blog, old_hash)
     return {
         '__template__': 'blog.html',
         'blog': blog,
@@ -198,10 +225,11 @@ def manage():
 # day14定义
 # 页面：评论列表页
 @get('/manage/comments')
-def manage_comments(*, page='1'):
+def manage_comments(*, cursor=''):
+    # 评论很多，管理页面用游标翻页，避免翻到后面的页时limit的偏移量越来越大
     return {
         '__template__': 'manage_comments.html',
-        'page_index': get_page_index(page)
+        'cursor': cursor
     }
 
 # day14定义
@@ -370,6 +398,7 @@ def api_create_blog(request, *, name, summary, content):
         raise APIValueError('content', 'content cannot be empty.')
     # 创建博客对象
     blog = Blog(user_id=request.__user__.id, user_name=request.__user__.name, user_image=request.__user__.image, name=name.strip(), summary=summary.strip(), content=content.strip())
+    yield from render.render_blog(blog)  # 保存前渲染好html
     yield from blog.save()  # 储存博客到数据库中
     return blog  # 返回博客信息
 
@@ -378,32 +407,58 @@ def api_create_blog(request, *, name, summary, content):
 # API:获取博客
 @get('/api/blogs')
 @asyncio.coroutine
-def api_blogs(*, page='1'):
+# 传入cursor参数(第一页传空字符串)时按游标翻页，返回的page是CursorPage，用next_cursor和prev_cursor翻页
+def api_blogs(*, page='1', cursor=None):
+    if cursor is not None:
+        p = CursorPage(cursor)
+        blogs = p.paginate((yield from Blog.findAll(seek=p.seek, limit=p.limit, defer=LIST_DEFERRED, compact=True, cache=True)))
+        return dict(page=p, blogs=blogs)
     page_index = get_page_index(page)
-    num = yield from Blog.findNumber('count(id)') # num为博客总数
+    num = yield from Blog.count() # num为博客总数
     p = Page(num, page_index)  # 创建Page对象（Page对象在apis.py中定义）
     if num == 0:
         return dict(page=p, blogs=())  # 若博客数为0,返回字典,将被app.py的response中间件再处理
     # 博客总数不为0,则从数据库中抓取博客
     # limit强制select语句返回指定的记录数,前一个参数为偏移量,后一个参数为记录的最大数目
-    blogs = yield from Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
+    blogs = yield from Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit), defer=LIST_DEFERRED, compact=True, cache=True)
     return dict(page=p, blogs=blogs)  # 返回字典,以供response中间件处理
 
 # day14定义
 # API：获取评论
 @get('/api/comments')
 @asyncio.coroutine
-def api_comments(*, page='1'):
+# 和api_blogs一样，传入cursor参数时按游标翻页
+def api_comments(*, page='1', cursor=None):
+    if cursor is not None:
+        p = CursorPage(cursor)
+        comments = p.paginate((yield from Comment.findAll(seek=p.seek, limit=p.limit, compact=True)))
+        return dict(page=p, comments=comments)
     page_index = get_page_index(page)
-    num = yield from Comment.findNumber('count(id)')  # num为评论总数
+    num = yield from Comment.count()  # num为评论总数
     p = Page(num, page_index)  # 创建Page对象，保存页面信息
     if num == 0:
         return dict(page=p, comments=())  # 若评论数为零，返回字典，将会被app.py的response中间件再处理
     # 博客总数不为0,则从数据库中抓取博客
     # limit强制select语句返回指定的记录数,前一个参数为偏移量,后一个参数为记录的最大数目
-    comments = yield from Comment.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
+    comments = yield from Comment.findAll(orderBy='created_at desc', limit=(p.offset, p.limit), compact=True)
     return dict(page=p, comments=comments)
 
+# API：运行时的统计信息，只有管理员可以查看
+# pools是每个数据库连接池的连接数、取连接的等待时间、超时次数等，render是markdown渲染进程池的统计信息
+# queries是按指纹统计的每种SQL的执行次数和耗时，按总耗时从高到低排列，limit指定返回多少种
+@get('/api/metrics')
+def api_metrics(request, *, limit='50'):
+    check_admin(request)
+    # 和get_page_index一样，不合法的limit用默认值，不返回500
+    n = 50
+    try:
+        n = int(limit)
+    except ValueError as e:
+        pass
+    if n < 1:
+        n = 50
+    return dict(pools=orm.pool_stats(), render=render.stats(), queries=orm.query_stats(n))
+
 # day14定义
 # API：创建评论
 @post('/api/blogs/{id}/comments')
@@ -454,6 +509,7 @@ def api_update_blog(id, request, *, name, summary, content):
     blog.name = name.strip()
     blog.summary = summary.strip()
     blog.content = content.strip()
+    yield from render.render_blog(blog, incremental=True)  # 正文变了，按块重新渲染html，没改的段落用缓存
     yield from blog.update()  # 更新博客
     return blog  # 返回博客信息
 
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Logging configuration for the web app.
+
+setup() configures the root logger from configs.logging:
+
+    level           level of the root logger, e.g. 'WARNING' in production
+    queued          hand records to a background thread, which formats and
+                    writes them, so a slow terminal or disk never blocks the
+                    event loop
+    filename        write to this file instead of stderr
+    request_sample  fraction of requests logged by the 'request' logger,
+                    independently of the root level (0 disables, 1 logs all)
+'''
+
+import atexit, logging, queue, random
+
+from logging.handlers import QueueHandler, QueueListener
+
+FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# 请求日志单独用一个logger，按request_sample抽样记录
+request_logger = logging.getLogger('request')
+
+_request_sample = 0.0
+_listener = None
+_config = {}  # 上次setup()的参数，setup_worker()在子进程里按同样的配置设置
+
+
+# 和QueueHandler一样，但是不在调用logging的线程里格式化消息，格式化也交给后台线程
+# 队列是进程内的queue.Queue，记录不需要pickle，所以可以直接把record放进队列
+# 注意：参数要在后台线程格式化时才转换成字符串，传给logging的可变对象在那之前不应该再修改
+class _LazyQueueHandler(QueueHandler):
+
+    def prepare(self, record):
+        return record
+
+
+def setup(level='WARNING', queued=True, filename=None, request_sample=0.0, fmt=FORMAT):
+    global _listener, _request_sample, _config
+    _config = dict(level=level, filename=filename, request_sample=request_sample, fmt=fmt)
+    if filename:
+        handler = logging.FileHandler(filename, encoding='utf-8')
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(fmt))
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    _stop_listener()
+    if queued:
+        q = queue.Queue(-1)
+        _listener = QueueListener(q, handler, respect_handler_level=True)
+        _listener.start()
+        root.addHandler(_LazyQueueHandler(q))
+    else:
+        root.addHandler(handler)
+    root.setLevel(level)
+    _request_sample = request_sample
+    if request_sample > 0:
+        request_logger.setLevel(logging.INFO)
+
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# 退出前把队列里剩下的日志写完，只注册一次，停止的是退出时正在用的后台线程
+atexit.register(_stop_listener)
+
+
+# 进程池子进程的initializer
+# 子进程是fork出来的，继承了QueueHandler和进程内的队列，却没有继承写日志的后台线程，
+# 子进程的日志会一直堆在队列里，一条也写不出去，所以子进程按同样的配置改成直接写
+def setup_worker():
+    global _listener
+    _listener = None  # 后台线程是父进程的，子进程里不能stop
+    setup(queued=False, **_config)
+
+
+# 这个请求是否要记录日志，每个请求调用一次
+def sample_request():
+    return _request_sample > 0 and (_request_sample >= 1 or random.random() < _request_sample)
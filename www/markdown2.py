@@ -101,6 +101,10 @@ except ImportError:
 import optparse
 from random import random, randint
 import codecs
+from bisect import bisect_left, bisect_right
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 
 
 #---- Python version compat
@@ -140,8 +144,13 @@ DEFAULT_TAB_WIDTH = 4
 
 
 SECRET_SALT = bytes(randint(0, 1000000))
+# On Python 3 `bytes(n)` is n zero bytes, so the salt can be up to a megabyte
+# long. Hash it once and start every digest from a copy of that state.
+_salted_md5 = md5(SECRET_SALT)
 def _hash_text(s):
-    return 'md5-' + md5(SECRET_SALT + s.encode("utf-8")).hexdigest()
+    h = _salted_md5.copy()
+    h.update(s.encode("utf-8"))
+    return 'md5-' + h.hexdigest()
 
 # Table of hash values for escaped characters:
 g_escape_table = dict([(ch, _hash_text(ch))
@@ -156,6 +165,229 @@ class MarkdownError(Exception):
 
 
 
+#---- render cache
+
+class RenderCache(object):
+    """A bounded, thread-safe LRU cache of converted HTML.
+
+    Keys are digests of the input text plus every option that affects the
+    output (see `Markdown._render_cache_key()`). Least recently used
+    entries are evicted once the cache holds more than `max_entries`
+    entries or more than `max_bytes` bytes of (UTF-8 encoded) HTML.
+    Results larger than `max_bytes` on their own are not cached at all.
+
+    `hits` and `misses` count lookups; `stats()` returns a snapshot.
+    """
+    def __init__(self, max_entries=512, max_bytes=32*1024*1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()   # key -> (value, nbytes)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        # Neither counted as a lookup nor marking the entry as used.
+        return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            try:
+                entry = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries[key] = entry  # mark as most recently used
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        nbytes = len(value.encode("utf-8"))
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (value, nbytes)
+            self.size += nbytes
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or self.size > self.max_bytes):
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self.size -= evicted_nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": lookups and float(self.hits) / lookups or 0.0,
+            }
+
+# The process-wide cache used by `Markdown.convert()` (and therefore by
+# `markdown()`). Disable it by setting `Markdown.render_cache = None`, or
+# on a subclass or instance.
+render_cache = RenderCache()
+
+
+
+#---- syntax highlighting
+
+# Highlighted code blocks, keyed by a digest of the lexer, the formatter
+# options and the code, so a snippet repeated in a post or across posts
+# is highlighted once. Disable it by setting
+# `Markdown.highlight_cache = None`.
+highlight_cache = RenderCache(max_entries=1024, max_bytes=8*1024*1024)
+
+# Pygments lexers by name and formatters by options, shared by all
+# instances. Both are only read while highlighting.
+_pygments_lexers = {}
+_pygments_formatters = {}
+
+_HtmlCodeFormatter = None
+
+def _html_code_formatter_class():
+    global _HtmlCodeFormatter
+    if _HtmlCodeFormatter is not None:
+        return _HtmlCodeFormatter
+    import pygments.formatters
+
+    class HtmlCodeFormatter(pygments.formatters.HtmlFormatter):
+        def _wrap_code(self, inner):
+            """A function for use in a Pygments Formatter which
+            wraps in <code> tags.
+            """
+            yield 0, "<code>"
+            for tup in inner:
+                yield tup
+            yield 0, "</code>"
+
+        def wrap(self, source, outfile=None):
+            """Return the source with a code, pre, and div."""
+            # Older Pygments call `wrap(source, outfile)` and expect the
+            # div to be added here; newer ones call `wrap(source)` and add
+            # the div themselves.
+            if outfile is None:
+                return self._wrap_pre(self._wrap_code(source))
+            return self._wrap_div(self._wrap_pre(self._wrap_code(source)))
+
+    _HtmlCodeFormatter = HtmlCodeFormatter
+    return HtmlCodeFormatter
+
+
+
+#---- profiling
+
+try:
+    from time import perf_counter as _timer
+except ImportError:  # Python 2
+    from time import time as _timer
+
+class ConvertProfile(object):
+    """Where the time of one `Markdown.convert()` call went.
+
+    `stages` is a list of `(name, seconds, in_chars, out_chars)`, one per
+    pass of the conversion, in order. Passes are named after the method
+    doing them (e.g. "_run_block_gamut"); the passes done by a single
+    regex substitution in `convert()` get a plain name ("line_endings",
+    "ws_only_lines", "nofollow").
+    """
+    def __init__(self, in_chars):
+        self.in_chars = in_chars
+        self.out_chars = 0
+        self.seconds = 0.0
+        self.stages = []
+
+    def slowest(self):
+        return max(self.stages, key=lambda stage: stage[1])
+
+    def __str__(self):
+        return "%d -> %d chars in %.1fms: %s" % (
+            self.in_chars, self.out_chars, self.seconds * 1000,
+            ", ".join("%s %.1fms" % (name, seconds * 1000)
+                      for name, seconds, _, _ in self.stages))
+
+class ProfileLogger(object):
+    """A profile sink logging conversions that took `threshold` seconds or
+    longer, with the time of each pass.
+    """
+    def __init__(self, threshold=0.0, logger=None, level=logging.INFO):
+        self.threshold = threshold
+        self.logger = logger or log
+        self.level = level
+
+    def __call__(self, profile):
+        if profile.seconds >= self.threshold:
+            name, seconds, _, _ = profile.slowest()
+            self.logger.log(self.level, "slow conversion (mostly %s, %.1fms): %s",
+                            name, seconds * 1000, profile)
+
+class ProfileHistogram(object):
+    """A profile sink keeping, in memory, a histogram of the time of each
+    pass (and of whole conversions, as "convert") plus the characters in
+    and out of it. Bucket bounds are in seconds; thread-safe.
+    """
+    bounds = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+    def __init__(self, bounds=None):
+        if bounds is not None:
+            self.bounds = tuple(bounds)
+        self._stages = OrderedDict()    # name -> [count, seconds, max, in, out, buckets]
+        self._lock = threading.Lock()
+
+    def __call__(self, profile):
+        with self._lock:
+            for stage in profile.stages:
+                self._add(*stage)
+            self._add("convert", profile.seconds, profile.in_chars,
+                      profile.out_chars)
+
+    def _add(self, name, seconds, in_chars, out_chars):
+        entry = self._stages.get(name)
+        if entry is None:
+            entry = self._stages[name] = [0, 0.0, 0.0, 0, 0,
+                                          [0] * (len(self.bounds) + 1)]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        entry[3] += in_chars
+        entry[4] += out_chars
+        entry[5][bisect_left(self.bounds, seconds)] += 1
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+
+    def stats(self):
+        """A snapshot: stage name -> dict of `count`, `seconds` (total),
+        `max`, `in_chars`, `out_chars` and `buckets`, a list of
+        `(upper bound, count)` with None as the bound of the last bucket.
+        """
+        with self._lock:
+            return OrderedDict(
+                (name, {"count": count, "seconds": seconds, "max": max_,
+                        "in_chars": in_chars, "out_chars": out_chars,
+                        "buckets": list(zip(self.bounds + (None,), buckets))})
+                for name, (count, seconds, max_, in_chars, out_chars, buckets)
+                in self._stages.items())
+
+
+
 #---- public api
 
 def markdown_path(path, encoding="utf-8",
@@ -165,18 +397,18 @@ def markdown_path(path, encoding="utf-8",
     fp = codecs.open(path, 'r', encoding)
     text = fp.read()
     fp.close()
-    return Markdown(html4tags=html4tags, tab_width=tab_width,
-                    safe_mode=safe_mode, extras=extras,
-                    link_patterns=link_patterns,
-                    use_file_vars=use_file_vars).convert(text)
+    return converter_pool.convert(text, html4tags=html4tags,
+                                  tab_width=tab_width, safe_mode=safe_mode,
+                                  extras=extras, link_patterns=link_patterns,
+                                  use_file_vars=use_file_vars)
 
 def markdown(text, html4tags=False, tab_width=DEFAULT_TAB_WIDTH,
              safe_mode=None, extras=None, link_patterns=None,
              use_file_vars=False):
-    return Markdown(html4tags=html4tags, tab_width=tab_width,
-                    safe_mode=safe_mode, extras=extras,
-                    link_patterns=link_patterns,
-                    use_file_vars=use_file_vars).convert(text)
+    return converter_pool.convert(text, html4tags=html4tags,
+                                  tab_width=tab_width, safe_mode=safe_mode,
+                                  extras=extras, link_patterns=link_patterns,
+                                  use_file_vars=use_file_vars)
 
 class Markdown(object):
     # The dict of "extras" to enable in processing -- a mapping of
@@ -199,6 +431,19 @@ class Markdown(object):
 
     _ws_only_line_re = re.compile(r"^[ \t]+$", re.M)
 
+    # Cache of converted HTML shared by all instances (see `RenderCache`).
+    render_cache = render_cache
+
+    # Sink for per-pass timings: a callable that gets a `ConvertProfile`
+    # after every conversion, e.g. `ProfileLogger` or `ProfileHistogram`.
+    # Off (None) by default; conversions served from the render cache
+    # aren't profiled.
+    profiler = None
+    _profile = None     # the `ConvertProfile` being recorded
+
+    # Cache of pygments-highlighted code blocks (see `highlight_cache`).
+    highlight_cache = highlight_cache
+
     def __init__(self, html4tags=False, tab_width=4, safe_mode=None,
                  extras=None, link_patterns=None, use_file_vars=False):
         if html4tags:
@@ -231,27 +476,53 @@ class Markdown(object):
 
         self.link_patterns = link_patterns
         self.use_file_vars = use_file_vars
-        self._outdent_re = re.compile(r'^(\t|[ ]{1,%d})' % tab_width, re.M)
+        self._outdent_re = _outdent_re_from_tab_width(tab_width)
 
         self._escape_table = g_escape_table.copy()
         if "smarty-pants" in self.extras:
             self._escape_table['"'] = _hash_text('"')
             self._escape_table["'"] = _hash_text("'")
+        self._char_from_hash = dict((h, ch)
+            for ch, h in self._escape_table.items())
+        self._code_table = {}  # hash -> encoded code span/block text
+
+        # Everything besides the text that can change the output. The class
+        # is included because subclasses may override pre/postprocess().
+        self._render_cache_config = repr((
+            self.__class__.__module__, self.__class__.__name__,
+            self.empty_element_suffix, self.tab_width, self.safe_mode,
+            sorted(self._instance_extras.items()), self.link_patterns,
+            self.use_file_vars))
 
     def reset(self):
-        self.urls = {}
-        self.titles = {}
-        self.html_blocks = {}
-        self.html_spans = {}
+        # The per-document dicts are emptied in place rather than rebuilt so
+        # that re-using a converter (see `MarkdownPool`) stays cheap. Only
+        # the objects that escape into the returned value (`metadata` and
+        # the TOC list) have to be fresh each time.
+        for name in ("urls", "titles", "html_blocks", "html_spans"):
+            d = getattr(self, name)
+            if d is None:
+                setattr(self, name, {})
+            elif d:
+                d.clear()
         self.list_level = 0
-        self.extras = self._instance_extras.copy()
+        if self.extras != self._instance_extras:
+            self.extras = self._instance_extras.copy()
         if "footnotes" in self.extras:
-            self.footnotes = {}
-            self.footnote_ids = []
+            if getattr(self, "footnotes", None) is None:
+                self.footnotes = {}
+                self.footnote_ids = []
+            else:
+                self.footnotes.clear()
+                del self.footnote_ids[:]
         if "header-ids" in self.extras:
             self._count_from_header_id = {} # no `defaultdict` in Python 2.4
         if "metadata" in self.extras:
             self.metadata = {}
+        self._toc = None
+        self._html_comment_scan_stopped = False
+        if self._code_table:
+            self._code_table.clear()
 
     # Per <https://developer.mozilla.org/en-US/docs/HTML/Element/a> "rel"
     # should only be used in <a> tags with an "href" attribute.
@@ -259,6 +530,52 @@ class Markdown(object):
 
     def convert(self, text):
         """Convert the given text."""
+        if not isinstance(text, unicode):
+            #TODO: perhaps shouldn't presume UTF-8 for string input?
+            text = unicode(text, 'utf-8')
+
+        cache = self.render_cache
+        if cache is None:
+            return self._profiled_convert(text)
+        key = self._render_cache_key(text)
+        html = cache.get(key)
+        if html is None:
+            html = self._profiled_convert(text)
+            cache.set(key, html)
+        return html
+
+    def _profiled_convert(self, text):
+        profiler = self.profiler
+        if profiler is None:
+            self._profile = None
+            return self._convert(text)
+        self._profile = profile = ConvertProfile(len(text))
+        start = _timer()
+        try:
+            html = self._convert(text)
+        finally:
+            self._profile = None
+        profile.seconds = _timer() - start
+        profile.out_chars = len(html)
+        profiler(profile)
+        return html
+
+    def _stage(self, name, func, text, *args):
+        """Run one pass of `_convert()`, `func(text, *args)`, timing it if
+        profiling."""
+        profile = self._profile
+        if profile is None:
+            return func(text, *args)
+        start = _timer()
+        out = func(text, *args)
+        profile.stages.append((name, _timer() - start, len(text), len(out)))
+        return out
+
+    def _render_cache_key(self, text):
+        return md5((self._render_cache_config + "\0" + text)
+                   .encode("utf-8")).hexdigest()
+
+    def _convert(self, text):
         # Main function. The order in which other subs are called here is
         # essential. Link and image substitutions need to happen before
         # _EscapeSpecialChars(), so that any *'s or _'s in the <a>
@@ -270,10 +587,6 @@ class Markdown(object):
         # articles):
         self.reset()
 
-        if not isinstance(text, unicode):
-            #TODO: perhaps shouldn't presume UTF-8 for string input?
-            text = unicode(text, 'utf-8')
-
         if self.use_file_vars:
             # Look for emacs-style file variable hints.
             emacs_vars = self._get_emacs_vars(text)
@@ -291,60 +604,68 @@ class Markdown(object):
                     self.extras[ename] = earg
 
         # Standardize line endings:
-        text = re.sub("\r\n|\r", "\n", text)
+        text = self._stage("line_endings",
+                           lambda text: re.sub("\r\n|\r", "\n", text), text)
 
         # Make sure $text ends with a couple of newlines:
         text += "\n\n"
 
         # Convert all tabs to spaces.
-        text = self._detab(text)
+        text = self._stage("_detab", self._detab, text)
 
         # Strip any lines consisting only of spaces and tabs.
         # This makes subsequent regexen easier to write, because we can
         # match consecutive blank lines with /\n+/ instead of something
         # contorted like /[ \t]*\n+/ .
-        text = self._ws_only_line_re.sub("", text)
+        text = self._stage("ws_only_lines",
+                           lambda text: self._ws_only_line_re.sub("", text), text)
 
         # strip metadata from head and extract
         if "metadata" in self.extras:
-            text = self._extract_metadata(text)
+            text = self._stage("_extract_metadata", self._extract_metadata, text)
 
-        text = self.preprocess(text)
+        text = self._stage("preprocess", self.preprocess, text)
 
         if "fenced-code-blocks" in self.extras and not self.safe_mode:
-            text = self._do_fenced_code_blocks(text)
+            text = self._stage("_do_fenced_code_blocks",
+                               self._do_fenced_code_blocks, text)
 
         if self.safe_mode:
-            text = self._hash_html_spans(text)
+            text = self._stage("_hash_html_spans", self._hash_html_spans, text)
 
         # Turn block-level HTML blocks into hash entries
-        text = self._hash_html_blocks(text, raw=True)
+        text = self._stage("_hash_html_blocks", self._hash_html_blocks, text, True)
 
         if "fenced-code-blocks" in self.extras and self.safe_mode:
-            text = self._do_fenced_code_blocks(text)
+            text = self._stage("_do_fenced_code_blocks",
+                               self._do_fenced_code_blocks, text)
 
         # Strip link definitions, store in hashes.
         if "footnotes" in self.extras:
             # Must do footnotes first because an unlucky footnote defn
             # looks like a link defn:
             #   [^4]: this "looks like a link defn"
-            text = self._strip_footnote_definitions(text)
-        text = self._strip_link_definitions(text)
+            text = self._stage("_strip_footnote_definitions",
+                               self._strip_footnote_definitions, text)
+        text = self._stage("_strip_link_definitions",
+                           self._strip_link_definitions, text)
 
-        text = self._run_block_gamut(text)
+        text = self._stage("_run_block_gamut", self._run_block_gamut, text)
 
         if "footnotes" in self.extras:
-            text = self._add_footnotes(text)
+            text = self._stage("_add_footnotes", self._add_footnotes, text)
 
-        text = self.postprocess(text)
+        text = self._stage("postprocess", self.postprocess, text)
 
-        text = self._unescape_special_chars(text)
+        text = self._stage("_unescape_special_chars",
+                           self._unescape_special_chars, text)
 
         if self.safe_mode:
-            text = self._unhash_html_spans(text)
+            text = self._stage("_unhash_html_spans", self._unhash_html_spans, text)
 
         if "nofollow" in self.extras:
-            text = self._a_nofollow.sub(r'<\1 rel="nofollow"\2', text)
+            text = self._stage("nofollow", lambda text: self._a_nofollow.sub(
+                r'<\1 rel="nofollow"\2', text), text)
 
         text += "\n"
 
@@ -572,6 +893,57 @@ class Markdown(object):
         """ % _block_tags_b,
         re.X | re.M)
 
+    # Cheap pre-scans for `_hash_html_blocks`. An opener with no possible
+    # closer after it makes the regexes above scan to the end of the text
+    # before failing, so openers are only tried when a closer exists.
+    _strict_tag_block_opener_re = re.compile(r"^<(%s)\b" % _block_tags_a, re.M)
+    _strict_tag_block_closer_re = re.compile(
+        r"</(%s)>[ \t]*(?=\n|\Z)" % _block_tags_a)
+    _liberal_tag_block_opener_re = re.compile(r"^<(%s)\b" % _block_tags_b, re.M)
+    _liberal_tag_block_closer_re = re.compile(
+        r"</(%s)>[ \t]*(?=\n|\Z)" % _block_tags_b)
+
+    def _sub_tag_blocks(self, block_re, opener_re, closer_re, repl, text,
+                        strict=False):
+        """Equivalent to `block_re.sub(repl, text)` for the tag block regexes.
+
+        `block_re` is only tried at an opener for which a matching closer is
+        known to exist, and it then always matches, so each character is
+        scanned a bounded number of times. The strict regex wants its end
+        tag at the start of a line (or right after the start tag name).
+        """
+        closers = {}
+        for match in closer_re.finditer(text):
+            start = match.start()
+            if strict and start and text[start-1] != '\n':
+                continue
+            closers.setdefault(match.group(1), []).append(start)
+        pieces = []
+        pos = 0
+        for match in opener_re.finditer(text):
+            start = match.start()
+            if start < pos:
+                continue
+            tag = match.group(1)
+            positions = closers.get(tag)
+            if strict:
+                if not (positions and positions[-1] > start):
+                    inline = closer_re.match(text, match.end())
+                    if inline is None or inline.group(1) != tag:
+                        continue
+            elif not (positions and positions[-1] >= match.end()):
+                continue
+            block = block_re.match(text, start)
+            if block is None:
+                continue
+            pieces.append(text[pos:start])
+            pieces.append(repl(block))
+            pos = block.end()
+        if not pieces:
+            return text
+        pieces.append(text[pos:])
+        return ''.join(pieces)
+
     _html_markdown_attr_re = re.compile(
         r'''\s+markdown=("1"|'1')''')
     def _hash_html_block_sub(self, match, raw=False):
@@ -626,10 +998,14 @@ class Markdown(object):
         # the inner nested divs must be indented.
         # We need to do this before the next, more liberal match, because the next
         # match will start at the first `<div>` and stop at the first `</div>`.
-        text = self._strict_tag_block_re.sub(hash_html_block_sub, text)
+        text = self._sub_tag_blocks(self._strict_tag_block_re,
+            self._strict_tag_block_opener_re, self._strict_tag_block_closer_re,
+            hash_html_block_sub, text, strict=True)
 
         # Now match more liberally, simply from `\n<tag>` to `</tag>\n`
-        text = self._liberal_tag_block_re.sub(hash_html_block_sub, text)
+        text = self._sub_tag_blocks(self._liberal_tag_block_re,
+            self._liberal_tag_block_opener_re,
+            self._liberal_tag_block_closer_re, hash_html_block_sub, text)
 
         # Special case just for <hr />. It was easier to make a special
         # case than to make the other regex more complicated.
@@ -672,6 +1048,9 @@ class Markdown(object):
                     elif text[start_idx-2:start_idx] == '\n\n':
                         pass
                     else:
+                        # Later comments are left alone too (see
+                        # `BlockRenderer.split()`).
+                        self._html_comment_scan_stopped = True
                         break
 
                 # Validate whitespace after comment.
@@ -708,28 +1087,10 @@ class Markdown(object):
     def _strip_link_definitions(self, text):
         # Strips link definitions from text, stores the URLs and titles in
         # hash references.
-        less_than_tab = self.tab_width - 1
 
         # Link defs are in the form:
         #   [id]: url "optional title"
-        _link_def_re = re.compile(r"""
-            ^[ ]{0,%d}\[(.+)\]: # id = \1
-              [ \t]*
-              \n?               # maybe *one* newline
-              [ \t]*
-            <?(.+?)>?           # url = \2
-              [ \t]*
-            (?:
-                \n?             # maybe one newline
-                [ \t]*
-                (?<=\s)         # lookbehind for whitespace
-                ['"(]
-                ([^\n]*)        # title = \3
-                ['")]
-                [ \t]*
-            )?  # title is optional
-            (?:\n+|\Z)
-            """ % less_than_tab, re.X | re.M | re.U)
+        _link_def_re = _link_def_re_from_tab_width(self.tab_width)
         return _link_def_re.sub(self._extract_link_def_sub, text)
 
     def _extract_link_def_sub(self, match):
@@ -764,22 +1125,7 @@ class Markdown(object):
             [^note-id]:
                 Text of the note.
         """
-        less_than_tab = self.tab_width - 1
-        footnote_def_re = re.compile(r'''
-            ^[ ]{0,%d}\[\^(.+)\]:   # id = \1
-            [ \t]*
-            (                       # footnote text = \2
-              # First line need not start with the spaces.
-              (?:\s*.*\n+)
-              (?:
-                (?:[ ]{%d} | \t)  # Subsequent lines must be indented.
-                .*\n+
-              )*
-            )
-            # Lookahead for non-space at line-start, or end of doc.
-            (?:(?=^[ ]{0,%d}\S)|\Z)
-            ''' % (less_than_tab, self.tab_width, self.tab_width),
-            re.X | re.M)
+        footnote_def_re = _footnote_def_re_from_tab_width(self.tab_width)
         return footnote_def_re.sub(self._extract_footnote_def_sub, text)
 
     _hr_re = re.compile(r'^[ ]{0,3}([-_*][ ]{0,2}){3,}$', re.M)
@@ -840,12 +1186,7 @@ class Markdown(object):
         if ">>>" not in text:
             return text
 
-        less_than_tab = self.tab_width - 1
-        _pyshell_block_re = re.compile(r"""
-            ^([ ]{0,%d})>>>[ ].*\n   # first line
-            ^(\1.*\S+.*\n)*         # any number of subsequent lines
-            ^\n                     # ends with a blank line
-            """ % less_than_tab, re.M | re.X)
+        _pyshell_block_re = _pyshell_block_re_from_tab_width(self.tab_width)
 
         return _pyshell_block_re.sub(self._pyshell_block_sub, text)
 
@@ -894,29 +1235,7 @@ class Markdown(object):
         """Copying PHP-Markdown and GFM table syntax. Some regex borrowed from
         https://github.com/michelf/php-markdown/blob/lib/Michelf/Markdown.php#L2538
         """
-        less_than_tab = self.tab_width - 1
-        table_re = re.compile(r'''
-                (?:(?<=\n\n)|\A\n?)             # leading blank line
-
-                ^[ ]{0,%d}                      # allowed whitespace
-                (.*[|].*)  \n                   # $1: header row (at least one pipe)
-
-                ^[ ]{0,%d}                      # allowed whitespace
-                (                               # $2: underline row
-                    # underline row with leading bar
-                    (?:  \|\ *:?-+:?\ *  )+  \|?  \n
-                    |
-                    # or, underline row without leading bar
-                    (?:  \ *:?-+:?\ *\|  )+  (?:  \ *:?-+:?\ *  )?  \n
-                )
-
-                (                               # $3: data rows
-                    (?:
-                        ^[ ]{0,%d}(?!\ )         # ensure line begins with 0 to less_than_tab spaces
-                        .*\|.*  \n
-                    )+
-                )
-            ''' % (less_than_tab, less_than_tab, less_than_tab), re.M | re.X)
+        table_re = _table_re_from_tab_width(self.tab_width)
         return table_re.sub(self._table_sub, text)
 
     def _wiki_table_sub(self, match):
@@ -945,12 +1264,7 @@ class Markdown(object):
         if "||" not in text:
             return text
 
-        less_than_tab = self.tab_width - 1
-        wiki_table_re = re.compile(r'''
-            (?:(?<=\n\n)|\A\n?)            # leading blank line
-            ^([ ]{0,%d})\|\|.+?\|\|[ ]*\n  # first line
-            (^\1\|\|.+?\|\|\n)*        # any number of subsequent lines
-            ''' % less_than_tab, re.M | re.X)
+        wiki_table_re = _wiki_table_re_from_tab_width(self.tab_width)
         return wiki_table_re.sub(self._wiki_table_sub, text)
 
     def _run_span_gamut(self, text):
@@ -1005,6 +1319,20 @@ class Markdown(object):
         )
         """, re.X)
 
+    def _sorta_html_tokenize(self, text):
+        """`_sorta_html_tokenize_re.split(text)`, alternating text and markup.
+
+        Every markup token ends in '>', so only the text up to the last '>'
+        is split. Otherwise each '<' without a '>' after it is retried to
+        the end of the text, which is quadratic for text like "<a <a <a".
+        """
+        end = text.rfind('>') + 1
+        if end == len(text):
+            return self._sorta_html_tokenize_re.split(text)
+        tokens = self._sorta_html_tokenize_re.split(text[:end])
+        tokens[-1] += text[end:]
+        return tokens
+
     def _escape_special_chars(self, text):
         # Python markdown note: the HTML tokenization here differs from
         # that in Markdown.pl, hence the behaviour for subtle cases can
@@ -1014,7 +1342,7 @@ class Markdown(object):
         # here.
         escaped = []
         is_html_markup = False
-        for token in self._sorta_html_tokenize_re.split(text):
+        for token in self._sorta_html_tokenize(text):
             if is_html_markup:
                 # Within tags/HTML-comments/auto-links, encode * and _
                 # so they don't conflict with their use in Markdown for
@@ -1041,7 +1369,7 @@ class Markdown(object):
 
         tokens = []
         is_html_markup = False
-        for token in self._sorta_html_tokenize_re.split(text):
+        for token in self._sorta_html_tokenize(text):
             if is_html_markup and not _is_auto_link(token):
                 sanitized = self._sanitize_html(token)
                 key = _hash_text(sanitized)
@@ -1073,6 +1401,10 @@ class Markdown(object):
             raise MarkdownError("invalid value for 'safe_mode': %r (must be "
                                 "'escape' or 'replace')" % self.safe_mode)
 
+    # `_inline_link_title` is what the tail of an inline link has to match,
+    # anchored at the end of the balanced parentheses. It is no longer run
+    # with `search()`: retrying it from every position is quadratic in the
+    # url length, see `_match_inline_link_title`.
     _inline_link_title = re.compile(r'''
             (                   # \1
               [ \t]+
@@ -1082,6 +1414,10 @@ class Markdown(object):
             )?                  # title is optional
           \)$
         ''', re.X | re.S)
+    _inline_link_title_start = {
+        '"': re.compile(r'[ \t]+"'),
+        "'": re.compile(r"[ \t]+'"),
+    }
     _tail_of_reference_link_re = re.compile(r'''
           # Match tail of: [text][id]
           [ ]?          # one optional space
@@ -1118,21 +1454,46 @@ class Markdown(object):
             i += 1
         return i
 
-    def _extract_url_and_title(self, text, start):
+    def _match_inline_link_title(self, text, start, end):
+        """Same as `_inline_link_title.search(text, start, end)`, returning
+        `(match start, title)` or None.
+
+        The match has to end at `end` (or just before a trailing newline),
+        which pins down the closing paren and quote, so only the position
+        of the title's leading whitespace has to be searched for.
+        """
+        if text[end-1:end] == ')':
+            paren = end - 1
+        elif text[end-1:end] == '\n' and text[end-2:end-1] == ')':
+            paren = end - 2
+        else:
+            return None
+        if paren < start:
+            return None
+        quote = text[paren-1:paren]
+        if quote in self._inline_link_title_start and paren - 1 > start:
+            match = self._inline_link_title_start[quote].search(
+                text, start, paren - 1)
+            if match:
+                return match.start(), text[match.end():paren-1]
+        return paren, None
+
+    def _extract_url_and_title(self, text, start, scanner=None):
         """Extracts the url and (optional) title from the tail of a link"""
         # text[start] equals the opening parenthesis
         idx = self._find_non_whitespace(text, start+1)
         if idx == len(text):
             return None, None, None
+        find_balanced = scanner.find_balanced if scanner else self._find_balanced
         end_idx = idx
         has_anglebrackets = text[idx] == "<"
         if has_anglebrackets:
-            end_idx = self._find_balanced(text, end_idx+1, "<", ">")
-        end_idx = self._find_balanced(text, end_idx, "(", ")")
-        match = self._inline_link_title.search(text, idx, end_idx)
+            end_idx = find_balanced(text, end_idx+1, "<", ">")
+        end_idx = find_balanced(text, end_idx, "(", ")")
+        match = self._match_inline_link_title(text, idx, end_idx)
         if not match:
             return None, None, None
-        url, title = text[idx:match.start()], match.group("title")
+        url, title = text[idx:match[0]], match[1]
         if has_anglebrackets:
             url = self._strip_anglebrackets.sub(r'\1', url)
         return url, title, end_idx
@@ -1153,6 +1514,7 @@ class Markdown(object):
         # pos must be `>= anchor_allowed_pos`.
         anchor_allowed_pos = 0
 
+        scanner = _LinkScanner(text, MAX_LINK_TEXT_SENTINEL)
         curr_pos = 0
         while True: # Handle the next link.
             # The next '[' is the start of:
@@ -1181,17 +1543,8 @@ class Markdown(object):
             # will here too. Markdown.pl *doesn't* currently allow
             # matching brackets in img alt text -- we'll differ in that
             # regard.
-            bracket_depth = 0
-            for p in range(start_idx+1, min(start_idx+MAX_LINK_TEXT_SENTINEL,
-                                            text_length)):
-                ch = text[p]
-                if ch == ']':
-                    bracket_depth -= 1
-                    if bracket_depth < 0:
-                        break
-                elif ch == '[':
-                    bracket_depth += 1
-            else:
+            p = scanner.link_text_end(text, start_idx)
+            if p is None:
                 # Closing bracket not found within sentinel length.
                 # This isn't markup.
                 curr_pos = start_idx + 1
@@ -1206,6 +1559,7 @@ class Markdown(object):
                     result = '<sup class="footnote-ref" id="fnref-%s">' \
                              '<a href="#fn-%s">%s</a></sup>' \
                              % (normed_id, normed_id, len(self.footnote_ids))
+                    scanner.spliced(text, p+1)
                     text = text[:start_idx] + result + text[p+1:]
                 else:
                     # This id isn't defined, leave the markup alone.
@@ -1219,7 +1573,8 @@ class Markdown(object):
 
             # Inline anchor or img?
             if text[p] == '(': # attempt at perf improvement
-                url, title, url_end_idx = self._extract_url_and_title(text, p)
+                url, title, url_end_idx = self._extract_url_and_title(
+                    text, p, scanner)
                 if url is not None:
                     # Handle an inline anchor or img.
                     is_img = start_idx > 0 and text[start_idx-1] == "!"
@@ -1246,6 +1601,7 @@ class Markdown(object):
                         if "smarty-pants" in self.extras:
                             result = result.replace('"', self._escape_table['"'])
                         curr_pos = start_idx + len(result)
+                        scanner.spliced(text, url_end_idx)
                         text = text[:start_idx] + result + text[url_end_idx:]
                     elif start_idx >= anchor_allowed_pos:
                         result_head = '<a href="%s"%s>' % (url, title_str)
@@ -1256,6 +1612,7 @@ class Markdown(object):
                         # anchor_allowed_pos on.
                         curr_pos = start_idx + len(result_head)
                         anchor_allowed_pos = start_idx + len(result)
+                        scanner.spliced(text, url_end_idx)
                         text = text[:start_idx] + result + text[url_end_idx:]
                     else:
                         # Anchor not allowed here.
@@ -1297,6 +1654,7 @@ class Markdown(object):
                             if "smarty-pants" in self.extras:
                                 result = result.replace('"', self._escape_table['"'])
                             curr_pos = start_idx + len(result)
+                            scanner.spliced(text, match.end())
                             text = text[:start_idx] + result + text[match.end():]
                         elif start_idx >= anchor_allowed_pos:
                             result = '<a href="%s"%s>%s</a>' \
@@ -1309,6 +1667,7 @@ class Markdown(object):
                             # anchor_allowed_pos on.
                             curr_pos = start_idx + len(result_head)
                             anchor_allowed_pos = start_idx + len(result)
+                            scanner.spliced(text, match.end())
                             text = text[:start_idx] + result + text[match.end():]
                         else:
                             # Anchor not allowed here.
@@ -1438,33 +1797,8 @@ class Markdown(object):
             # types running into each other (see issue #16).
             hits = []
             for marker_pat in (self._marker_ul, self._marker_ol):
-                less_than_tab = self.tab_width - 1
-                whole_list = r'''
-                    (                   # \1 = whole list
-                      (                 # \2
-                        [ ]{0,%d}
-                        (%s)            # \3 = first list item marker
-                        [ \t]+
-                        (?!\ *\3\ )     # '- - - ...' isn't a list. See 'not_quite_a_list' test case.
-                      )
-                      (?:.+?)
-                      (                 # \4
-                          \Z
-                        |
-                          \n{2,}
-                          (?=\S)
-                          (?!           # Negative lookahead for another list item marker
-                            [ \t]*
-                            %s[ \t]+
-                          )
-                      )
-                    )
-                ''' % (less_than_tab, marker_pat, marker_pat)
-                if self.list_level:  # sub-list
-                    list_re = re.compile("^"+whole_list, re.X | re.M | re.S)
-                else:
-                    list_re = re.compile(r"(?:(?<=\n\n)|\A\n?)"+whole_list,
-                                         re.X | re.M | re.S)
+                list_re = _list_re_from_tab_width(self.tab_width, marker_pat,
+                                                  bool(self.list_level))
                 match = list_re.search(text, pos)
                 if match:
                     hits.append((match.start(), match))
@@ -1537,36 +1871,43 @@ class Markdown(object):
         return list_str
 
     def _get_pygments_lexer(self, lexer_name):
+        # Lexers are looked up once per name (misses included) and reused.
+        try:
+            return _pygments_lexers[lexer_name]
+        except KeyError:
+            pass
         try:
             from pygments import lexers, util
         except ImportError:
             return None
         try:
-            return lexers.get_lexer_by_name(lexer_name)
+            lexer = lexers.get_lexer_by_name(lexer_name)
         except util.ClassNotFound:
-            return None
+            lexer = None
+        _pygments_lexers[lexer_name] = lexer
+        return lexer
 
     def _color_with_pygments(self, codeblock, lexer, **formatter_opts):
         import pygments
-        import pygments.formatters
-
-        class HtmlCodeFormatter(pygments.formatters.HtmlFormatter):
-            def _wrap_code(self, inner):
-                """A function for use in a Pygments Formatter which
-                wraps in <code> tags.
-                """
-                yield 0, "<code>"
-                for tup in inner:
-                    yield tup
-                yield 0, "</code>"
-
-            def wrap(self, source, outfile):
-                """Return the source with a code, pre, and div."""
-                return self._wrap_div(self._wrap_pre(self._wrap_code(source)))
 
         formatter_opts.setdefault("cssclass", "codehilite")
-        formatter = HtmlCodeFormatter(**formatter_opts)
-        return pygments.highlight(codeblock, lexer, formatter)
+        opts_key = repr(sorted(formatter_opts.items()))
+        cache = self.highlight_cache
+        if cache is not None:
+            key = md5(("%s.%s\0%s\0%s" % (
+                lexer.__class__.__module__, lexer.__class__.__name__,
+                opts_key, codeblock)).encode("utf-8")).hexdigest()
+            colored = cache.get(key)
+            if colored is not None:
+                return colored
+        formatter = _pygments_formatters.get(opts_key)
+        if formatter is None:
+            formatter = _pygments_formatters[opts_key] \
+                = _html_code_formatter_class()(**formatter_opts)
+        colored = pygments.highlight(codeblock, lexer, formatter)
+        if cache is not None:
+            cache.set(key, colored)
+        return colored
 
     def _code_block_sub(self, match, is_fenced_code_block=False):
         lexer_name = None
@@ -1632,20 +1973,7 @@ class Markdown(object):
 
     def _do_code_blocks(self, text):
         """Process Markdown `<pre><code>` blocks."""
-        code_block_re = re.compile(r'''
-            (?:\n\n|\A\n?)
-            (               # $1 = the code block -- one or more lines, starting with a space/tab
-              (?:
-                (?:[ ]{%d} | \t)  # Lines must start with a tab or a tab-width of spaces
-                .*\n+
-              )+
-            )
-            ((?=^[ ]{0,%d}\S)|\Z)   # Lookahead for non-space at line-start, or end of doc
-            # Lookahead to make sure this block isn't already in a code block.
-            # Needed when syntax highlighting is being used.
-            (?![^<]*\</code\>)
-            ''' % (self.tab_width, self.tab_width),
-            re.M | re.X)
+        code_block_re = _code_block_re_from_tab_width(self.tab_width)
         return code_block_re.sub(self._code_block_sub, text)
 
     _fenced_code_block_re = re.compile(r'''
@@ -1726,23 +2054,110 @@ class Markdown(object):
         for before, after in replacements:
             text = text.replace(before, after)
         hashed = _hash_text(text)
-        self._escape_table[text] = hashed
+        self._code_table[hashed] = text
         return hashed
 
     _strong_re = re.compile(r"(\*\*|__)(?=\S)(.+?[*_]*)(?<=\S)\1", re.S)
     _em_re = re.compile(r"(\*|_)(?=\S)(.+?)(?<=\S)\1", re.S)
     _code_friendly_strong_re = re.compile(r"\*\*(?=\S)(.+?[*_]*)(?<=\S)\*\*", re.S)
     _code_friendly_em_re = re.compile(r"\*(?=\S)(.+?)(?<=\S)\*", re.S)
+    # The four regexes above define the emphasis syntax, but their lazy
+    # `.+?` rescans the rest of the text from every opener that has no
+    # closer, which is quadratic on input like "*a *a *a ...". The scanners
+    # below produce exactly the same substitutions from precomputed closer
+    # positions, in time linear in the text.
+    _em_opener_re = re.compile(r"[*_](?=\S)")
+    _code_friendly_em_opener_re = re.compile(r"\*(?=\S)")
+    _strong_opener_re = re.compile(r"(?=(\*\*|__)\S)")
+    _code_friendly_strong_opener_re = re.compile(r"(?=\*\*\S)")
+    _em_closer_re = {'*': re.compile(r"(?<=\S)\*"),
+                     '_': re.compile(r"(?<=\S)_")}
+    _strong_closer_re = {'*': re.compile(r"(?<=\S)(?=\*\*)"),
+                         '_': re.compile(r"(?<=\S)(?=__)")}
+    _emphasis_run_re = re.compile(r"[*_]+")
+
     def _do_italics_and_bold(self, text):
         # <strong> must go first:
         if "code-friendly" in self.extras:
-            text = self._code_friendly_strong_re.sub(r"<strong>\1</strong>", text)
-            text = self._code_friendly_em_re.sub(r"<em>\1</em>", text)
+            text = self._do_strong(text, self._code_friendly_strong_opener_re)
+            text = self._do_em(text, self._code_friendly_em_opener_re)
         else:
-            text = self._strong_re.sub(r"<strong>\2</strong>", text)
-            text = self._em_re.sub(r"<em>\2</em>", text)
+            text = self._do_strong(text, self._strong_opener_re)
+            text = self._do_em(text, self._em_opener_re)
         return text
 
+    def _do_em(self, text, opener_re):
+        """Equivalent to `_em_re.sub(r"<em>\2</em>", text)`.
+
+        An opener at `s` is closed by the first same character at `j >= s+2`
+        that follows a non-space character.
+        """
+        if '*' not in text and '_' not in text:
+            return text
+        closers = {}
+        pieces = []
+        pos = 0
+        for match in opener_re.finditer(text):
+            s = match.start()
+            if s < pos:
+                continue
+            c = text[s]
+            if c not in closers:
+                closers[c] = [m.start() for m in
+                              self._em_closer_re[c].finditer(text)]
+            positions = closers[c]
+            i = bisect_left(positions, s + 2)
+            if i == len(positions):
+                continue
+            j = positions[i]
+            pieces.append(text[pos:s])
+            pieces.append("<em>%s</em>" % text[s+1:j])
+            pos = j + 1
+        if not pieces:
+            return text
+        pieces.append(text[pos:])
+        return ''.join(pieces)
+
+    def _do_strong(self, text, opener_re):
+        """Equivalent to `_strong_re.sub(r"<strong>\2</strong>", text)`.
+
+        The `[*_]*` in the regex lets a closer be pushed to the right within
+        the run of '*'/'_' where the first possible closer lies, so the
+        match ends at the last valid closer in that run.
+        """
+        if '**' not in text and '__' not in text:
+            return text
+        closers = {}
+        runs = None
+        pieces = []
+        pos = 0
+        for match in opener_re.finditer(text):
+            s = match.start()
+            if s < pos:
+                continue
+            c = text[s]
+            if c not in closers:
+                closers[c] = [m.start() for m in
+                              self._strong_closer_re[c].finditer(text)]
+            positions = closers[c]
+            i = bisect_left(positions, s + 3)
+            if i == len(positions):
+                continue
+            if runs is None:
+                runs = [(m.start(), m.end()) for m in
+                        self._emphasis_run_re.finditer(text)]
+                run_starts = [start for start, end in runs]
+            # The run holding the first closer; take the last closer in it.
+            run_end = runs[bisect_right(run_starts, positions[i]) - 1][1]
+            m = positions[bisect_right(positions, run_end - 2) - 1]
+            pieces.append(text[pos:s])
+            pieces.append("<strong>%s</strong>" % text[s+2:m])
+            pos = m + 2
+        if not pieces:
+            return text
+        pieces.append(text[pos:])
+        return ''.join(pieces)
+
     # "smarty-pants" extra: Very liberal in interpreting a single prime as an
     # apostrophe; e.g. ignores the fact that "round", "bout", "twer", and
     # "twixt" can be written without an initial apostrophe. This is fine because
@@ -1987,11 +2402,21 @@ class Markdown(object):
             text = text.replace(hash, link)
         return text
 
+    _hash_re = re.compile(r'md5-[0-9a-f]{32}')
     def _unescape_special_chars(self, text):
-        # Swap back in all the special characters we've hidden.
-        for ch, hash in list(self._escape_table.items()):
-            text = text.replace(hash, ch)
-        return text
+        # Swap back in all the special characters we've hidden. This is a
+        # single pass over the hashes actually present: code spans get their
+        # own hash each, so a `replace()` per table entry was O(spans * n).
+        if 'md5-' not in text:
+            return text
+        char_from_hash = self._char_from_hash
+        code_table = self._code_table
+        def _unhash(match):
+            h = match.group(0)
+            if h in char_from_hash:
+                return char_from_hash[h]
+            return code_table.get(h, h)
+        return self._hash_re.sub(_unhash, text)
 
     def _outdent(self, text):
         # Remove one level of line-leading tabs or spaces
@@ -2013,8 +2438,383 @@ class MarkdownWithExtras(Markdown):
     extras = ["footnotes", "code-color"]
 
 
+class MarkdownPool(object):
+    """A thread-safe pool of reusable converters.
+
+    Building a `Markdown` instance normalizes its extras and sets up its
+    escape table every time; `markdown()` used to pay that on each call.
+    The pool keeps up to `max_idle` idle converters per configuration
+    (converter class plus constructor options) and hands them out again,
+    each one used by a single thread at a time:
+
+        >>> pool = MarkdownPool()
+        >>> with pool.converter(extras=["footnotes"]) as md:
+        ...     html = md.convert("*boo!*")
+        >>> pool.convert("*boo!*", cls=MarkdownWithExtras)
+        u'<p><em>boo!</em></p>\n'
+
+    Configurations that can't be hashed (e.g. a `link_patterns` entry
+    holding a list) get a fresh, unpooled converter.
+    """
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self.created = 0
+        self.reused = 0
+        self._idle = {}     # config key -> [converter, ...]
+        self._lock = threading.Lock()
+
+    def _key(self, cls, opts):
+        key = (cls, tuple(sorted(opts.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # e.g. `extras` given as a list or dict
+            key = (cls, _freeze(opts))
+            try:
+                hash(key)
+            except TypeError:
+                return None
+        return key
+
+    def acquire(self, cls=Markdown, **opts):
+        """Take a converter out of the pool, building one if none is idle.
+
+        Give it back with `release()` when done.
+        """
+        key = self._key(cls, opts)
+        if key is not None:
+            with self._lock:
+                idle = self._idle.get(key)
+                if idle:
+                    self.reused += 1
+                    md = idle.pop()
+                    md._pool_key = key
+                    return md
+                self.created += 1
+        md = cls(**opts)
+        md._pool_key = key
+        return md
+
+    def release(self, md):
+        key = md._pool_key
+        if key is None:
+            return
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(md)
+
+    @contextmanager
+    def converter(self, cls=Markdown, **opts):
+        md = self.acquire(cls, **opts)
+        try:
+            yield md
+        finally:
+            self.release(md)
+
+    def convert(self, text, cls=Markdown, **opts):
+        md = self.acquire(cls, **opts)
+        try:
+            return md.convert(text)
+        finally:
+            self.release(md)
+
+    def clear(self):
+        with self._lock:
+            self._idle.clear()
+
+# The pool used by `markdown()` and `markdown_path()`.
+converter_pool = MarkdownPool()
+
+
+class _LinkDefinitionScanner(Markdown):
+    """Runs `Markdown.convert()` only as far as stripping link definitions,
+    to collect the document's `urls` and `titles`. Fenced code blocks are
+    dropped instead of being highlighted.
+    """
+    render_cache = None
+
+    def _fenced_code_block_sub(self, match):
+        return "\n\n"
+
+    def _run_block_gamut(self, text):
+        return ""
+
+
+class _BlockMarkdown(Markdown):
+    """Converts one block of a document, with the link definitions of the
+    whole document (`link_definitions`, as collected by `BlockRenderer`).
+    """
+    render_cache = None     # `BlockRenderer` caches per block
+    link_definitions = ((), ())
+
+    def _strip_link_definitions(self, text):
+        text = Markdown._strip_link_definitions(self, text)
+        urls, titles = self.link_definitions
+        self.urls.update(urls)
+        self.titles.update(titles)
+        return text
+
+
+class BlockRenderer(object):
+    """Converts a document block by block, caching the html of each block.
+
+    The document is split at blank lines into top-level blocks that convert
+    the same on their own as inside the document (a list, block quote,
+    fenced code block or HTML block is never split). The html of a block is
+    cached under the block's text plus the document's link definitions, so
+    converting an edited document only converts the blocks that changed:
+
+        >>> renderer = BlockRenderer(extras=["tables"])
+        >>> html = renderer.convert(text)
+        >>> html = renderer.convert(text_with_one_paragraph_changed)
+
+    The output is the same as `markdown(text, **opts)`. Extras that number
+    or collect things across the whole document (footnotes, toc, header-ids,
+    metadata) and `use_file_vars` make the renderer convert whole documents.
+    So does html that may pair up across blocks: an end tag without a start
+    tag, or, with the fenced-code-blocks extra, fenced code next to <pre> or
+    <div> tags.
+
+    `split()`, `missing()`, `convert_block()` and `assemble(..., converted)`
+    let a caller convert the missing blocks elsewhere (e.g. in a process
+    pool).
+    """
+    whole_document_extras = ("footnotes", "toc", "header-ids", "metadata")
+
+    _list_item_re = re.compile(r"^[ \t]*(?:[*+-]|\d+\.)[ \t]")
+    _quote_re = re.compile(r"^[ \t]*>")
+    _empty_list_item_re = re.compile(r"^[ \t]*(?:[*+-]|\d+\.)[ \t]+$")
+    _open_span_re = re.compile(r"</?\w[^>]*\Z")
+    _chunk_end_re = re.compile(r"\n(?:[ \t]*\n)+")
+    _fence_line_re = re.compile(r"^```([\w+-]+)?[ \t]*$", re.M)
+    _html_tag_re = re.compile(r"<(/?)(%s)\b" % Markdown._block_tags_a)
+    _pre_or_div_re = re.compile(r"</?(?:pre|div)\b")
+
+    def __init__(self, cache=None, **opts):
+        self.opts = opts
+        if cache is None:
+            cache = RenderCache(max_entries=4096)
+        self.cache = cache
+        self.blocks_converted = 0
+        self.blocks_reused = 0
+        md = Markdown(**opts)
+        self.incremental = not md.use_file_vars and not any(
+            e in md.extras for e in self.whole_document_extras)
+        self._cache_config = md._render_cache_config
+        self._tab_width = md.tab_width
+        self._fenced_code = "fenced-code-blocks" in md.extras
+
+    def convert(self, text):
+        """Convert the given text; same result as `markdown(text, **opts)`."""
+        if not isinstance(text, unicode):
+            text = unicode(text, 'utf-8')
+        split = self.split(text)
+        if split is None:
+            return converter_pool.convert(text, **self.opts)
+        return self.assemble(*split)
+
+    def assemble(self, blocks, links, converted=None):
+        """Join the html of the blocks from `split()`, converting the ones
+        that are not cached yet. `converted` maps blocks converted elsewhere
+        (see `missing()`) to their html; they are cached here."""
+        converted = dict(converted or ())
+        htmls = []
+        for block in blocks:
+            key = self._key(block, links)
+            html = converted.pop(block, None)
+            if html is None:
+                html = self.cache.get(key)
+                if html is not None:
+                    self.blocks_reused += 1
+                    htmls.append(html)
+                    continue
+                html = self.convert_block(block, links)
+            self.cache.set(key, html)
+            self.blocks_converted += 1
+            htmls.append(html)
+        return self.join(blocks, htmls)
+
+    def split(self, text):
+        """Return `(blocks, links)` for `text`, or None if it has to be
+        converted as a whole. `links` holds the document's link definitions.
+        """
+        if not self.incremental:
+            return None
+        text = re.sub("\r\n|\r", "\n", text)
+        with converter_pool.converter(_LinkDefinitionScanner, **self.opts) as md:
+            md.convert(text)
+            if md._html_comment_scan_stopped:
+                # An HTML comment that isn't on its own stops the hashing of
+                # all comments after it, anywhere in the document.
+                return None
+            links = (tuple(sorted(md.urls.items())),
+                     tuple(sorted(md.titles.items())))
+            # Split what `convert()` works on: tabs expanded and
+            # whitespace-only lines emptied. Both are idempotent.
+            text = md._ws_only_line_re.sub("", md._detab(text))
+        if (self._fenced_code and "```" in text
+                and self._pre_or_div_re.search(text)):
+            # The html of a fenced code block is a <pre> (in a <div> when
+            # highlighted), which can pair up with <pre>/<div> tags in other
+            # blocks when the whole document is converted.
+            return None
+        blocks = self._split_blocks(text)
+        if not blocks:
+            return None
+        return blocks, links
+
+    def missing(self, blocks, links):
+        """The distinct blocks that are not in the cache. Only `assemble()`
+        counts cache hits and converted blocks."""
+        seen = set()
+        missing = []
+        for block in blocks:
+            if block not in seen:
+                seen.add(block)
+                if self._key(block, links) not in self.cache:
+                    missing.append(block)
+        return missing
+
+    def convert_block(self, block, links):
+        with converter_pool.converter(_BlockMarkdown, **self.opts) as md:
+            md.link_definitions = links
+            return md.convert(block)
+
+    def join(self, blocks, htmls):
+        # Each block's html ends with a newline; `_form_paragraphs` joins
+        # blocks with a blank line. A block that is all link definitions
+        # converts to an empty paragraph, but to nothing in the document
+        # (unlike, say, a literal "<p></p>" HTML block).
+        link_def_re = _link_def_re_from_tab_width(self._tab_width)
+        htmls = [html for block, html in zip(blocks, htmls)
+                 if html != u"<p></p>\n" or link_def_re.sub("", block).strip()]
+        return u"\n".join(htmls or [u"<p></p>\n"])
+
+    def stats(self):
+        return dict(self.cache.stats(), blocks_converted=self.blocks_converted,
+                    blocks_reused=self.blocks_reused)
+
+    def _key(self, block, links):
+        return md5((self._cache_config + "\0" + repr(links) + "\0" + block)
+                   .encode("utf-8")).hexdigest()
+
+    def _comment_left_open(self, chunk, is_open):
+        # Same pairing as the comment hashing in `_hash_html_blocks()`.
+        pos = 0
+        while True:
+            if not is_open:
+                pos = chunk.find("<!--", pos)
+                if pos == -1:
+                    return False
+                is_open = True
+            pos = chunk.find("-->", pos)
+            if pos == -1:
+                return True
+            pos += 3
+            is_open = False
+
+    def _fenced_spans(self, text):
+        """(start, end) of every stretch of `text` that may be a fenced code
+        block, in order of start.
+
+        An opening fence only counts after a blank line, but hashing HTML
+        blocks can put one before it later, so a fence without a blank line
+        before it is taken to span to the next closing fence too, without
+        consuming that closing fence.
+        """
+        fences = [(m.start(), m.end(), not m.group(1),
+                   m.start() < 2 or text[m.start()-2:m.start()] == "\n\n")
+                  for m in self._fence_line_re.finditer(text)]
+        spans = []
+        i = 0
+        while i < len(fences):
+            start, _, _, after_blank = fences[i]
+            for j in range(i + 1, len(fences)):
+                if fences[j][2]:    # a closing fence
+                    spans.append((start, fences[j][1]))
+                    break
+            else:
+                break
+            i = j + 1 if after_blank else i + 1
+        return spans
+
+    def _split_blocks(self, text):
+        blocks = []     # [start, end] of each block in `text`
+        html_open = {}  # block tag -> depth in the current block
+        fences = self._fenced_spans(text) if "```" in text else []
+        fence_end = 0   # end of the last fenced code block seen
+        comment_open = False    # an HTML comment runs on past this chunk
+        span_open = False   # a "<tag ..." still waiting for its ">"
+        in_list = in_quote = False  # the current block has list items/quotes
+        def_at_end = False  # the previous chunk ends in a link definition
+        prev_last = ""      # the last line of the previous chunk
+        link_def_re = _link_def_re_from_tab_width(self._tab_width)
+        start = 0
+        for match in self._chunk_end_re.finditer(text + "\n\n"):
+            chunk_start, chunk_end = start, match.start()
+            chunk, start = text[chunk_start:chunk_end], match.end()
+            if not chunk.strip():
+                continue
+            while fences and fences[0][0] < chunk_start:
+                fence_end = max(fence_end, fences.pop(0)[1])
+            lines = chunk.split("\n")
+            # Leading link definitions are stripped before anything else.
+            effective = link_def_re.sub("", chunk + "\n")
+            first = effective.split("\n", 1)[0]
+            if blocks and (
+                    first[:1] in (" ", "\t")
+                    or chunk_start < fence_end
+                    or comment_open
+                    or span_open
+                    or any(html_open.values())
+                    # A link definition or an empty list item swallows the
+                    # blank lines after it.
+                    or def_at_end
+                    or self._empty_list_item_re.match(prev_last)
+                    # Lists and block quotes run on across blank lines.
+                    or (in_list and self._list_item_re.match(first))
+                    or (in_quote and self._quote_re.match(first))
+                    # Nothing but link definitions: converts to nothing.
+                    or not effective.strip()):
+                blocks[-1][1] = chunk_end
+            else:
+                blocks.append([chunk_start, chunk_end])
+                html_open.clear()
+                comment_open = False
+                span_open = in_list = in_quote = False
+            comment_open = self._comment_left_open(chunk, comment_open)
+            span_open = bool(self._open_span_re.search(chunk)) or (
+                span_open and ">" not in chunk)
+            for tag in self._html_tag_re.finditer(chunk):
+                name = tag.group(2)
+                if tag.group(1):
+                    if not html_open.get(name):
+                        # An end tag without a start tag can pair up with
+                        # the html of an earlier block (e.g. the <pre> of a
+                        # code block) when the whole document is converted.
+                        return None
+                    html_open[name] -= 1
+                else:
+                    html_open[name] = html_open.get(name, 0) + 1
+            in_list = in_list or any(map(self._list_item_re.match, lines))
+            in_quote = in_quote or any(map(self._quote_re.match, lines))
+            def_at_end = any(m.end() >= len(chunk)
+                             for m in link_def_re.finditer(chunk + "\n"))
+            prev_last = lines[-1]
+        return [text[start:end] + "\n" for start, end in blocks]
+
+
 #---- internal support functions
 
+def _freeze(value):
+    """Turn (nested) dicts and lists into something hashable."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
 class UnicodeWithAttrs(unicode):
     """A subclass of unicode used for the return value of conversion to
     possibly attach some attributes. E.g. the "toc_html" attribute when
@@ -2223,6 +3023,130 @@ class _memoized(object):
       return self.func.__doc__
 
 
+class _LinkScanner(object):
+    """Bracket and parenthesis matching for one `Markdown._do_links` pass.
+
+    Scanning forward from every '[' and '(' for its partner is quadratic on
+    text full of unclosed brackets. The answers here are computed once and
+    keyed by distance from the end of the text: `_do_links` only splices
+    replacements in front of the position it is working on, so the tail
+    after the last splice (`unchanged` chars long) keeps its cached answers.
+    Positions inside spliced text fall back to a direct, bounded scan.
+    """
+    def __init__(self, text, max_link_text):
+        self.max_link_text = max_link_text
+        self.unchanged = len(text)
+        self._link_text_ends = {}   # end-relative '[' -> end-relative ']'
+        self._balances = {}         # (open_c, close_c) -> (rels, lows)
+
+    def spliced(self, text, end):
+        """Record that `text[:end]` (pre-splice coordinates) was rewritten."""
+        self.unchanged = min(self.unchanged, len(text) - end)
+
+    def link_text_end(self, text, start):
+        """Index of the ']' closing the '[' at `start`, or None if there is
+        none within `max_link_text` chars.
+        """
+        l = len(text)
+        if l - start > self.unchanged:
+            return self._scan_link_text_end(text, start)
+        ends = self._link_text_ends
+        if l - start not in ends:
+            self._match_brackets(text, start)
+        end = ends[l - start]
+        if end is None:
+            return None
+        return l - end
+
+    def _scan_link_text_end(self, text, start):
+        bracket_depth = 0
+        for p in range(start+1, min(start+self.max_link_text, len(text))):
+            ch = text[p]
+            if ch == ']':
+                bracket_depth -= 1
+                if bracket_depth < 0:
+                    return p
+            elif ch == '[':
+                bracket_depth += 1
+        return None
+
+    def _match_brackets(self, text, start):
+        # Pair up brackets over a window twice the sentinel length. Every
+        # '[' in the first half gets a definite answer, so windows advance
+        # by at least the sentinel length.
+        l = len(text)
+        limit = self.max_link_text
+        window_end = min(l, start + 2*limit)
+        ends = self._link_text_ends
+        stack = []
+        for match in _brackets_re.finditer(text, start, window_end):
+            p = match.start()
+            if text[p] == '[':
+                stack.append(p)
+            elif stack:
+                q = stack.pop()
+                ends[l - q] = l - p if p - q < limit else None
+        for q in stack:
+            if q + limit <= window_end or window_end == l:
+                ends[l - q] = None
+
+    def find_balanced(self, text, start, open_c, close_c):
+        """Same result as `Markdown._find_balanced()`, but returns the end of
+        the text straight away when the characters never balance out.
+        """
+        if self._lowest(text, start, open_c, close_c) >= 0:
+            return len(text)
+        i = start
+        count = 1
+        while count > 0:
+            ch = text[i]
+            if ch == open_c:
+                count += 1
+            elif ch == close_c:
+                count -= 1
+            i += 1
+        return i
+
+    def _lowest(self, text, start, open_c, close_c):
+        # The minimum of (#open_c - #close_c) over prefixes of text[start:].
+        l = len(text)
+        boundary = l - self.unchanged
+        if start >= boundary:
+            return self._suffix_lowest(text, l - start, open_c, close_c)
+        depth = low = 0
+        for i in range(start, boundary):
+            ch = text[i]
+            if ch == open_c:
+                depth += 1
+            elif ch == close_c:
+                depth -= 1
+                if depth < low:
+                    low = depth
+        return min(low, depth + self._suffix_lowest(text, self.unchanged,
+                                                    open_c, close_c))
+
+    def _suffix_lowest(self, text, rel, open_c, close_c):
+        key = (open_c, close_c)
+        if key not in self._balances:
+            # Built from the current tail: entries are only looked up for
+            # end-relative positions inside it.
+            tail = text[len(text) - self.unchanged:]
+            l = len(tail)
+            rels, lows = [], []
+            low = 0
+            pattern = re.compile('[%s]' % re.escape(open_c + close_c))
+            for p in reversed([m.start() for m in pattern.finditer(tail)]):
+                low = min(0, low + (1 if tail[p] == open_c else -1))
+                rels.append(l - p)
+                lows.append(low)
+            self._balances[key] = (rels, lows)
+        rels, lows = self._balances[key]
+        i = bisect_right(rels, rel) - 1
+        return lows[i] if i >= 0 else 0
+
+_brackets_re = re.compile(r'[\[\]]')
+
+
 def _xml_oneliner_re_from_tab_width(tab_width):
     """Standalone XML processing instruction regex."""
     return re.compile(r"""
@@ -2244,6 +3168,150 @@ def _xml_oneliner_re_from_tab_width(tab_width):
         """ % (tab_width - 1), re.X)
 _xml_oneliner_re_from_tab_width = _memoized(_xml_oneliner_re_from_tab_width)
 
+def _link_def_re_from_tab_width(tab_width):
+    """Link definition regex: `[id]: url "optional title"`."""
+    less_than_tab = tab_width - 1
+    return re.compile(r"""
+        ^[ ]{0,%d}\[(.+)\]: # id = \1
+          [ \t]*
+          \n?               # maybe *one* newline
+          [ \t]*
+        <?(.+?)>?           # url = \2
+          [ \t]*
+        (?:
+            \n?             # maybe one newline
+            [ \t]*
+            (?<=\s)         # lookbehind for whitespace
+            ['"(]
+            ([^\n]*)        # title = \3
+            ['")]
+            [ \t]*
+        )?  # title is optional
+        (?:\n+|\Z)
+        """ % less_than_tab, re.X | re.M | re.U)
+_link_def_re_from_tab_width = _memoized(_link_def_re_from_tab_width)
+
+def _footnote_def_re_from_tab_width(tab_width):
+    """Footnote definition regex ('footnotes' extra)."""
+    less_than_tab = tab_width - 1
+    return re.compile(r'''
+        ^[ ]{0,%d}\[\^(.+)\]:   # id = \1
+        [ \t]*
+        (                       # footnote text = \2
+          # First line need not start with the spaces.
+          (?:\s*.*\n+)
+          (?:
+            (?:[ ]{%d} | \t)  # Subsequent lines must be indented.
+            .*\n+
+          )*
+        )
+        # Lookahead for non-space at line-start, or end of doc.
+        (?:(?=^[ ]{0,%d}\S)|\Z)
+        ''' % (less_than_tab, tab_width, tab_width),
+        re.X | re.M)
+_footnote_def_re_from_tab_width = _memoized(_footnote_def_re_from_tab_width)
+
+def _pyshell_block_re_from_tab_width(tab_width):
+    """Python interactive shell session regex ('pyshell' extra)."""
+    less_than_tab = tab_width - 1
+    return re.compile(r"""
+        ^([ ]{0,%d})>>>[ ].*\n   # first line
+        ^(\1.*\S+.*\n)*         # any number of subsequent lines
+        ^\n                     # ends with a blank line
+        """ % less_than_tab, re.M | re.X)
+_pyshell_block_re_from_tab_width = _memoized(_pyshell_block_re_from_tab_width)
+
+def _table_re_from_tab_width(tab_width):
+    """GFM/PHP-Markdown Extra table regex ('tables' extra)."""
+    less_than_tab = tab_width - 1
+    return re.compile(r'''
+            (?:(?<=\n\n)|\A\n?)             # leading blank line
+
+            ^[ ]{0,%d}                      # allowed whitespace
+            (.*[|].*)  \n                   # $1: header row (at least one pipe)
+
+            ^[ ]{0,%d}                      # allowed whitespace
+            (                               # $2: underline row
+                # underline row with leading bar
+                (?:  \|\ *:?-+:?\ *  )+  \|?  \n
+                |
+                # or, underline row without leading bar
+                (?:  \ *:?-+:?\ *\|  )+  (?:  \ *:?-+:?\ *  )?  \n
+            )
+
+            (                               # $3: data rows
+                (?:
+                    ^[ ]{0,%d}(?!\ )         # ensure line begins with 0 to less_than_tab spaces
+                    .*\|.*  \n
+                )+
+            )
+        ''' % (less_than_tab, less_than_tab, less_than_tab), re.M | re.X)
+_table_re_from_tab_width = _memoized(_table_re_from_tab_width)
+
+def _wiki_table_re_from_tab_width(tab_width):
+    """Google Code wiki table regex ('wiki-tables' extra)."""
+    less_than_tab = tab_width - 1
+    return re.compile(r'''
+        (?:(?<=\n\n)|\A\n?)            # leading blank line
+        ^([ ]{0,%d})\|\|.+?\|\|[ ]*\n  # first line
+        (^\1\|\|.+?\|\|\n)*        # any number of subsequent lines
+        ''' % less_than_tab, re.M | re.X)
+_wiki_table_re_from_tab_width = _memoized(_wiki_table_re_from_tab_width)
+
+def _code_block_re_from_tab_width(tab_width):
+    """Indented code block regex."""
+    return re.compile(r'''
+        (?:\n\n|\A\n?)
+        (               # $1 = the code block -- one or more lines, starting with a space/tab
+          (?:
+            (?:[ ]{%d} | \t)  # Lines must start with a tab or a tab-width of spaces
+            .*\n+
+          )+
+        )
+        ((?=^[ ]{0,%d}\S)|\Z)   # Lookahead for non-space at line-start, or end of doc
+        # Lookahead to make sure this block isn't already in a code block.
+        # Needed when syntax highlighting is being used.
+        (?![^<]*\</code\>)
+        ''' % (tab_width, tab_width),
+        re.M | re.X)
+_code_block_re_from_tab_width = _memoized(_code_block_re_from_tab_width)
+
+def _list_re_from_tab_width(tab_width, marker_pat, sublist):
+    """Whole-list regex for the given list marker pattern."""
+    less_than_tab = tab_width - 1
+    whole_list = r'''
+        (                   # \1 = whole list
+          (                 # \2
+            [ ]{0,%d}
+            (%s)            # \3 = first list item marker
+            [ \t]+
+            (?!\ *\3\ )     # '- - - ...' isn't a list. See 'not_quite_a_list' test case.
+          )
+          (?:.+?)
+          (                 # \4
+              \Z
+            |
+              \n{2,}
+              (?=\S)
+              (?!           # Negative lookahead for another list item marker
+                [ \t]*
+                %s[ \t]+
+              )
+          )
+        )
+    ''' % (less_than_tab, marker_pat, marker_pat)
+    if sublist:
+        return re.compile("^"+whole_list, re.X | re.M | re.S)
+    else:
+        return re.compile(r"(?:(?<=\n\n)|\A\n?)"+whole_list,
+                          re.X | re.M | re.S)
+_list_re_from_tab_width = _memoized(_list_re_from_tab_width)
+
+def _outdent_re_from_tab_width(tab_width):
+    """Regex removing one level of line-leading tabs or spaces."""
+    return re.compile(r'^(\t|[ ]{1,%d})' % tab_width, re.M)
+_outdent_re_from_tab_width = _memoized(_outdent_re_from_tab_width)
+
 def _hr_tag_re_from_tab_width(tab_width):
      return re.compile(r"""
         (?:
@@ -2306,13 +3374,193 @@ def _test():
     import doctest
     doctest.testmod()
 
+
+#---- batch conversion
+
+# Markdown options of the batch workers, set by `_batch_init()` in each
+# worker process.
+_batch_kwargs = None
+
+def _batch_init(kwargs):
+    global _batch_kwargs
+    _batch_kwargs = kwargs
+
+def _write_atomically(path, text, encoding="utf-8"):
+    """Write `text` to `path` via a temporary file in the same directory,
+    so readers see the old file or the new one, never a partial one.
+    """
+    import tempfile
+    dir = os.path.dirname(path) or os.curdir
+    if not os.path.isdir(dir):
+        try:
+            os.makedirs(dir)
+        except OSError:
+            if not os.path.isdir(dir):  # lost a race with another worker
+                raise
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(text.encode(encoding))
+        # mkstemp creates the file 0600; give it the mode the destination
+        # has, or the mode a plain open() would give a new file.
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except OSError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp_path, mode)
+        if hasattr(os, "replace"):
+            os.replace(tmp_path, path)
+        else:  # Python 2: rename doesn't replace on Windows
+            if sys.platform == "win32" and os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _batch_convert(job):
+    """Convert one batch document in a worker process.
+
+    `job` is `(name, src_path, text, dest_path, encoding)`; `text` is None
+    when the document is read from `src_path`. Returns
+    `(name, n_chars, seconds, error)`.
+    """
+    from time import time
+    name, src_path, text, dest_path, encoding = job
+    start = time()
+    try:
+        if text is None:
+            fp = codecs.open(src_path, 'r', encoding)
+            try:
+                text = fp.read()
+            finally:
+                fp.close()
+        html = converter_pool.convert(text, **_batch_kwargs)
+        _write_atomically(dest_path, html, encoding)
+    except Exception:
+        _, ex, _ = sys.exc_info()
+        return name, 0, time() - start, "%s: %s" % (ex.__class__.__name__, ex)
+    return name, len(text), time() - start, None
+
+def _batch_jobs_from_paths(paths, pattern, output_dir, encoding):
+    """Generate batch jobs for the files named by `paths`: files,
+    directories (searched recursively for files matching `pattern`) and
+    glob patterns.
+
+    Each output goes next to its input, or into `output_dir` at the
+    input's path relative to the directory or glob it was found by.
+    """
+    import fnmatch, glob
+    for path in paths:
+        if glob.has_magic(path):
+            base = path
+            while glob.has_magic(base):
+                base = os.path.dirname(base)
+            if py3:
+                found = glob.glob(path, recursive=True)
+            else:
+                found = glob.glob(path)
+            found = sorted(f for f in found if os.path.isfile(f))
+        elif os.path.isdir(path):
+            base = path
+            found = []
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                found += [os.path.join(dirpath, f) for f in sorted(filenames)
+                          if fnmatch.fnmatch(f, pattern)]
+        else:
+            base = os.path.dirname(path)
+            found = [path]
+        for src_path in found:
+            dest_path = os.path.splitext(src_path)[0] + ".html"
+            if output_dir:
+                dest_path = os.path.join(output_dir,
+                    os.path.relpath(dest_path, base or os.curdir))
+            yield src_path, src_path, None, dest_path, encoding
+
+def _batch_jobs_from_jsonl(fp, output_dir, encoding):
+    """Generate batch jobs for a JSONL stream of `{"id": ..., "text": ...}`
+    documents ("content" is accepted for "text"). The html of a document
+    goes to "<output_dir>/<id>.html".
+    """
+    import json
+    for lineno, line in enumerate(fp, 1):
+        if not line.strip():
+            continue
+        try:
+            doc = json.loads(line)
+            id = unicode(doc["id"])
+            text = doc["text"] if "text" in doc else doc["content"]
+        except (ValueError, KeyError, TypeError):
+            raise MarkdownError("line %d: not a JSON object with 'id' and "
+                                "'text': %r" % (lineno, line[:80]))
+        if os.path.isabs(id) or ".." in id.replace("\\", "/").split("/"):
+            raise MarkdownError("line %d: id is not a relative path: %r"
+                                % (lineno, id))
+        yield id, None, text, os.path.join(output_dir, id + ".html"), encoding
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(len(sorted_values) * p))]
+
+def batch_convert(jobs, processes=None, chunksize=4, **kwargs):
+    """Convert batch jobs (see `_batch_convert()`) across a pool of worker
+    processes, `processes` defaulting to the number of CPUs.
+
+    Returns a stats dict: counts, throughput, per-document latency
+    percentiles and the `(name, error)` of failed documents.
+    """
+    import multiprocessing
+    from time import time
+    start = time()
+    latencies = []
+    n_chars = 0
+    failed = []
+    pool = multiprocessing.Pool(processes, _batch_init, (kwargs,))
+    try:
+        for name, size, seconds, error in pool.imap_unordered(
+                _batch_convert, jobs, chunksize):
+            if error:
+                failed.append((name, error))
+                log.error("%s: %s", name, error)
+                continue
+            latencies.append(seconds)
+            n_chars += size
+            log.debug("%s: %.1fms", name, seconds * 1000)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    elapsed = time() - start
+    latencies.sort()
+    return {
+        "documents": len(latencies),
+        "failed": failed,
+        "chars": n_chars,
+        "seconds": elapsed,
+        "docs_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "chars_per_sec": n_chars / elapsed if elapsed else 0.0,
+        "p50_ms": _percentile(latencies, 0.5) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+    }
+
 def main(argv=None):
     if argv is None:
         argv = sys.argv
     if not logging.root.handlers:
         logging.basicConfig()
 
-    usage = "usage: %prog [PATHS...]"
+    usage = ("usage: %prog [PATHS...]\n"
+             "       %prog --batch [-j N] [-o DIR] PATHS...\n"
+             "       %prog --batch --jsonl FILE -o DIR")
     version = "%prog "+__version__
     parser = optparse.OptionParser(prog="markdown2", usage=usage,
         version=version, description=cmdln_desc,
@@ -2341,9 +3589,26 @@ def main(argv=None):
                       help="run internal self-tests (some doctests)")
     parser.add_option("--compare", action="store_true",
                       help="run against Markdown.pl as well (for testing)")
+    parser.add_option("--batch", action="store_true",
+                      help="convert many documents in parallel: each PATH "
+                           "is a file, a directory or a glob, and the html "
+                           "is written to a .html file next to it (or "
+                           "under --output-dir)")
+    parser.add_option("--jsonl", metavar="FILE",
+                      help="batch: read documents from a JSONL file ('-' "
+                           "for stdin) of {\"id\": ..., \"text\": ...} "
+                           "objects; <id>.html is written under --output-dir")
+    parser.add_option("-o", "--output-dir", metavar="DIR",
+                      help="batch: write the html files under DIR")
+    parser.add_option("--pattern", default="*.md",
+                      help="batch: file name pattern for directories "
+                           "(default '*.md')")
+    parser.add_option("-j", "--jobs", type="int", metavar="N",
+                      help="batch: number of worker processes (default: "
+                           "the number of CPUs)")
     parser.set_defaults(log_level=logging.INFO, compare=False,
                         encoding="utf-8", safe_mode=None, use_file_vars=False)
-    opts, paths = parser.parse_args()
+    opts, paths = parser.parse_args(argv[1:])
     log.setLevel(opts.log_level)
 
     if opts.self_test:
@@ -2385,6 +3650,38 @@ def main(argv=None):
     else:
         link_patterns = None
 
+    if opts.batch or opts.jsonl:
+        if opts.jsonl:
+            if paths:
+                parser.error("--jsonl doesn't take PATHS")
+            if not opts.output_dir:
+                parser.error("--jsonl needs --output-dir")
+            if opts.jsonl == '-':
+                fp = codecs.getreader(opts.encoding)(
+                    getattr(sys.stdin, "buffer", sys.stdin))
+            else:
+                fp = codecs.open(opts.jsonl, 'r', opts.encoding)
+            jobs = _batch_jobs_from_jsonl(fp, opts.output_dir, opts.encoding)
+        elif not paths:
+            parser.error("--batch needs PATHS")
+        else:
+            jobs = _batch_jobs_from_paths(paths, opts.pattern,
+                                          opts.output_dir, opts.encoding)
+        stats = batch_convert(jobs, opts.jobs,
+            html4tags=opts.html4tags,
+            safe_mode=opts.safe_mode,
+            extras=extras, link_patterns=link_patterns,
+            use_file_vars=opts.use_file_vars)
+        sys.stderr.write(
+            "converted %(documents)d documents (%(chars)d chars) in "
+            "%(seconds).2fs: %(docs_per_sec).1f docs/s, "
+            "%(chars_per_sec).0f chars/s; latency p50 %(p50_ms).1fms, "
+            "p99 %(p99_ms).1fms, max %(max_ms).1fms\n" % stats)
+        if stats["failed"]:
+            sys.stderr.write("%d documents failed\n" % len(stats["failed"]))
+            return 1
+        return 0
+
     from os.path import join, dirname, abspath, exists
     markdown_pl = join(dirname(dirname(abspath(__file__))), "test",
                        "Markdown.pl")
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark for markdown2 on a representative corpus.
+
+The corpus is generated (deterministically) to cover what the blog renders:
+short comments, typical posts, huge code-heavy posts, tables, footnotes and
+pathological emphasis. For every case the script reports the time of
+Markdown.convert, the time spent in its main stages and the peak memory
+allocated while converting, and compares them with a stored baseline:
+
+    python3 md_benchmark.py [--repeat 5] [--tolerance 0.25] [case ...]
+    python3 md_benchmark.py --save-baseline
+
+Times in the baseline are stored relative to a fixed pure-Python workload
+timed on the same machine, so a baseline saved on one machine is roughly
+usable on another. The script fails if a case got slower (or allocates
+more) than the baseline by more than --tolerance.
+'''
+
+import argparse, json, os, random, sys, time, tracemalloc
+
+import markdown2
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'md_benchmark.json')
+
+# Stages of Markdown.convert that are timed. Their times are inclusive and
+# nested (links are done inside the span gamut, which runs inside the block
+# gamut), so they don't add up to the total.
+STAGES = ['_hash_html_blocks', '_run_block_gamut', '_run_span_gamut', '_do_links', '_form_paragraphs']
+
+WORDS = ('the of and to in is that for it as was with be by on not he this are or his from at which '
+         'but have an they you were her she there been one all we their has would when if so no will '
+         'markdown python asyncio render blog comment server database').split()
+
+
+def _sentence(rnd, n=12):
+    words = [rnd.choice(WORDS) for _ in range(rnd.randint(n // 2, n))]
+    i = rnd.randrange(len(words))
+    words[i] = rnd.choice(['*%s*', '**%s**', '`%s`', '_%s_']) % words[i]
+    return ' '.join(words).capitalize() + '.'
+
+
+def _link_sentence(rnd):
+    word = rnd.choice(WORDS)
+    return '%s [%s](http://example.com/%s "%s") %s.' % (
+        _sentence(rnd, 8)[:-1], word, word, word, rnd.choice(WORDS))
+
+
+def _paragraph(rnd, sentences=4):
+    return ' '.join(_sentence(rnd) if i % 3 else _link_sentence(rnd) for i in range(sentences))
+
+
+def _code(rnd, lines):
+    return '\n'.join('%sdef %s_%d(x):  # %s' % ('    ' * (i % 3), rnd.choice(WORDS), i, rnd.choice(WORDS))
+                     for i in range(lines))
+
+
+def comment(rnd):
+    return _paragraph(rnd, rnd.randint(1, 3))
+
+
+def post(rnd):
+    parts = ['# %s' % _sentence(rnd, 6)[:-1]]
+    for section in range(4):
+        parts.append('## %s' % _sentence(rnd, 4)[:-1])
+        parts += [_paragraph(rnd) for _ in range(3)]
+        parts.append('\n'.join('- %s' % _sentence(rnd, 6) for _ in range(4)))
+        parts.append('> %s' % _paragraph(rnd, 2))
+        parts.append('\n'.join('    ' + line for line in _code(rnd, 6).split('\n')))
+    parts.append('[ref]: http://example.com/ref "Reference"')
+    return '\n\n'.join(parts) + '\n'
+
+
+def code_heavy(rnd):
+    # Posts repeat snippets (a setup block, the same call with a change...),
+    # so blocks are drawn from a smaller pool.
+    snippets = [_code(rnd, 40) for _ in range(80)]
+    parts = ['# %s' % _sentence(rnd, 6)[:-1]]
+    for block in range(120):
+        parts.append(_paragraph(rnd, 2))
+        parts.append('```python\n%s\n```' % rnd.choice(snippets))
+    return '\n\n'.join(parts) + '\n'
+
+
+def tables(rnd):
+    rows = ['| id | name | value | note |', '|----|:-----|------:|:----:|']
+    rows += ['| %d | %s | %d | *%s* |' % (i, rnd.choice(WORDS), rnd.randint(0, 10 ** 6), rnd.choice(WORDS))
+             for i in range(400)]
+    return '%s\n\n%s\n\n%s\n' % (_paragraph(rnd), '\n'.join(rows), _paragraph(rnd))
+
+
+def footnotes(rnd):
+    parts = []
+    for i in range(150):
+        parts.append('%s[^n%d] %s' % (_sentence(rnd), i, _sentence(rnd)))
+    parts += ['[^n%d]: %s' % (i, _paragraph(rnd, 2)) for i in range(150)]
+    return '\n\n'.join(parts) + '\n'
+
+
+def emphasis(rnd):
+    return ''.join(rnd.choice(['*a ', '_a ', '**a ', '*_', 'a*', '***b*** ', '__c__ ']) for _ in range(8000))
+
+
+# name -> (document generator, number of documents, extras)
+CASES = {
+    'comments': (comment, 300, None),
+    'posts': (post, 30, None),
+    'code-heavy': (code_heavy, 2, ['fenced-code-blocks']),
+    'tables': (tables, 5, ['tables']),
+    'footnotes': (footnotes, 5, ['footnotes']),
+    'emphasis': (emphasis, 2, None),
+}
+
+
+def corpus(name, seed=0):
+    make, count, extras = CASES[name]
+    rnd = random.Random('%s-%s' % (name, seed))
+    return [make(rnd) for _ in range(count)], extras
+
+
+class StageTimer(markdown2.Markdown):
+    '''A Markdown that adds up the time spent in each of STAGES. Recursive
+    calls of a stage are counted once, in the outermost call.'''
+
+    render_cache = None
+
+    def __init__(self, *args, **kwargs):
+        super(StageTimer, self).__init__(*args, **kwargs)
+        self.stage_times = dict.fromkeys(STAGES, 0.0)
+        self._depth = dict.fromkeys(STAGES, 0)
+
+
+def _timed(name):
+    method = getattr(markdown2.Markdown, name)
+
+    def timed(self, *args, **kwargs):
+        self._depth[name] += 1
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._depth[name] -= 1
+            if not self._depth[name]:
+                self.stage_times[name] += time.perf_counter() - start
+    timed.__name__ = name
+    return timed
+
+for _name in STAGES:
+    setattr(StageTimer, _name, _timed(_name))
+
+
+def calibrate(repeat=5):
+    '''Time of a fixed pure-Python workload, the unit of baseline times.'''
+    def work():
+        d = {}
+        for i in range(200000):
+            d[i % 1000] = d.get(i % 1000, '')[:8] + str(i)
+        return ''.join(sorted(d.values()))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        work()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_case(name, repeat=5):
+    '''Benchmark one case: the best total and per-stage times (seconds) over
+    `repeat` runs, and the peak memory allocated by a run (KiB).'''
+    docs, extras = corpus(name)
+    best = None
+    for _ in range(repeat):
+        md = StageTimer(extras=extras)
+        # Highlighting is cached within a run, not across runs.
+        md.highlight_cache = markdown2.RenderCache()
+        start = time.perf_counter()
+        for doc in docs:
+            md.convert(doc)
+        total = time.perf_counter() - start
+        if best is None or total < best[0]:
+            best = (total, dict(md.stage_times))
+
+    md = StageTimer(extras=extras)
+    md.highlight_cache = markdown2.RenderCache()
+    tracemalloc.start()
+    try:
+        for doc in docs:
+            md.convert(doc)
+        # Nothing is kept between documents, so this is the peak of the
+        # most expensive one.
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return dict(docs=len(docs), chars=sum(map(len, docs)), seconds=best[0], stages=best[1],
+                peak_kib=peak / 1024.0)
+
+
+def compare(name, result, baseline, unit, tolerance):
+    '''Return the regressions of `result` against `baseline` as strings.'''
+    regressions = []
+    seconds = result['seconds'] / unit
+    if seconds > baseline['seconds'] * (1 + tolerance):
+        regressions.append('%s: time %.1f%% over baseline' % (name, (seconds / baseline['seconds'] - 1) * 100))
+    if result['peak_kib'] > baseline['peak_kib'] * (1 + tolerance):
+        regressions.append('%s: peak memory %.1f%% over baseline'
+                           % (name, (result['peak_kib'] / baseline['peak_kib'] - 1) * 100))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark markdown2 on a representative corpus.')
+    parser.add_argument('cases', nargs='*', help='cases to run (default: all of %s)' % ', '.join(sorted(CASES)))
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case, the fastest is kept')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown/extra memory against the baseline (0.25 is 25%%)')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.cases if name not in CASES]
+    if unknown:
+        parser.error('unknown case(s): %s' % ', '.join(unknown))
+    names = args.cases or sorted(CASES)
+
+    baseline = None
+    if not args.save_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        else:
+            print('no baseline at %s, run with --save-baseline to create one' % args.baseline)
+
+    unit = calibrate()
+    results = {}
+    regressions = []
+    print('%-12s %5s %9s %10s %10s  %s' % ('case', 'docs', 'chars', 'total', 'peak', '  '.join(STAGES)))
+    for name in names:
+        result = results[name] = run_case(name, args.repeat)
+        print('%-12s %5d %9d %9.4fs %7.0fKiB  %s' % (
+            name, result['docs'], result['chars'], result['seconds'], result['peak_kib'],
+            '  '.join('%*.4fs' % (len(stage) - 1, result['stages'][stage]) for stage in STAGES)))
+        if baseline and name in baseline['cases']:
+            regressions += compare(name, result, baseline['cases'][name], unit, args.tolerance)
+
+    if args.save_baseline:
+        cases = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                cases = json.load(f)['cases']
+        for name, result in results.items():
+            cases[name] = dict(seconds=result['seconds'] / unit, peak_kib=result['peak_kib'])
+        with open(args.baseline, 'w') as f:
+            json.dump(dict(markdown2=markdown2.__version__, python=sys.version.split()[0], cases=cases),
+                      f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('baseline saved to %s' % args.baseline)
+        return 0
+
+    for line in regressions:
+        print('REGRESSION %s' % line)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
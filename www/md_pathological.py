@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Pathological markdown corpus for markdown2.
+
+Each shape is a generator of input of a given size that used to make some
+regex or scan in markdown2 go super-linear (unclosed emphasis, unbalanced
+brackets and parentheses, block tags without an end tag...). The script
+renders every shape at growing sizes and fails if render time grows
+faster than linearly:
+
+    python3 md_pathological.py [--sizes 2000,4000,8000] [--max-exponent 1.5] [shape ...]
+
+With --fuzz it also renders random mixes of the fragments below and fails
+if any of them takes longer than --budget seconds per 10k chars.
+'''
+
+import argparse, math, random, sys, time
+
+import markdown2
+
+# size -> text. Sizes count repetitions, not characters.
+SHAPES = {
+    'em-unclosed': lambda n: '*a ' * n,
+    'em-unclosed-underscore': lambda n: '_a ' * n,
+    'strong-unclosed': lambda n: '**a ' * n,
+    'emphasis-run': lambda n: 'a' + '*' * n,
+    'emphasis-mixed': lambda n: '*_' * n,
+    'brackets-open': lambda n: '[' * n,
+    'brackets-text': lambda n: '[a' * n,
+    'link-unclosed-url': lambda n: '[a](' * n,
+    'link-unclosed-title': lambda n: '[a](b "' * n,
+    'link-angle-url': lambda n: '[a](<' * n,
+    'image-unclosed-url': lambda n: '![a](' * n,
+    'block-tag-unclosed': lambda n: '</div>\n\n' + '<div>\n' * n + '\n<p>x</p>\n',
+    'block-tag-lines': lambda n: '<div>x\n' * n,
+    'html-unclosed': lambda n: '<a ' * n,
+    'code-spans': lambda n: '`a ' * n,
+    'list': lambda n: '- a\n' * n,
+    'blockquote': lambda n: '> a\n' * n,
+}
+
+# Fragments mixed together by --fuzz.
+FRAGMENTS = ['*', '**', '_', '__', '[', ']', '(', ')', '<', '>', '"', '`',
+             '![', '](', ' ', 'a', '\n', '\n\n', '<div>', '</div>', '    ',
+             '- ', '> ', '#', '[a]: /u\n', '<!--', '-->']
+
+EXTRAS = [None, ['code-friendly'], ['footnotes', 'tables'], ['fenced-code-blocks']]
+
+
+def render_time(text, extras=None):
+    start = time.perf_counter()
+    markdown2.Markdown(extras=extras).convert(text)
+    return time.perf_counter() - start
+
+
+def growth_exponent(sizes, times):
+    '''Largest k such that time grows like size**k between adjacent sizes
+    (1.0 is linear, 2.0 quadratic).'''
+    return max(math.log(max(t2, 1e-4) / max(t1, 1e-4)) / math.log(float(n2) / n1)
+               for n1, n2, t1, t2 in zip(sizes, sizes[1:], times, times[1:]))
+
+
+def check_linear(shapes, sizes, max_exponent, repeat=3):
+    '''Print timings per shape; return the names of shapes whose render time
+    grew faster than size**max_exponent.'''
+    failed = []
+    for name in shapes:
+        make = SHAPES[name]
+        times = [min(render_time(make(n)) for _ in range(repeat)) for n in sizes]
+        k = growth_exponent(sizes, times)
+        ok = k <= max_exponent
+        print('%-24s %s  n^%.2f%s' % (name, ' '.join('%8.4fs' % t for t in times),
+                                      k, '' if ok else '  SUPER-LINEAR'))
+        if not ok:
+            failed.append(name)
+    return failed
+
+
+def fuzz(rounds, length, budget, seed=None):
+    '''Render random fragment mixes; return the slow ones as (seconds, text).'''
+    rnd = random.Random(seed)
+    slow = []
+    for _ in range(rounds):
+        text = ''.join(rnd.choice(FRAGMENTS) for _ in range(length))
+        t = render_time(text, rnd.choice(EXTRAS))
+        if t > budget * len(text) / 10000.0:
+            slow.append((t, text))
+    return slow
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check markdown2 stays linear on pathological input.')
+    parser.add_argument('shapes', nargs='*', help='shapes to run (default: all of %s)' % ', '.join(sorted(SHAPES)))
+    parser.add_argument('--sizes', default='2000,4000,8000', help='comma separated repetition counts')
+    parser.add_argument('--max-exponent', type=float, default=1.5,
+                        help='largest allowed k for time ~ size**k (linear is 1)')
+    parser.add_argument('--fuzz', type=int, default=0, metavar='ROUNDS', help='also run ROUNDS random mixes')
+    parser.add_argument('--fuzz-length', type=int, default=5000, help='fragments per random mix')
+    parser.add_argument('--budget', type=float, default=0.5, help='fuzz: max seconds per 10k chars')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.shapes if name not in SHAPES]
+    if unknown:
+        parser.error('unknown shape(s): %s' % ', '.join(unknown))
+    # Measure the renderer, not the cache in front of it.
+    markdown2.Markdown.render_cache = None
+
+    sizes = [int(n) for n in args.sizes.split(',')]
+    if len(sizes) < 2:
+        parser.error('--sizes needs at least two sizes')
+    failed = check_linear(args.shapes or sorted(SHAPES), sizes, args.max_exponent)
+    if args.fuzz:
+        slow = fuzz(args.fuzz, args.fuzz_length, args.budget, args.seed)
+        for t, text in sorted(slow, reverse=True)[:5]:
+            print('slow fuzz input (%.3fs, %d chars): %r...' % (t, len(text), text[:200]))
+        print('fuzz: %d/%d over budget' % (len(slow), args.fuzz))
+        if slow:
+            failed.append('fuzz')
+    if failed:
+        print('FAILED: %s' % ', '.join(failed))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -34,6 +34,8 @@ class Blog(Model):
     name = StringField(ddl="varchar(50)")  # 文章名
     summary = StringField(ddl="varchar(200)")  # 文章概要
     content = TextField()  # 文章正文
+    html_content = TextField(default='')  # 渲染好的正文html，避免每次访问都重新渲染markdown
+    content_hash = StringField(ddl="varchar(50)", default='')  # 渲染html时正文的hash，见render.content_hash
     created_at = FloatField(default=time.time)
 
 # 这是一个评论的表
@@ -4,26 +4,325 @@
 __author__ = 'ReedSun'
 
 import asyncio
+import contextlib
+import contextvars
 import logging
+import re
+import time
+import weakref
+from collections import OrderedDict, deque
 # aiomysql是Mysql的python异步驱动程序，操作数据库要用到
 import aiomysql
+import ormcache
 
 
 # 这个函数的作用是输出信息，让你知道这个时间点程序在做什么
 def log(sql, args=()):
-    logging.info('SQL: %s' % sql)
+    logging.info('SQL: %s', sql)
 
 
-# 创建全局连接池
-# 这个函数将来会在app.py的init函数中引用
-# 目的是为了让每个HTTP请求都能s从连接池中直接获取数据库连接
-# 避免了频繁关闭和打开数据库连接
-async def create_pool(loop, **kw):
-    logging.info('创建连接池...')
-    # 声明变量__pool是一个全局变量，如果不加声明，__pool就会被默认为一个私有变量，不能被其他函数引用
-    global __pool
+# =================================连接池区====================================
+
+
+# 对aiomysql连接池的包装，记录每个连接池的统计信息
+# 主库和每个从库各有一个DbPool
+# 取连接时记录等待时间，连接池满了以后取连接要排队，等待时间变长说明连接池不够用了
+# acquire_timeout不为None时，等待超过这个秒数会抛出asyncio.TimeoutError，不会一直卡住请求
+# maxsize是同时使用的连接数的上限，可以用set_maxsize调整(见PoolController)，不能超过aiomysql连接池的maxsize
+# aiomysql没有提供修改最大连接数的接口，所以aiomysql连接池按允许的最大值创建，由DbPool限制实际使用的连接数
+class DbPool(object):
+
+    def __init__(self, name, pool, weight=1, acquire_timeout=None, maxsize=None, wait_samples=1000):
+        self.name = name
+        self.pool = pool
+        self.weight = weight  # 从库的权重，读请求按权重分配
+        self.acquire_timeout = acquire_timeout
+        self.maxsize = pool.maxsize if maxsize is None else min(maxsize, pool.maxsize)
+        self.in_use = 0  # 已经取出、还没有放回的连接数
+        self._waiters = []  # 等待in_use低于maxsize的协程
+        self.healthy = True
+        self.counts = dict(reads=0, writes=0, errors=0, failovers=0, health_checks=0, acquires=0, timeouts=0)
+        self.query_time = 0.0  # 在这个连接池上执行查询的总耗时(秒)
+        self.wait_time = 0.0  # 取连接的总等待时间(秒)
+        self.waiting = 0  # 正在等待连接的协程数
+        self.last_error = None
+        self.controller = None  # 自动调整连接池大小，见PoolController
+        self.warmup = None  # 预热的结果，见warm_up
+        self._waits = deque(maxlen=wait_samples)  # 最近的取连接等待时间(秒)
+        self._recent_waits = []  # PoolController上次调整以后的等待时间
+        self._connections = weakref.WeakSet()  # 用过的连接，用来统计打开过多少个连接
+        self.connections_opened = 0
+
+    async def acquire(self):
+        start = time.time()
+        self.waiting += 1
+        try:
+            if self.acquire_timeout is None:
+                conn = await self._acquire()
+            else:
+                conn = await asyncio.wait_for(self._acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.counts['timeouts'] += 1
+            logging.warning('timed out waiting %ss for a connection of database pool %s', self.acquire_timeout, self.name)
+            raise
+        finally:
+            self.waiting -= 1
+        wait = time.time() - start
+        self.counts['acquires'] += 1
+        self.wait_time += wait
+        self._waits.append(wait)
+        self._recent_waits.append(wait)
+        if conn not in self._connections:
+            self._connections.add(conn)
+            self.connections_opened += 1
+        return conn
+
+    # 等正在使用的连接数低于maxsize，再从aiomysql的连接池取连接
+    async def _acquire(self):
+        while self.in_use >= self.maxsize:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                self._waiters.remove(waiter)
+        self.in_use += 1
+        try:
+            return await self.pool.acquire()
+        except BaseException:
+            self._put_back()
+            raise
+
+    # 最大连接数调小以后，打开的连接可能比maxsize多，多出来的连接放回时直接关掉
+    def release(self, conn):
+        if self.pool.size > self.maxsize:
+            conn.close()
+        self.pool.release(conn)
+        self._put_back()
+
+    def _put_back(self):
+        self.in_use -= 1
+        self._wake()
+
+    # 唤醒所有等待的协程，让它们重新检查in_use
+    def _wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    # 调整同时使用的连接数上限，不超过aiomysql连接池的maxsize
+    # 调小时不会马上关闭多出来的空闲连接，它们被取出、放回时由release关掉
+    def set_maxsize(self, maxsize):
+        self.maxsize = min(maxsize, self.pool.maxsize)
+        self._wake()
+
+    @contextlib.asynccontextmanager
+    async def get(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    # 记录一次查询，kind是'reads'或'writes'
+    def record(self, kind, elapsed):
+        self.counts[kind] += 1
+        self.query_time += elapsed
+
+    # 查询出错(连接断开、连不上)，标记为不可用，等健康检查通过后再恢复
+    def failed(self, e):
+        self.counts['errors'] += 1
+        self.last_error = str(e)
+        if self.healthy:
+            logging.warning('database pool %s is down: %s', self.name, e)
+        self.healthy = False
+
+    # 预热：同时取出size个连接，让连接池把连接都建好(TCP连接、登录认证)，每个连接执行一次query检查是否可用
+    # 再在其中一个连接上执行一遍statements，让MySQL提前打开这些表、检查表结构和Model是否一致
+    # 没通过检查的连接直接关掉，不放回连接池，全部没通过时抛出异常
+    async def warm_up(self, size, query='select 1', statements=()):
+        start = time.time()
+        size = min(size, self.maxsize or size)
+        conns, invalid = [], 0
+        try:
+            for _ in range(size):
+                conns.append(await self.acquire())
+            for conn in conns:
+                try:
+                    async with conn.cursor() as cur:
+                        await cur.execute(query)
+                        await cur.fetchall()
+                except (aiomysql.OperationalError, aiomysql.InterfaceError) as e:
+                    logging.warning('database pool %s: closing connection that failed validation: %s', self.name, e)
+                    conn.close()
+                    invalid += 1
+            valid = [conn for conn in conns if not conn.closed]
+            if not valid:
+                raise RuntimeError('database pool %s: no connection passed validation' % self.name)
+            async with valid[0].cursor() as cur:
+                for sql in statements:
+                    await cur.execute(sql)
+                    await cur.fetchall()
+        finally:
+            for conn in conns:
+                self.release(conn)
+        self.warmup = dict(connections=size - invalid, invalid=invalid, statements=len(statements), elapsed_ms=(time.time() - start) * 1000)
+        logging.info('database pool %s warmed up: %s connections, %s statements in %.1fms', self.name, size - invalid, len(statements), self.warmup['elapsed_ms'])
+        return self.warmup
+
+    # 返回PoolController上次调整以后的等待时间，并清空
+    def take_recent_waits(self):
+        waits, self._recent_waits = self._recent_waits, []
+        return waits
+
+    # 统计信息：连接数(正在使用的、空闲的)、等待连接的协程数、取连接等待时间的分位数(毫秒)、平均每个连接执行的查询数等
+    def stats(self):
+        samples = sorted(self._waits)
+        def percentile(p):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+        queries = self.counts['reads'] + self.counts['writes']
+        return dict(self.counts, name=self.name, weight=self.weight, healthy=self.healthy,
+                    size=self.pool.size, maxsize=self.maxsize, in_use=self.in_use,
+                    idle=self.pool.freesize, waiting=self.waiting,
+                    query_time_ms=self.query_time * 1000, wait_time_ms=self.wait_time * 1000,
+                    wait_p50_ms=percentile(0.5), wait_p95_ms=percentile(0.95), wait_p99_ms=percentile(0.99),
+                    wait_max_ms=samples[-1] * 1000 if samples else 0.0,
+                    connections_opened=self.connections_opened, warmup=self.warmup,
+                    queries_per_connection=queries / self.connections_opened if self.connections_opened else 0.0,
+                    last_error=self.last_error)
+
+
+# 根据取连接的等待时间自动调整连接池的最大连接数，每隔interval秒检查一次：
+# 这段时间内等待时间的p95超过target_wait_ms毫秒(或者有取连接超时)时，最大连接数增加step，但不超过max_size
+# p95不到target_wait_ms的四分之一并且有空闲连接时，最大连接数减一，但不少于min_size
+class PoolController(object):
+
+    def __init__(self, pool, min_size, max_size, target_wait_ms=5.0, interval=10.0, step=2):
+        self.pool = pool
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_wait = target_wait_ms / 1000.0
+        self.interval = interval
+        self.step = step
+        self.resizes = 0
+        self._timeouts = pool.counts['timeouts']
+        self._task = None
+
+    def start(self, loop):
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.adjust()
+            except Exception as e:
+                logging.exception(e)
+
+    def adjust(self):
+        waits = sorted(self.pool.take_recent_waits())
+        timeouts, self._timeouts = self.pool.counts['timeouts'] - self._timeouts, self.pool.counts['timeouts']
+        p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        maxsize = self.pool.maxsize
+        if (p95 > self.target_wait or timeouts) and maxsize < self.max_size:
+            self.resize(min(self.max_size, maxsize + self.step), p95)
+        elif p95 < self.target_wait / 4 and self.pool.in_use < maxsize and maxsize > self.min_size:
+            self.resize(maxsize - 1, p95)
+
+    def resize(self, maxsize, p95):
+        logging.info('database pool %s: maxsize %s => %s (p95 wait %.1fms)', self.pool.name, self.pool.maxsize, maxsize, p95 * 1000)
+        self.pool.set_maxsize(maxsize)
+        self.resizes += 1
+
+    def stats(self):
+        return dict(min_size=self.min_size, max_size=self.max_size, target_wait_ms=self.target_wait * 1000, resizes=self.resizes)
+
+
+# 从库集合，用平滑加权轮询(smooth weighted round-robin，和nginx一样)选择从库，只在健康的从库之间分配
+# 定期对每个从库执行select 1，失败的从库暂时不再分配读请求，恢复后重新加入
+class ReplicaSet(object):
+
+    def __init__(self):
+        self.pools = []
+        self._current = {}  # DbPool -> 当前权重
+        self._task = None
+
+    def __len__(self):
+        return len(self.pools)
+
+    def add(self, pool):
+        self.pools.append(pool)
+        self._current[pool] = 0
+
+    # 选择一个健康的从库，都不可用时返回None
+    def choose(self):
+        best, total = None, 0
+        for pool in self.pools:
+            if not pool.healthy:
+                continue
+            self._current[pool] += pool.weight
+            total += pool.weight
+            if best is None or self._current[pool] > self._current[best]:
+                best = pool
+        if best is not None:
+            self._current[best] -= total
+        return best
+
+    async def check(self, pool, timeout):
+        pool.counts['health_checks'] += 1
+        try:
+            await asyncio.wait_for(self._ping(pool), timeout)
+        except Exception as e:
+            pool.failed(e)
+            return
+        if not pool.healthy:
+            logging.info('database pool %s is up again', pool.name)
+            pool.healthy = True
+
+    async def _ping(self, pool):
+        async with pool.get() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute('select 1')
+
+    # 每隔interval秒检查一次所有从库
+    def start(self, loop, interval, timeout=2.0):
+        self._task = loop.create_task(self._check_forever(interval, timeout))
+
+    async def _check_forever(self, interval, timeout):
+        while True:
+            await asyncio.sleep(interval)
+            for pool in self.pools:
+                await self.check(pool, timeout)
+
+
+# 从库，没有配置时所有查询都在主库上执行
+_replicas = ReplicaSet()
+
+# 当前请求(Task)是否写过数据库，写过以后的读请求都发到主库，保证能读到自己刚写入的数据(read-your-writes)
+# aiohttp的每个请求在一个单独的Task里处理，contextvars不会影响其他请求
+_use_primary = contextvars.ContextVar('use_primary', default=False)
+
+
+# 让当前请求接下来的查询都在主库上执行，需要读到最新数据时使用：
+#   orm.use_primary()
+#   user = await User.find(uid)
+def use_primary():
+    _use_primary.set(True)
+
+
+# 选择执行读请求的连接池
+def _read_pool():
+    if _use_primary.get():
+        return __pool
+    return _replicas.choose() or __pool
+
+
+# 用kw里的参数创建一个aiomysql连接池
+async def _open_pool(loop, kw):
     # 调用一个自协程来创建全局连接池，create_pool的返回值是一个pool实例对象
-    __pool = await aiomysql.create_pool(
+    return await aiomysql.create_pool(
         # 下面就是创建数据库连接需要用到的一些参数，从**kw（关键字参数）中取出来
         # kw.get的作用应该是，当没有传入参数是，默认参数就是get函数的第二项
         host=kw.get('host', 'localhost'),  # 数据库服务器位置，默认设在本地
@@ -33,48 +332,316 @@ async def create_pool(loop, **kw):
         db=kw['db'],  # 当前数据库名
         charset=kw.get('charset', 'utf8'),  # 设置编码格式，默认为utf-8
         autocommit=kw.get('autocommit', True),  # 自动提交模式，设置默认开启
-        maxsize=kw.get('maxsize', 10),  # 最大连接数默认设为10
+        # 最大连接数默认设为10，自动调整连接池大小时按调整的上限创建，实际使用的连接数由DbPool.maxsize限制
+        maxsize=max(kw.get('maxsize', 10), (kw.get('autosize') or {}).get('max_size', 0)),
         minsize=kw.get('minsize', 1),  # 最小连接数，默认设为1，这样可以保证任何时候都会有一个数据库连接
         loop=loop  # 传递消息循环对象，用于异步执行
     )
 
+
+# 打开从库的连接池，连不上时不影响启动：换成minsize=0打开(不会马上建立连接)，并标记为不可用
+# 之后健康检查能连上时才开始给它分配读请求
+async def _open_replica(loop, name, options):
+    try:
+        pool = await _open_pool(loop, options)
+        error = None
+    except Exception as e:
+        pool = await _open_pool(loop, dict(options, minsize=0))
+        error = e
+    replica = DbPool(name, pool, options.get('weight', 1), options.get('acquire_timeout'), options.get('maxsize', 10))
+    if error is not None:
+        replica.failed(error)
+    return replica
+
+
+# 创建全局连接池
+# 这个函数将来会在app.py的init函数中引用
+# 目的是为了让每个HTTP请求都能s从连接池中直接获取数据库连接
+# 避免了频繁关闭和打开数据库连接
+# replicas是从库的列表，每一项是一个dict，没有写的参数(user、password、db等)和主库一样，weight是分配读请求的权重：
+#   replicas=[{'host': '10.0.0.2', 'weight': 2}, {'host': '10.0.0.3'}]
+# 有从库时，select和流式查询按权重发到健康的从库，写过数据库的请求、事务里的查询都在主库上执行
+async def create_pool(loop, **kw):
+    logging.info('创建连接池...')
+    # 声明变量__pool是一个全局变量，如果不加声明，__pool就会被默认为一个私有变量，不能被其他函数引用
+    global __pool
+    __pool = DbPool('primary', await _open_pool(loop, kw), acquire_timeout=kw.get('acquire_timeout'), maxsize=kw.get('maxsize', 10))
+    replicas = kw.pop('replicas', None) or ()
+    for i, replica in enumerate(replicas):
+        options = dict(kw, **replica)
+        logging.info('创建从库连接池：%s:%s', options.get('host', 'localhost'), options.get('port', 3306))
+        _replicas.add(await _open_replica(loop, replica.get('name', 'replica%s' % (i + 1)), options))
+    if replicas:
+        _replicas.start(loop, kw.get('health_interval', 5.0))
+    # warmup大于0时，在开始接受请求之前先打开这么多个连接，检查连接是否可用，并把每个Model的select语句执行一遍(limit 0)
+    # 这样部署以后的第一批请求不用等着建立连接，表结构和Model不一致时也能在启动时就发现
+    # 返回每个连接池的预热结果，包括用了多少毫秒
+    warmups = []
+    warmup = kw.get('warmup', 0)
+    if warmup:
+        statements = ['%s limit 0' % model.__select__ for model in Model.__subclasses__()]
+        warmups.append(await __pool.warm_up(warmup, kw.get('warmup_query', 'select 1'), statements))
+        # 从库预热失败不影响启动，标记为不可用，等健康检查通过
+        for pool in _replicas.pools:
+            if not pool.healthy:
+                continue
+            try:
+                warmups.append(await pool.warm_up(warmup, kw.get('warmup_query', 'select 1'), statements))
+            except Exception as e:
+                pool.failed(e)
+    # autosize不为None时自动调整每个连接池的最大连接数，是传给PoolController的参数，比如{'min_size': 5, 'max_size': 50}
+    autosize = kw.get('autosize')
+    if autosize:
+        for pool in [__pool] + _replicas.pools:
+            pool.controller = PoolController(pool, **autosize)
+            pool.controller.start(loop)
+    return warmups
+
+
+# 所有连接池的统计信息
+def pool_stats():
+    stats = []
+    for pool in [__pool] + _replicas.pools:
+        s = pool.stats()
+        if pool.controller is not None:
+            s['autosize'] = pool.controller.stats()
+        stats.append(s)
+    return stats
+
+# =================================SQL统计区====================================
+
+
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_ROWS_RE = re.compile(r'\(\?\+\)(?:\s*,\s*\(\?\+\))+')
+_SPACE_RE = re.compile(r'\s+')
+
+
+# SQL的指纹：去掉参数以后的语句，同一个指纹的语句只是参数不同
+# 字符串和数字换成?，in (?, ?, ?)这样的列表和多行insert的values不管有多少项都写成(?+)
+def fingerprint(sql):
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _LIST_RE.sub('(?+)', sql)
+    sql = _ROWS_RE.sub('(?+)', sql)
+    return _SPACE_RE.sub(' ', sql).strip().lower()
+
+
+# 按指纹统计每种语句的执行次数、耗时和返回(或影响)的行数
+# 执行时间超过slow_ms毫秒的语句记录到慢查询日志里(包括参数)，explain为True时还会在后台对慢的select执行一次EXPLAIN
+class QueryStats(object):
+
+    def __init__(self, slow_ms=None, explain=False, samples=1000, explain_interval=60.0):
+        self.slow = None if slow_ms is None else slow_ms / 1000.0
+        self.explain = explain
+        self.samples = samples  # 每个指纹保留最近多少次的耗时，用来计算分位数
+        self.explain_interval = explain_interval  # 同一个指纹多少秒内最多EXPLAIN一次
+        self.slow_queries = 0
+        self._stats = {}  # 指纹 -> 统计
+        self._fingerprints = {}  # sql -> 指纹，Model生成的sql都是固定的几种，不用每次都重新计算
+        self._explained = {}  # 指纹 -> 上次EXPLAIN的时间
+
+    def record(self, sql, args, elapsed, rows):
+        fp = self._fingerprints.get(sql)
+        if fp is None:
+            if len(self._fingerprints) >= 4096:
+                self._fingerprints.clear()
+            fp = self._fingerprints[sql] = fingerprint(sql)
+        st = self._stats.get(fp)
+        if st is None:
+            st = self._stats[fp] = dict(count=0, total=0.0, max=0.0, rows=0, slow=0, times=deque(maxlen=self.samples))
+        st['count'] += 1
+        st['total'] += elapsed
+        st['rows'] += rows if rows and rows > 0 else 0
+        st['times'].append(elapsed)
+        if elapsed > st['max']:
+            st['max'] = elapsed
+        if self.slow is not None and elapsed >= self.slow:
+            st['slow'] += 1
+            self.slow_queries += 1
+            logging.warning('slow query (%.1fms, %s rows): %s; args: %r', elapsed * 1000, rows, sql, args)
+            if self.explain and fp.startswith('select') and time.time() - self._explained.get(fp, 0) > self.explain_interval:
+                self._explained[fp] = time.time()
+                asyncio.ensure_future(self._explain(sql, args))
+
+    # 在主库上执行EXPLAIN，结果写到日志里
+    async def _explain(self, sql, args):
+        try:
+            conn = await _acquire()
+            try:
+                async with conn.cursor(aiomysql.DictCursor) as cur:
+                    await cur.execute('explain ' + sql.replace('?', '%s'), args or ())
+                    plan = await cur.fetchall()
+            finally:
+                _release(conn)
+            logging.warning('explain %s:\n%s', sql, '\n'.join(map(str, plan)))
+        except Exception as e:
+            logging.warning('explain failed for %s: %s', sql, e)
+
+    # 返回所有指纹的统计，按总耗时从高到低排列，耗时单位是毫秒
+    def dump(self, limit=None):
+        result = []
+        for fp, st in self._stats.items():
+            times = sorted(st['times'])
+            result.append(dict(sql=fp, count=st['count'], total_ms=st['total'] * 1000,
+                               avg_ms=st['total'] * 1000 / st['count'],
+                               p50_ms=times[int(len(times) * 0.5)] * 1000,
+                               p95_ms=times[min(len(times) - 1, int(len(times) * 0.95))] * 1000,
+                               max_ms=st['max'] * 1000, rows=st['rows'], slow=st['slow']))
+        result.sort(key=lambda r: r['total_ms'], reverse=True)
+        return result[:limit] if limit else result
+
+    def reset(self):
+        self._stats.clear()
+        self.slow_queries = 0
+
+
+# 全局的SQL统计，select、execute等函数执行的每条语句都会记录到这里
+_query_stats = QueryStats()
+
+
+# 设置慢查询阈值(毫秒，None表示不记录慢查询)和是否EXPLAIN，这个函数在app.py的init函数中调用
+def init_query_stats(slow_ms=None, explain=False, **kw):
+    global _query_stats
+    _query_stats = QueryStats(slow_ms, explain, **kw)
+    return _query_stats
+
+
+# 按总耗时从高到低返回每种语句的统计信息，可以看出哪些ORM调用占用了最多的数据库时间
+def query_stats(limit=None):
+    return _query_stats.dump(limit)
+
 # =================================以下是SQL函数处理区====================================
 # select和execute方法是实现其他Model类中SQL语句都经常要用的方法
 
+
+# 在conn上执行查询，返回结果集
+async def _fetch(conn, sql, args, size, as_tuple):
+    # 等待连接对象返回DictCursor可以通过dict的方式获取数据库对象，需要通过游标对象执行SQL
+    async with conn.cursor(aiomysql.Cursor if as_tuple else aiomysql.DictCursor) as cur:
+        # 设置执行语句，其中sql语句的占位符为？，而python为%s, 这里要做一下替换
+        # args是sql语句的参数
+        start = time.time()
+        await cur.execute(sql.replace('?', '%s'), args or ())
+        # 如果制定了查询数量，则查询制定数量的结果，如果不指定则查询所有结果
+        if size:
+            rs = await cur.fetchmany(size)  # 从数据库获取指定的行数
+        else:
+            rs = await cur.fetchall()  # 返回所有结果集
+        _query_stats.record(sql, args, time.time() - start, len(rs))
+    logging.info("返回的行数：%s", len(rs))
+    return rs  # 返回结果集
+
+
 # 将执行SQL的代码封装仅select函数，调用的时候只要传入sql，和sql所需要的一些参数就好
 # sql参数即为sql语句，args表示要搜索的参数
 # size用于指定最大的查询数量，不指定将返回所有查询结果
-async def select(sql, args, size=None):
+# as_tuple为True时每行返回一个tuple而不是dict，省去按列名建dict的开销，Model的查询方法都用这种方式，见Model._hydrator
+# 有从库时查询发到从库，从库出错时标记为不可用，改到主库上重新查询
+async def select(sql, args, size=None, as_tuple=False):
     log(sql, args)
-    # 声明全局变量，这样才能引用create_pool函数创建的__pool变量
-    global __pool
+    tx = _transaction.get()
+    if tx is not None:
+        await tx.flush()  # 先把事务里还没写入的修改写进去，这样才能查到
+        return await _fetch(tx.conn, sql, args, size, as_tuple)
+    pool = _read_pool()
+    if pool is not __pool:
+        start = time.time()
+        try:
+            # 用with语句可以封装清理（关闭conn)和处理异常工作
+            async with pool.get() as conn:
+                rs = await _fetch(conn, sql, args, size, as_tuple)
+            pool.record('reads', time.time() - start)
+            return rs
+        except (aiomysql.OperationalError, aiomysql.InterfaceError) as e:
+            pool.failed(e)
+            pool.counts['failovers'] += 1
+    start = time.time()
     # 从连接池中获得一个数据库连接
-    # 用with语句可以封装清理（关闭conn)和处理异常工作
     async with __pool.get() as conn:
-        # 等待连接对象返回DictCursor可以通过dict的方式获取数据库对象，需要通过游标对象执行SQL
-        async with conn.cursor(aiomysql.DictCursor) as cur:
-            # 设置执行语句，其中sql语句的占位符为？，而python为%s, 这里要做一下替换
-            # args是sql语句的参数
-            await cur.execute(sql.replace('?', '%s'), args or ())
-            # 如果制定了查询数量，则查询制定数量的结果，如果不指定则查询所有结果
-            if size:
-                rs = await cur.fetchmany(size)  # 从数据库获取指定的行数
-            else:
-                rs = await cur.fetchall()  # 返回所有结果集
-        logging.info("返回的行数：%s" % len(rs))
-        return rs  # 返回结果集
+        rs = await _fetch(conn, sql, args, size, as_tuple)
+    __pool.record('reads', time.time() - start)
+    return rs
+
+# 流式查询，用服务器端游标(SSCursor)每次从数据库读batch_size行，逐行yield出tuple
+# 和select不同，结果集不会一次性读进内存，适合导出整张表这类大查询
+# 流式查询总是从连接池取一个新连接(有从库时用从库)，不使用进行中的事务，读不到事务里还没提交的修改
+# 结果集没读完就退出时(break、异常)，连接上还有没读完的数据，不能直接放回连接池，只能关掉
+async def select_stream(sql, args, batch_size=100):
+    log(sql, args)
+    pool = _read_pool()
+    conn = await pool.acquire()
+    finished = False
+    elapsed, rows = 0.0, 0  # 只统计等待数据库的时间，不包括调用者处理每一行的时间
+    try:
+        cur = await conn.cursor(aiomysql.SSCursor)
+        start = time.time()
+        await cur.execute(sql.replace('?', '%s'), args or ())
+        elapsed += time.time() - start
+        while True:
+            start = time.time()
+            rs = await cur.fetchmany(batch_size)
+            elapsed += time.time() - start
+            if not rs:
+                break
+            rows += len(rs)
+            for r in rs:
+                yield r
+        await cur.close()
+        finished = True
+    finally:
+        if not finished:
+            conn.close()
+        pool.release(conn)
+        pool.record('reads', elapsed)
+        _query_stats.record(sql, args, elapsed, rows)
+
+
+# Model.stream()的返回值，既可以直接用async for遍历，也可以用async with保证提前退出时马上释放连接：
+#   async with Comment.stream() as comments:
+#       async for comment in comments:
+#           ...
+# 只用async for的话，提前break后要等这个对象被回收时才会释放连接
+class ResultStream(object):
+
+    def __init__(self, rows, factory):
+        self._rows = rows
+        self._factory = factory
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return self._factory(await self._rows.__anext__())
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    # 关闭服务器端游标，释放连接
+    async def aclose(self):
+        await self._rows.aclose()
 
 # 定义execute()函数执行insert update delete语句
 async def execute(sql, args, autocommit=True):
     # execute()函数只返回结果数，不返回结果集，适用于insert, update这些语句
     log(sql)
-    async with __pool.get() as conn:
+    tx = _transaction.get()
+    if tx is not None:
+        await tx.flush()  # 先写入事务里记下的操作，保持写入的先后顺序
+        autocommit = True  # 在事务里执行时，由事务负责begin和commit
+    async with _connection() as conn:
         if not autocommit:
             await conn.begin()
         try:
             async with conn.cursor(aiomysql.DictCursor) as cur:
+                start = time.time()
                 await cur.execute(sql.replace('?', '%s'), args)
                 affected = cur.rowcount  # 返回受影响的行数
+                _query_stats.record(sql, args, time.time() - start, affected)
             if not autocommit:
                 await conn.commit()
         except BaseException as e:
@@ -83,6 +650,355 @@ async def execute(sql, args, autocommit=True):
             raise
         return affected
 
+# 在同一个连接、同一个事务里依次执行多条insert update delete语句，返回受影响的总行数
+# statements是(sql, args)的列表，任何一条出错都会回滚整个事务，适合批量写入
+# 在事务里调用时直接使用事务的连接，由事务负责提交和回滚，执行前先写入事务里记下的操作
+async def execute_batch(statements):
+    tx = _transaction.get()
+    if tx is not None:
+        await tx.flush()
+    return await _execute_batch(statements)
+
+
+# execute_batch的实现，Transaction.flush直接调用它，不能再反过来flush
+async def _execute_batch(statements):
+    affected = 0
+    own = _transaction.get() is None
+    async with _connection() as conn:
+        if own:
+            await conn.begin()
+        try:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                for sql, args in statements:
+                    log(sql)
+                    start = time.time()
+                    await cur.execute(sql.replace('?', '%s'), args)
+                    affected += cur.rowcount
+                    _query_stats.record(sql, args, time.time() - start, cur.rowcount)
+            if own:
+                await conn.commit()
+        except BaseException as e:
+            if own:
+                await conn.rollback()
+            raise
+    return affected
+
+# =================================事务区====================================
+
+# 当前协程(Task)所在的事务，用contextvars保存，每个请求的Task互不影响
+_transaction = contextvars.ContextVar('transaction', default=None)
+
+
+# 执行写入语句用的连接：有进行中的事务时使用事务的连接，否则从主库的连接池取一个连接，用完放回
+# 写过以后，当前请求接下来的查询都发到主库，见_use_primary
+@contextlib.asynccontextmanager
+async def _connection():
+    _use_primary.set(True)
+    start = time.time()
+    tx = _transaction.get()
+    if tx is not None:
+        yield tx.conn
+    else:
+        async with __pool.get() as conn:
+            yield conn
+    __pool.record('writes', time.time() - start)
+
+
+def _acquire():
+    return __pool.acquire()
+
+
+def _release(conn):
+    __pool.release(conn)
+
+
+# 事务，同时也是一个unit of work：
+#   async with orm.transaction():
+#       await blog.update()
+#       await comment.save()
+# 事务里的select、execute都使用同一个连接，退出时一起提交，出现异常时全部回滚
+# 事务里调用Model的save、update、remove不会马上执行，只是记下来，在提交前(或者事务里执行查询前)一次性写入
+# 连续的同类操作合并成一条语句：多个save合并成多行insert，多个remove合并成where `id` in (...)，多个update用同一个连接依次执行
+# 所以事务里的save、update、remove不会检查受影响的行数是否为1，只在写入时检查每一组的总数
+class Transaction(object):
+
+    def __init__(self):
+        self.conn = None
+        self._pending = []  # [(操作, Model类, sql, [对象])]，连续的同类操作合并在一起
+        self._written = []  # [(Model类, 操作, [对象], 受影响的行数是否正确)]，提交后传给_written
+        self._token = None
+
+    async def __aenter__(self):
+        if _transaction.get() is not None:
+            raise RuntimeError('transaction already in progress')
+        self.conn = await _acquire()
+        try:
+            await self.conn.begin()
+        except BaseException:
+            _release(self.conn)
+            raise
+        self._token = _transaction.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        committed = False
+        try:
+            if exc_type is None:
+                try:
+                    await self.flush()
+                    await self.conn.commit()
+                    committed = True
+                except BaseException:
+                    await self.conn.rollback()
+                    raise
+            else:
+                await self.conn.rollback()
+        finally:
+            _transaction.reset(self._token)
+            _release(self.conn)
+            self.conn = None
+        if committed:
+            for args in self._written:
+                await _written(*args)
+
+    # 记下一个save、update或者remove操作，和上一个操作相同(同一个Model，同样的sql)时合并
+    def add(self, op, obj, sql=None):
+        model = obj.__class__
+        if self._pending:
+            last = self._pending[-1]
+            if last[0] == op and last[1] is model and last[2] == sql:
+                last[3].append(obj)
+                return
+        self._pending.append((op, model, sql, [obj]))
+
+    # 把记下的操作写入数据库(还没有提交)
+    async def flush(self):
+        while self._pending:
+            op, model, sql, objs = self._pending.pop(0)
+            if op == 'save':
+                rows = await _execute_batch(model._insert_statements(objs))
+            elif op == 'update':
+                rows = await _execute_batch([(sql, obj._update_args()) for obj in objs])
+            else:
+                rows = await _execute_batch(model._delete_statements(objs))
+            if rows != len(objs):
+                logging.warn('%s %s: expected %s rows, affected rows: %s', op, model.__table__, len(objs), rows)
+            self.written(op, model, objs, rows == len(objs))
+
+    # 记下写入过的对象，提交以后再让查询缓存失效、更新行数统计，回滚时就不用处理了
+    def written(self, op, model, objs, ok):
+        self._written.append((model, op, objs, ok))
+
+
+def transaction():
+    return Transaction()
+
+
+# 表被写入(已经提交)以后调用，让查询缓存失效并更新行数统计
+# op是'save'、'update'或者'remove'，ok为False表示受影响的行数不对，这时这张表记录的行数全部作废
+async def _written(model, op, objs, ok):
+    table = model.__table__
+    await invalidate_cache(table)
+    if op == 'save':
+        _row_counts.changed(table, inserted=objs, reset=not ok)
+    elif op == 'remove':
+        _row_counts.changed(table, deleted=objs, reset=not ok)
+    else:
+        _row_counts.changed(table, updated=True, reset=not ok)
+
+# 查询结果缓存，见ormcache.py，为None时不缓存
+_query_cache = None
+
+
+# 根据配置创建查询结果缓存，这个函数在app.py的init函数中调用
+def init_cache(**kw):
+    global _query_cache
+    _query_cache = ormcache.create_cache(**kw)
+    return _query_cache
+
+
+# 带缓存的select，cache为False时直接查询，为True时使用缓存的默认过期时间，为数字时表示过期时间(秒)
+# 缓存的key是sql和args，table被写入(Model的save、update、remove)时这张表的所有缓存都会失效
+async def cached_select(table, cache, sql, args, size=None, as_tuple=False):
+    if not cache or _query_cache is None or _transaction.get() is not None:
+        # 事务里的查询能看到还没提交的修改，不能放进缓存，也不能用缓存
+        return await select(sql, args, size, as_tuple)
+    key = (sql, tuple(args or ()), size, as_tuple)
+    rs, token = await _query_cache.lookup(table, key)
+    if rs is not None:
+        return rs
+    rs = tuple(await select(sql, args, size, as_tuple))
+    await _query_cache.store(table, key, rs, token, None if cache is True else cache)
+    return rs
+
+
+# 让table的查询缓存失效
+async def invalidate_cache(table):
+    if _query_cache is not None:
+        await _query_cache.invalidate(table)
+
+# =================================行数统计区====================================
+# 首页、/api/blogs和/api/comments每次都要select count(*)整张表，InnoDB上这是一次完整的索引扫描
+# RowCounter把查过的行数记下来，Model的save、remove时直接加减，再定期用count(*)校正
+
+
+# 简单的条件：若干个 `field`=? 用and连接，比如'blog_id=?'，这种条件可以直接用对象的字段值判断
+_EQ_RE = re.compile(r'^`?(\w+)`?\s*=\s*\?$')
+_AND_RE = re.compile(r'\s+and\s+', re.I)
+
+
+# 把where和args解析成((字段名, 值), ...)，where为None时返回()，即匹配所有行，不是简单条件时返回None
+def _parse_predicate(model, where, args):
+    if where is None:
+        return ()
+    names = []
+    for part in _AND_RE.split(where.strip()):
+        m = _EQ_RE.match(part.strip())
+        if m is None or m.group(1) not in model.__mappings__:
+            return None
+        names.append(m.group(1))
+    if len(names) != len(args):
+        return None
+    return tuple(zip(names, args))
+
+
+# 判断对象是否满足简单条件，条件里的字段没有加载时(见findAll的defer参数)无法判断，返回None
+def _matches(obj, predicate):
+    for name, value in predicate:
+        if name not in obj:
+            return None
+        if obj[name] != value:
+            return False
+    return True
+
+
+class RowCounter(object):
+
+    def __init__(self, max_keys=256):
+        self.max_keys = max_keys  # 每张表最多记录多少个条件的行数
+        self.counts = dict(hits=0, misses=0, estimates=0, reconciled=0, drifted=0)
+        self._entries = {}  # table -> OrderedDict((where, args) -> [行数, 简单条件或None])
+        self._models = {}  # table -> Model类，校正时要用
+        self._generations = {}  # table -> 写入次数，和ormcache一样，count(*)期间表被写过时不保存结果
+        self._task = None
+
+    # 返回满足where条件的行数
+    # approximate为True且没有记录过整张表的行数时，用information_schema里的估计值(InnoDB的估计值误差可能有几十个百分点)
+    async def count(self, model, where=None, args=None, approximate=False):
+        table, args = model.__table__, tuple(args or ())
+        if _transaction.get() is not None:
+            # 事务里count(*)的结果包含还没提交的修改，不能记下来
+            return await self._select_count(model, where, args)
+        entry = self._entries.get(table, {}).get((where, args))
+        if entry is not None:
+            self.counts['hits'] += 1
+            return entry[0]
+        if approximate and where is None:
+            n = await self.estimate(model)
+            if n is not None:
+                self.counts['estimates'] += 1
+                return n
+        self.counts['misses'] += 1
+        generation = self._generations.get(table, 0)
+        n = await self._select_count(model, where, args)
+        if generation == self._generations.get(table, 0):
+            self._models[table] = model
+            entries = self._entries.setdefault(table, OrderedDict())
+            entries[(where, args)] = [n, _parse_predicate(model, where, args)]
+            while len(entries) > self.max_keys:
+                entries.popitem(last=False)
+        return n
+
+    async def _select_count(self, model, where, args):
+        sql = 'select count(*) from `%s`' % model.__table__
+        if where:
+            sql = '%s where %s' % (sql, where)
+        # 记下来的行数之后会直接加减，必须是准确的，所以在主库上查询，不用有延迟的从库
+        token = _use_primary.set(True)
+        try:
+            rs = await select(sql, args, 1, as_tuple=True)
+        finally:
+            _use_primary.reset(token)
+        return rs[0][0]
+
+    # information_schema.tables.table_rows，不需要扫描表
+    async def estimate(self, model):
+        rs = await select('select table_rows from information_schema.tables where table_schema=database() and table_name=?', [model.__table__], 1, as_tuple=True)
+        if len(rs) == 0 or rs[0][0] is None:
+            return None
+        return int(rs[0][0])
+
+    # 表被写入后调用，inserted和deleted是插入和删除的对象，简单条件的行数直接加减，其他条件的行数丢掉下次重新查
+    # updated为True时不知道对象原来的字段值，只保留整张表的行数；reset为True(受影响的行数不对)时全部丢掉
+    def changed(self, table, inserted=(), deleted=(), updated=False, reset=False):
+        self._generations[table] = self._generations.get(table, 0) + 1
+        entries = self._entries.get(table)
+        if not entries:
+            return
+        for key, entry in list(entries.items()):
+            predicate = entry[1]
+            if reset or predicate is None or (updated and predicate):
+                del entries[key]
+                continue
+            delta = 0
+            for objs, sign in ((inserted, 1), (deleted, -1)):
+                for obj in objs:
+                    m = _matches(obj, predicate)
+                    if m is None:
+                        break
+                    delta += sign if m else 0
+                else:
+                    continue
+                delta = None
+                break
+            if delta is None:
+                del entries[key]
+            else:
+                entry[0] += delta
+
+    # 用count(*)校正所有记录的行数，其他进程的写入和不经过Model的写入都会在这里被纠正
+    async def reconcile(self):
+        for table, entries in list(self._entries.items()):
+            model = self._models[table]
+            for key in list(entries):
+                generation = self._generations.get(table, 0)
+                n = await self._select_count(model, *key)
+                entry = entries.get(key)
+                if entry is None or generation != self._generations.get(table, 0):
+                    continue
+                self.counts['reconciled'] += 1
+                if entry[0] != n:
+                    self.counts['drifted'] += 1
+                    logging.info('row count of %s (%s) drifted: %s => %s', table, key[0] or 'all', entry[0], n)
+                    entry[0] = n
+
+    # 每隔interval秒校正一次
+    def start(self, loop, interval):
+        self._task = loop.create_task(self._reconcile_forever(interval))
+
+    async def _reconcile_forever(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logging.exception(e)
+
+    def stats(self):
+        return dict(self.counts, keys=sum(map(len, self._entries.values())))
+
+
+# 全局的行数统计，Model.count()使用
+_row_counts = RowCounter()
+
+
+# 设置行数统计，reconcile_interval秒校正一次，为None时不校正，这个函数在app.py的init函数中调用
+def init_counts(loop, reconcile_interval=60.0, max_keys=256):
+    _row_counts.max_keys = max_keys
+    if reconcile_interval is not None:
+        _row_counts.start(loop, reconcile_interval)
+    return _row_counts
+
 # 这个函数在元类中被引用，作用是创建一定数量的占位符
 def create_args_string(num):
     L = []
@@ -146,14 +1062,14 @@ class ModelMetaclass(type):
             return type.__new__(cls, name, bases, attrs)
         # 获取table名称
         tableName = attrs.get('__table__', None) or name
-        logging.info('found model: %s (table: %s)' % (name, tableName))
+        logging.info('found model: %s (table: %s)', name, tableName)
         # 获取所有定义域中的属性和主键
         mappings = dict()
         fields = []
         primaryKey = None
         for k, v in attrs.items():
             if isinstance(v, Field):
-                logging.info('  found mapping: %s ==> %s' % (k, v))
+                logging.info('  found mapping: %s ==> %s', k, v)
                 mappings[k] = v
                 # 先判断找到的映射是不是主键
                 if v.primary_key:
@@ -180,13 +1096,86 @@ class ModelMetaclass(type):
         attrs['__insert__'] = 'insert into `%s` (%s, `%s`) values (%s)' % (tableName, ', '.join(escaped_fields), primaryKey, create_args_string(len(escaped_fields) + 1))
         attrs['__update__'] = 'update `%s` set %s where `%s`=?' % (tableName, ', '.join(map(lambda f: '`%s`=?' % (mappings.get(f).name or f), fields)), primaryKey)
         attrs['__delete__'] = 'delete from `%s` where `%s`=?' % (tableName, primaryKey)
-        return type.__new__(cls, name, bases, attrs)
+        model = type.__new__(cls, name, bases, attrs)
+        # 同时生成这个Model对应的紧凑行类型，比如Blog.Row，见ModelRow
+        model.Row = type('%sRow' % name, (ModelRow,), {'__slots__': tuple([primaryKey] + fields), '__model__': model})
+        return model
 
 
 
 # =====================================Model基类区==========================================
 
 
+# Model._hydrator生成的函数，key是(Model类, 列名, 是否compact)
+_hydrators = {}
+
+
+# 生成把一行tuple变成cls对象的函数
+# Model继承自dict，直接用zip把列名和值填进去；ModelRow用__slots__，生成一个按位置给属性赋值的函数
+# 这两种方式都跳过了__init__，Model的子类不应该在__init__里做额外的事情
+def _make_hydrator(cls, columns, deferred):
+    if issubclass(cls, ModelRow):
+        ns = {'new': object.__new__, 'cls': cls}
+        targets = ', '.join('o.%s' % c for c in columns)
+        exec('def hydrate(row):\n    o = new(cls)\n    %s, = row\n    return o\n' % targets, ns)
+        return ns['hydrate']
+    new, fill = dict.__new__, dict.update
+    if not deferred:
+        def hydrate(row):
+            obj = new(cls)
+            fill(obj, zip(columns, row))
+            return obj
+    else:
+        def hydrate(row):
+            obj = new(cls)
+            fill(obj, zip(columns, row))
+            obj.__dict__['_deferred'] = deferred
+            return obj
+    return hydrate
+
+
+# 紧凑的只读行对象，由ModelMetaclass根据__mappings__为每个Model生成一个子类(比如Blog.Row)
+# 用__slots__保存字段，没有dict的哈希表开销，访问属性也不用走__getattr__和KeyError
+# 大量读取、只用来显示的查询可以用findAll(..., compact=True)得到这种对象，需要保存修改时用to_model()转换
+class ModelRow(object):
+    __slots__ = ()
+
+    def __init__(self, **kw):
+        for k, v in kw.items():
+            setattr(self, k, v)
+
+    # 和Model一样支持row['name']的写法
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    # 转换成dict，用于JSON序列化，没有查询的字段(见findAll的only和defer参数)不会出现在结果里
+    def to_dict(self):
+        d = {}
+        for k in self.__slots__:
+            try:
+                d[k] = getattr(self, k)
+            except AttributeError:
+                pass
+        return d
+
+    # 转换成对应的Model对象，以便调用update()、remove()
+    def to_model(self):
+        d = self.to_dict()
+        return self.__model__._from_row(d, frozenset(self.__slots__).difference(d))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join('%s=%r' % kv for kv in self.to_dict().items()))
+
+
 # 定义所有ORM映射的基类Model， 使他既可以像字典那样通过[]访问key值，也可以通过.访问key值
 # 继承dict是为了使用方便，例如对象实例user['id']即可轻松通过UserModel去数据库获取到id
 # 元类自然是为了封装我们之前写的具体的SQL处理函数，从数据库获取数据
@@ -196,11 +1185,16 @@ class Model(dict, metaclass=ModelMetaclass):
     def __init__(self, **kw):
         super(Model, self).__init__(**kw)
 
+    # 查询时被defer掉、还没有从数据库加载的字段名，见findAll的only和defer参数
+    _deferred = frozenset()
+
     # 获取dict的key
     def __getattr__(self, key):
         try:
             return self[key]
         except KeyError:
+            if key in self._deferred:
+                raise AttributeError(r"'%s' field '%s' is deferred, load it with 'await obj.load()' first" % (self.__class__.__name__, key))
             raise AttributeError(r"'Model' object has no attribute '%s'" % key)
 
     # 设置dict的值的，通过d.k = v 的方式
@@ -223,35 +1217,142 @@ class Model(dict, metaclass=ModelMetaclass):
             if field.default is not None:
                 # 如果field的default属性是callable(可被调用的)，就给value赋值它被调用后的值，如果不可被调用直接返回这个值
                 value = field.default() if callable(field.default) else field.default
-                logging.debug('using default value for %s: %s' % (key, str(value)))
+                logging.debug('using default value for %s: %s', key, value)
                 # 把默认值设为这个属性的值
                 setattr(self, key, value)
         return value
 
+    # 加载被defer掉的字段，不传names就加载全部
+    async def load(self, *names):
+        names = [n for n in (names or self._deferred) if n in self._deferred]
+        if not names:
+            return self
+        rs = await select('select %s from `%s` where `%s`=?' % (', '.join('`%s`' % n for n in names), self.__table__, self.__primary_key__), [self.getValue(self.__primary_key__)], 1)
+        if len(rs) == 0:
+            raise ValueError('%s %s not found' % (self.__class__.__name__, self.getValue(self.__primary_key__)))
+        self.update_loaded(rs[0])
+        return self
+
+    # 把从数据库读到的字段值存进对象，并从_deferred里去掉
+    def update_loaded(self, row):
+        dict.update(self, row)
+        # _deferred不能通过self._deferred = ...赋值，__setattr__会把它存成dict的一项
+        self.__dict__['_deferred'] = self._deferred.difference(row)
+
+    # 根据only(只查这些字段)或defer(不查这些字段)生成select语句、查询的列名(按select语句里的顺序)和被defer掉的字段
+    # 主键总是会查出来
+    @classmethod
+    def _projection(cls, only=None, defer=None):
+        if only is None and defer is None:
+            return cls.__select__, (cls.__primary_key__,) + tuple(cls.__fields__), frozenset()
+        if only is not None:
+            fields = [f for f in cls.__fields__ if f in only]
+        else:
+            fields = [f for f in cls.__fields__ if f not in defer]
+        unknown = set(only or defer or ()) - set(cls.__mappings__)
+        if unknown:
+            raise ValueError('unknown field(s) of %s: %s' % (cls.__name__, ', '.join(sorted(unknown))))
+        sql = 'select `%s`%s from `%s`' % (cls.__primary_key__, ''.join(', `%s`' % f for f in fields), cls.__table__)
+        return sql, (cls.__primary_key__,) + tuple(fields), frozenset(cls.__fields__).difference(fields)
+
+    # 用查询结果(dict)创建对象，记下被defer掉的字段
+    @classmethod
+    def _from_row(cls, row, deferred):
+        obj = cls(**row)
+        if deferred:
+            obj.__dict__['_deferred'] = deferred
+        return obj
+
+    # 返回一个把查询结果的一行(tuple，按columns的顺序)直接变成对象的函数，compact为True时生成cls.Row对象
+    # 列的顺序就是select语句里的顺序，按位置赋值，不用先建一个以列名为key的dict再复制一遍
+    @classmethod
+    def _hydrator(cls, columns, compact=False):
+        key = (cls, columns, compact)
+        hydrate = _hydrators.get(key)
+        if hydrate is None:
+            hydrate = _hydrators[key] = _make_hydrator(cls.Row if compact else cls, columns, frozenset(cls.__fields__).difference(columns))
+        return hydrate
+
     # ==============往Model类添加类方法，就可以让所有子类调用类方法=================
 
+    # find、findAll和findNumber都可以传入cache参数使用查询结果缓存，见cached_select
     @ classmethod  # 这个装饰器是类方法的意思，即可以不创建实例直接调用类方法
-    async def find(cls, pk):
+    async def find(cls, pk, cache=False):
         '''查找对象的主键'''
         # select函数之前定义过，这里传入了三个参数分别是之前定义的 sql、args、size
-        rs = await select("%s where `%s`=?" % (cls.__select__, cls.__primary_key__), [pk], 1)
+        rs = await cached_select(cls.__table__, cache, "%s where `%s`=?" % (cls.__select__, cls.__primary_key__), [pk], 1, as_tuple=True)
         if len(rs) == 0:
             return None
-        return cls(**rs[0])
+        return cls._hydrator(cls._projection()[1])(rs[0])
+
+    # find_many() - 根据多个主键批量查找，代替循环调用find()，避免N+1次查询
+    # 重复的主键只查一次，主键很多时按chunk_size分成多条 where `id` in (...) 语句
+    # 默认按传入的主键顺序返回找到的对象(找不到的跳过)，as_dict为True时返回{主键: 对象}
+    @classmethod
+    async def find_many(cls, pks, chunk_size=500, as_dict=False):
+        pks = list(dict.fromkeys(pks))  # 去重并保持顺序
+        found = {}
+        hydrate = cls._hydrator(cls._projection()[1])
+        for i in range(0, len(pks), chunk_size):
+            chunk = pks[i:i + chunk_size]
+            rs = await select('%s where `%s` in (%s)' % (cls.__select__, cls.__primary_key__, create_args_string(len(chunk))), chunk, as_tuple=True)
+            for r in rs:
+                found[r[0]] = hydrate(r)  # 主键是select的第一列
+        if as_dict:
+            return found
+        return [found[pk] for pk in pks if pk in found]
 
     # findAll() - 根据WHERE条件查找
+    # only=[...]只查询指定的字段，defer=[...]不查询指定的字段，比如列表页不需要博客正文：
+    #   blogs = await Blog.findAll(defer=['content', 'html_content'])
+    # 没查询的字段要用的时候需要先await obj.load()，update()也只会更新已经加载的字段
+    # compact=True时返回cls.Row对象而不是Model对象，占用内存更少，创建更快，适合只读的列表
+    # cache=True(或者过期秒数)时使用查询结果缓存，见cached_select
+    # 传入seek关键字参数时使用keyset分页(也叫seek分页)，按(created_at, id)从新到旧排序，orderBy参数无效：
+    #   seek=None                      第一页
+    #   seek=('after', created_at, id)  排在这一行之后(更旧)的记录
+    #   seek=('before', created_at, id) 排在这一行之前(更新)的记录，返回的结果同样是从新到旧
+    # 和limit (offset, size)不同，不管翻到第几页，数据库都只需要沿着索引读limit行
     @classmethod
     async def findAll(cls, where=None, args=None, **kw):
         # sql语句不太会。。这里好像是添加了几个参数 where、args、OrderBy、limit
-        sql = [cls.__select__]
+        keyset = 'seek' in kw
+        only, defer = kw.get('only'), kw.get('defer')
+        if keyset:
+            if 'created_at' not in cls.__mappings__:
+                raise ValueError('%s没有created_at字段，不能使用seek分页' % cls.__name__)
+            if kw['seek'] is not None and (len(kw['seek']) != 3 or kw['seek'][0] not in ('after', 'before')):
+                raise ValueError('错误的seek值：%s' % (kw['seek'],))
+            # keyset分页要用created_at生成游标
+            if only is not None:
+                only = list(only) + ['created_at']
+            elif defer is not None:
+                defer = [f for f in defer if f != 'created_at']
+        select_sql, columns, _ = cls._projection(only, defer)
+        sql = [select_sql]
+        if args is None:  # 这个参数是在执行sql语句前嵌入到sql语句中的，如果为None则定义一个空的list
+            args = []
+        else:
+            args = list(args)  # 下面会往args里添加参数，复制一份，不修改调用者的list
+        seek = kw.get('seek')
+        if seek is not None:
+            direction, created_at, pk = seek
+            op = '<' if direction == 'after' else '>'
+            # 展开写而不是用(created_at, id) < (?, ?)，这样MySQL才能用上created_at上的索引
+            cond = '(`created_at` %s ? or (`created_at` = ? and `%s` %s ?))' % (op, cls.__primary_key__, op)
+            where = '(%s) and %s' % (where, cond) if where else cond
+            args.extend([created_at, created_at, pk])
         # 如果有where参数就在sql语句中添加字符串where和参数where
         if where:
             sql.append("where")
             sql.append(where)
-        if args is None:  # 这个参数是在执行sql语句前嵌入到sql语句中的，如果为None则定义一个空的list
-            args = []
         # 如果有OrderBy参数就在sql语句中添加字符串OrderBy和参数OrderBy，但是OrderBy是在关键字参数中定义的
         orderBy = kw.get("orderBy", None)
+        if keyset:
+            # 往前翻页时先按从旧到新取离游标最近的几行，取出来以后再倒过来
+            reverse = seek is not None and seek[0] == 'before'
+            order = 'asc' if reverse else 'desc'
+            orderBy = '`created_at` %s, `%s` %s' % (order, cls.__primary_key__, order)
         if orderBy:
             sql.append("order by")
             sql.append(orderBy)
@@ -261,46 +1362,144 @@ class Model(dict, metaclass=ModelMetaclass):
             if isinstance(limit, int):
                 sql.append("?")
                 args.append(limit)
-            if isinstance(limit, tuple) and len(limit) == 2:
+            elif isinstance(limit, tuple) and len(limit) == 2 and not keyset:
                 sql.append("?,?")
                 args.extend(limit)  # extend() 函数用于在列表末尾一次性追加另一个序列中的多个值（用新列表扩展原来的列表）。
             else:
-                raise ValueError("错误的limit值：%s" % limit)
-        rs = await select(" ".join(sql), args)
-        return [cls(**r) for r in rs]
+                raise ValueError("错误的limit值：%s" % (limit,))
+        rs = await cached_select(cls.__table__, kw.get('cache', False), " ".join(sql), args, as_tuple=True)
+        if keyset and reverse:
+            rs = rs[::-1]
+        return list(map(cls._hydrator(columns, kw.get('compact', False)), rs))
+
+    # stream() - 和findAll()一样根据WHERE条件查找，但是返回ResultStream，一边从数据库读取一边生成对象
+    # 不管结果有多少行，内存里最多只有batch_size行，适合导出、遍历整张表
+    # 和findAll一样支持only、defer和compact参数
+    @classmethod
+    def stream(cls, where=None, args=None, batch_size=100, **kw):
+        select_sql, columns, _ = cls._projection(kw.get('only'), kw.get('defer'))
+        sql = [select_sql]
+        if where:
+            sql.append("where")
+            sql.append(where)
+        orderBy = kw.get("orderBy", None)
+        if orderBy:
+            sql.append("order by")
+            sql.append(orderBy)
+        return ResultStream(select_stream(" ".join(sql), args, batch_size), cls._hydrator(columns, kw.get('compact', False)))
+
+    # count() - 满足WHERE条件的行数，和findNumber('count(*)', where, args)一样，但是查过一次以后会记住结果
+    # save、remove时直接加减，定期用count(*)校正，见RowCounter
+    # approximate=True时，整张表的行数如果还没有记录，就用information_schema里的估计值，适合只用来显示大概数量的地方
+    @classmethod
+    async def count(cls, where=None, args=None, approximate=False):
+        return await _row_counts.count(cls, where, args, approximate)
 
     # findNumber() - 根据WHERE条件查找，但返回的是整数，适用于select count(*)类型的SQL。
     @classmethod
-    async def findNumber(cls, selectField, where=None, args=None):
+    async def findNumber(cls, selectField, where=None, args=None, cache=False):
         sql = ['select %s _num_ from `%s`' % (selectField, cls.__table__)]
         if where:
             sql.append("where")
             sql.append(where)
-        rs = await select(" ".join(sql), args, 1)
+        rs = await cached_select(cls.__table__, cache, " ".join(sql), args, 1, as_tuple=True)
         if len(rs) == 0:
             return None
-        return rs[0]['_num_']
+        return rs[0][0]
 
     # ===============往Model类添加实例方法，就可以让所有子类调用实例方法===================
 
     # save、update、remove这三个方法需要管理员权限才能操作，所以不定义为类方法，需要创建实例之后才能调用
+    # 在事务里调用时只是记下来，提交前才写入，见Transaction
     async def save(self):
+        tx = _transaction.get()
+        if tx is not None:
+            # 现在就填好默认值(比如id和created_at)，调用者在提交前就可以使用
+            self.getValueOrDefault(self.__primary_key__)
+            for f in self.__fields__:
+                self.getValueOrDefault(f)
+            tx.add('save', self)
+            return
         args = list(map(self.getValueOrDefault, self.__fields__))  # 将除主键外的属性名添加到args这个列表中
         args.append(self.getValueOrDefault(self.__primary_key__))  # 再把主键添加到这个列表的最后
         rows = await execute(self.__insert__, args)
+        await _written(self.__class__, 'save', [self], rows == 1)
         if rows != 1:  # 插入纪录受影响的行数应该为1，如果不是1 那就错了
-            logging.warn("无法插入纪录，受影响的行：%s" % rows)
+            logging.warn("无法插入纪录，受影响的行：%s", rows)
 
-    async def update(self):
-        args = list(map(self.getValue, self.__fields__))
+    # save_many() - 批量插入，每chunk_size个对象拼成一条多行的insert语句，所有语句在同一个事务里执行
+    # 比逐个调用save()少了大量的数据库往返和连接获取，适合导入、迁移这类大批量写入
+    @classmethod
+    async def save_many(cls, objs, chunk_size=500):
+        objs = list(objs)
+        if not objs:
+            return 0
+        tx = _transaction.get()
+        rows = await execute_batch(cls._insert_statements(objs, chunk_size))
+        if tx is not None:
+            tx.written('save', cls, objs, rows == len(objs))
+        else:
+            await _written(cls, 'save', objs, rows == len(objs))
+        if rows != len(objs):
+            logging.warn('批量插入纪录数不符，预期%s行，受影响的行：%s', len(objs), rows)
+        return rows
+
+    # 生成插入objs的insert语句，每chunk_size个对象一条
+    @classmethod
+    def _insert_statements(cls, objs, chunk_size=500):
+        # __insert__形如 insert into `t` (...) values (?, ?, ?)，把values后面的一组占位符重复多次
+        head, row = cls.__insert__.rsplit(' values ', 1)
+        statements = []
+        for i in range(0, len(objs), chunk_size):
+            chunk = objs[i:i + chunk_size]
+            args = []
+            for obj in chunk:
+                args.extend(map(obj.getValueOrDefault, cls.__fields__))
+                args.append(obj.getValueOrDefault(cls.__primary_key__))
+            statements.append(('%s values %s' % (head, ', '.join([row] * len(chunk))), args))
+        return statements
+
+    # 生成删除objs的delete语句，每chunk_size个对象一条
+    @classmethod
+    def _delete_statements(cls, objs, chunk_size=500):
+        statements = []
+        for i in range(0, len(objs), chunk_size):
+            chunk = objs[i:i + chunk_size]
+            statements.append(('delete from `%s` where `%s` in (%s)' % (cls.__table__, cls.__primary_key__, create_args_string(len(chunk))), [obj.getValue(cls.__primary_key__) for obj in chunk]))
+        return statements
+
+    # update语句
+    def _update_sql(self):
+        if not self._deferred:
+            return self.__update__
+        # 有字段没有加载，只更新已经加载的字段，否则会把没加载的字段写成NULL
+        fields = [f for f in self.__fields__ if f not in self._deferred]
+        return 'update `%s` set %s where `%s`=?' % (self.__table__, ', '.join(map(lambda f: '`%s`=?' % (self.__mappings__.get(f).name or f), fields)), self.__primary_key__)
+
+    # update语句的参数，和_update_sql对应
+    def _update_args(self):
+        args = [self.getValue(f) for f in self.__fields__ if f not in self._deferred]
         args.append(self.getValue(self.__primary_key__))
-        rows = await execute(self.__update__, args)
+        return args
+
+    async def update(self):
+        sql = self._update_sql()
+        tx = _transaction.get()
+        if tx is not None:
+            tx.add('update', self, sql)
+            return
+        rows = await execute(sql, self._update_args())
+        await _written(self.__class__, 'update', [self], rows == 1)
         if rows != 1:
-            logging.warn('failed to update by primary key: affected rows: %s' % rows)
+            logging.warn('failed to update by primary key: affected rows: %s', rows)
 
     async def remove(self):
+        tx = _transaction.get()
+        if tx is not None:
+            tx.add('remove', self)
+            return
         args = [self.getValue(self.__primary_key__)]
         rows = await execute(self.__delete__, args)
+        await _written(self.__class__, 'remove', [self], rows == 1)
         if rows != 1:
-            logging.warn('failed to remove by primary key: affected rows: %s' % rows)
-
+            logging.warn('failed to remove by primary key: affected rows: %s', rows)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Micro-benchmark of turning query results into Model objects.
+
+Compares, without a database, the old path (the cursor builds a dict per
+row keyed by column name, then cls(**row) copies it into the Model) with
+the tuple path used by Model.findAll (rows stay tuples and are mapped
+positionally by Model._hydrator), for Model objects and compact rows:
+
+    python3 orm_benchmark.py [--rows 10000] [--repeat 5]
+'''
+
+import argparse, sys, time, tracemalloc
+
+import orm
+from models import Blog
+
+
+def make_rows(n):
+    '''n rows of the blogs table as the default (tuple) cursor returns them.'''
+    return [('%015d000' % i, 'user', 'name', 'about:blank', 'title %d' % i, 'summary ' * 10,
+             'content ' * 100, '<p>content</p>' * 50, 'hash', 1500000000.0 + i) for i in range(n)]
+
+
+def dict_path(rows, columns):
+    # 相当于DictCursor加上cls(**r)
+    dicts = [dict(zip(columns, r)) for r in rows]
+    return [Blog(**d) for d in dicts]
+
+
+def tuple_path(rows, columns):
+    return list(map(Blog._hydrator(columns), rows))
+
+
+def compact_path(rows, columns):
+    return list(map(Blog._hydrator(columns, compact=True), rows))
+
+
+def measure(func, rows, columns, repeat):
+    '''Best time (seconds) over repeat runs and the peak memory (KiB) of one run.'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(rows, columns)
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    tracemalloc.start()
+    try:
+        result = func(rows, columns)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return best, peak / 1024.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ORM row hydration.')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    rows = make_rows(args.rows)
+    columns = Blog._projection()[1]
+    # 三种方式得到的数据必须一样
+    assert [dict(b) for b in tuple_path(rows[:10], columns)] == [dict(b) for b in dict_path(rows[:10], columns)]
+    assert [b.to_dict() for b in compact_path(rows[:10], columns)] == [dict(b) for b in dict_path(rows[:10], columns)]
+
+    base = None
+    for name, func in [('dict cursor + cls(**r)', dict_path), ('tuple cursor', tuple_path),
+                       ('tuple cursor, compact', compact_path)]:
+        t, peak = measure(func, rows, columns, args.repeat)
+        base = base or t
+        print('%-24s %8.2fms %9.0fKiB  %.2fx' % (name, t * 1000, peak, base / t))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Query result cache for the ORM.
+
+Model.find/findAll/findNumber called with cache=True (or cache=<ttl>) look
+up their raw result rows here, keyed by table, SQL and args. Every write
+through Model.save/save_many/update/remove invalidates all entries of its
+table. Two backends:
+
+    MemoryQueryCache   in-process LRU with TTL
+    SocketQueryCache   client of a QueryCacheServer listening on a unix
+                       socket, shared by several worker processes
+
+Run a shared cache server:
+
+    python3 ormcache.py --socket /tmp/awesome-orm-cache.sock
+'''
+
+import argparse, asyncio, logging, os, pickle, socket, struct, time
+
+from collections import OrderedDict
+
+
+# 每张表有一个代数(generation)，表被写入时加一
+# 查询前先lookup拿到当时的代数，查询完store时代数已经变了，说明查询期间表被写过，查到的结果可能是旧的，不保存
+# 这样查询和写入并发时也不会把旧数据放进缓存
+
+
+# 进程内的LRU缓存，超过max_entries时淘汰最久没用的条目，条目超过ttl秒后失效
+# 缓存的是select返回的原始行(tuple)，每次命中都重新生成Model对象，调用者修改对象不会影响缓存
+class MemoryQueryCache(object):
+
+    def __init__(self, max_entries=1024, ttl=5.0):
+        self.max_entries = max_entries
+        self.ttl = ttl  # 默认的过期时间(秒)
+        self.counts = dict(hits=0, misses=0, stores=0, stale=0, evictions=0, invalidations=0)
+        self._entries = OrderedDict()  # (table, key) -> (expires, rows)
+        self._keys = {}  # table -> 这张表的缓存条目的key集合，用于按表失效
+        self._generations = {}  # table -> 代数
+
+    def __len__(self):
+        return len(self._entries)
+
+    # 查找缓存，返回(rows, token)，没命中时rows为None，token要传给store
+    async def lookup(self, table, key):
+        return self.lookup_now(table, key)
+
+    async def store(self, table, key, rows, token, ttl=None):
+        self.store_now(table, key, rows, token, ttl)
+
+    async def invalidate(self, table):
+        self.invalidate_now(table)
+
+    async def stats(self):
+        return self.stats_now()
+
+    async def close(self):
+        pass
+
+    # 以下是同步版本，QueryCacheServer直接调用
+
+    def lookup_now(self, table, key):
+        entry = self._entries.get((table, key))
+        if entry is not None:
+            if entry[0] > time.time():
+                self._entries.move_to_end((table, key))
+                self.counts['hits'] += 1
+                return entry[1], None
+            self._discard(table, key)
+        self.counts['misses'] += 1
+        return None, self._generations.get(table, 0)
+
+    def store_now(self, table, key, rows, token, ttl=None):
+        if token != self._generations.get(table, 0):
+            self.counts['stale'] += 1
+            return
+        self._discard(table, key)
+        self._entries[(table, key)] = (time.time() + (self.ttl if ttl is None else ttl), rows)
+        self._keys.setdefault(table, set()).add(key)
+        self.counts['stores'] += 1
+        while len(self._entries) > self.max_entries:
+            (t, k), _ = self._entries.popitem(last=False)
+            self._keys[t].discard(k)
+            self.counts['evictions'] += 1
+
+    def invalidate_now(self, table):
+        self._generations[table] = self._generations.get(table, 0) + 1
+        for key in self._keys.pop(table, ()):
+            del self._entries[(table, key)]
+        self.counts['invalidations'] += 1
+
+    def stats_now(self):
+        lookups = self.counts['hits'] + self.counts['misses']
+        return dict(self.counts, entries=len(self._entries), hit_rate=lookups and float(self.counts['hits']) / lookups or 0.0)
+
+    def _discard(self, table, key):
+        if self._entries.pop((table, key), None) is not None:
+            self._keys[table].discard(key)
+
+
+# 消息格式：4字节长度(网络字节序) + pickle后的数据
+# 请求是(序号, 操作, 参数)，回复是(序号, 结果)，客户端收到的序号不对时断开连接，回复不会配错请求
+# unix socket只有本机能连接，socket文件的权限决定了哪些进程可以使用缓存
+
+async def _read_message(reader):
+    size, = struct.unpack('!I', await reader.readexactly(4))
+    return pickle.loads(await reader.readexactly(size))
+
+
+def _write_message(writer, obj):
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    writer.write(struct.pack('!I', len(data)) + data)
+
+
+# 共享缓存服务器，在一个单独的进程里运行，多个worker进程通过SocketQueryCache连接同一个服务器
+# 所有的读写和失效都在服务器上完成，所以一个worker的写入会让所有worker的缓存失效
+class QueryCacheServer(object):
+
+    def __init__(self, path, **kw):
+        self.path = path
+        self.cache = MemoryQueryCache(**kw)
+        self._server = None
+
+    # 消息是pickle，能连接socket的进程就能让服务器执行任意代码，所以socket文件只能由所有者访问
+    # socket在umask 0o177下创建，从创建开始就是0600，没有先创建再chmod的空档
+    async def start(self):
+        if os.path.exists(self.path):
+            try:
+                _, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                os.unlink(self.path)  # 上次的服务器没有正常退出，留下的socket文件已经没人监听
+            else:
+                writer.close()
+                await writer.wait_closed()
+                raise RuntimeError('query cache server already listening on %s' % self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            sock.bind(self.path)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+        self._server = await asyncio.start_unix_server(self._handle, sock=sock)
+        logging.info('query cache server listening on %s', self.path)
+
+    async def _handle(self, reader, writer):
+        cache = self.cache
+        try:
+            while True:
+                seq, op, args = await _read_message(reader)
+                if op == 'lookup':
+                    result = cache.lookup_now(*args)
+                elif op == 'store':
+                    result = cache.store_now(*args)
+                elif op == 'invalidate':
+                    result = cache.invalidate_now(*args)
+                elif op == 'stats':
+                    result = cache.stats_now()
+                else:
+                    raise ValueError('unknown query cache operation: %r' % (op,))
+                _write_message(writer, (seq, result))
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        except Exception as e:
+            logging.exception(e)
+        finally:
+            writer.close()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+
+# QueryCacheServer的客户端，每个worker进程保持一个连接，请求依次发送
+# 缓存服务器不可用时查询照常访问数据库：lookup当作没命中，store和invalidate只记录日志
+# invalidate失败时其他worker可能会读到旧数据，最多持续ttl秒
+class SocketQueryCache(object):
+
+    def __init__(self, path, timeout=1.0):
+        self.path = path
+        self.timeout = timeout
+        self.errors = 0
+        self._reader = self._writer = None
+        self._lock = asyncio.Lock()
+        self._seq = 0
+
+    # 一次请求没有完整地收到回复(出错、超时或者调用者被取消，比如客户端断开了HTTP连接)时，
+    # 连接上可能还留着这个请求的回复，下一个请求会读到它，所以直接断开，下次调用时重新连接
+    async def _call(self, op, *args):
+        async with self._lock:
+            done = False
+            try:
+                if self._writer is None:
+                    self._reader, self._writer = await asyncio.wait_for(asyncio.open_unix_connection(self.path), self.timeout)
+                self._seq += 1
+                _write_message(self._writer, (self._seq, op, args))
+                seq, result = await asyncio.wait_for(_read_message(self._reader), self.timeout)
+                if seq != self._seq:
+                    raise EOFError('query cache reply %s does not match request %s' % (seq, self._seq))
+                done = True
+                return result
+            except (OSError, EOFError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                self.errors += 1
+                logging.warning('query cache %s failed: %s', op, e)
+                raise
+            finally:
+                if not done:
+                    self._disconnect()
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def lookup(self, table, key):
+        try:
+            return await self._call('lookup', table, key)
+        except Exception:
+            return None, None  # token为None，这次查询的结果不会保存
+
+    async def store(self, table, key, rows, token, ttl=None):
+        if token is None:
+            return
+        try:
+            await self._call('store', table, key, rows, token, ttl)
+        except Exception:
+            pass
+
+    async def invalidate(self, table):
+        try:
+            await self._call('invalidate', table)
+        except Exception:
+            pass
+
+    async def stats(self):
+        stats = await self._call('stats')
+        stats['client_errors'] = self.errors
+        return stats
+
+    async def close(self):
+        async with self._lock:
+            self._disconnect()
+
+
+# 根据配置创建缓存后端，backend为None时不使用缓存
+def create_cache(backend='memory', socket=None, max_entries=1024, ttl=5.0, timeout=1.0):
+    if backend is None:
+        return None
+    if backend == 'memory':
+        return MemoryQueryCache(max_entries=max_entries, ttl=ttl)
+    if backend == 'socket':
+        return SocketQueryCache(socket, timeout=timeout)
+    raise ValueError('unknown query cache backend: %r' % (backend,))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a query cache server shared by ORM worker processes.')
+    parser.add_argument('--socket', required=True, help='path of the unix socket')
+    parser.add_argument('--max-entries', type=int, default=1024)
+    parser.add_argument('--ttl', type=float, default=5.0, help='default TTL in seconds')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_event_loop()
+    server = QueryCacheServer(args.socket, max_entries=args.max_entries, ttl=args.ttl)
+    loop.run_until_complete(server.start())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
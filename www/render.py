@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Markdown rendering for blogs.
+'''
+
+import asyncio, hashlib, logging, time
+
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import logsetup
+import markdown2
+
+# 渲染器版本号，修改了渲染参数(比如MARKDOWN_EXTRAS)或者渲染逻辑时要把它加一
+# 版本号参与content_hash的计算，改动以后所有博客的hash都会失效，用rerender.py重新渲染即可
+RENDER_VERSION = 2
+
+# 传给markdown2的extras，None表示只用标准语法
+MARKDOWN_EXTRAS = None
+
+
+# 计算博客正文的hash，除了正文本身，渲染器版本、markdown2版本和extras也参与计算
+# 这样只要其中任何一项变了，已经保存的HTML就会被认为是过期的
+def content_hash(content):
+    s = '%s-%s-%r-%s' % (RENDER_VERSION, markdown2.__version__, MARKDOWN_EXTRAS, content)
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+# 把markdown文本渲染成html
+# 这个函数也会在进程池的子进程里执行，所以必须是模块级的函数
+def render_markdown(content):
+    return markdown2.markdown(content, extras=MARKDOWN_EXTRAS)
+
+
+# 按块增量渲染用的渲染器，每个块渲染出的html都缓存在进程内
+# 修改博客时通常只改了几段，只有改动过的块需要重新渲染
+_blocks = markdown2.BlockRenderer(extras=MARKDOWN_EXTRAS)
+
+
+# 把文本分成块，返回(blocks, links)，和render_markdown一样会在子进程里执行
+# 文本不能按块渲染时(比如用了footnotes)直接整篇渲染，返回(html, None)
+def split_markdown(content):
+    split = _blocks.split(content)
+    if split is None:
+        return render_markdown(content), None
+    return split
+
+
+# 渲染若干个块，返回对应的html列表，和render_markdown一样会在子进程里执行
+def render_blocks(blocks, links):
+    return [_blocks.convert_block(block, links) for block in blocks]
+
+
+# 渲染超时时的降级方案：不解析markdown，只把正文转义后按段落输出
+def plain_html(content):
+    lines = map(lambda s: '<p>%s</p>' % s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'), filter(lambda s: s.strip() != '', content.split('\n')))
+    return ''.join(lines)
+
+
+# 渲染服务
+# markdown渲染是纯CPU计算，直接在协程里执行会卡住整个事件循环，一篇长文章就能拖慢所有请求
+# 所以较长的文本交给进程池渲染，短文本渲染很快，直接在当前进程渲染反而省去了进程间传输的开销
+class RenderService(object):
+
+    def __init__(self, loop, workers=2, inline_threshold=16 * 1024, timeout=5.0, latency_samples=1000, max_failed=1024):
+        self._loop = loop
+        # 子进程的日志(比如慢渲染的各阶段耗时)要由子进程自己写，见logsetup.setup_worker
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=logsetup.setup_worker)
+        self.inline_threshold = inline_threshold  # 小于这个长度(字符数)的文本直接渲染
+        self.timeout = timeout  # 进程池渲染的超时时间(秒)，超时后降级为纯文本
+        self.pending = 0  # 已提交到进程池还没有返回的任务数，即队列深度
+        self.counts = dict(inline=0, offloaded=0, timeouts=0, errors=0)
+        self._latencies = deque(maxlen=latency_samples)  # 最近的渲染耗时(秒)
+        self._jobs = {}  # 正文hash -> 正在渲染的任务，同一篇正文同时只渲染一次
+        self._failed = OrderedDict()  # 渲染超时或出错的正文hash，正文不变就不再重试
+        self.max_failed = max_failed
+
+    # 渲染hash为key的正文，同一个key已经在渲染时等待那个任务的结果，不再重复提交
+    # 渲染失败的key会被记下来，见failed()
+    async def render_once(self, key, content, incremental=False):
+        job = self._jobs.get(key)
+        if job is None:
+            job = asyncio.ensure_future(self.render(content, incremental), loop=self._loop)
+            self._jobs[key] = job
+            job.add_done_callback(lambda job: self._done(key, job))
+        # 一个等待者被取消时不能取消共享的任务
+        return await asyncio.shield(job)
+
+    def _done(self, key, job):
+        del self._jobs[key]
+        if job.cancelled() or job.exception() is not None or not job.result()[1]:
+            self._failed[key] = True
+            while len(self._failed) > self.max_failed:
+                self._failed.popitem(last=False)
+
+    # 这个hash的正文是否渲染失败过，失败过的正文在当前进程里不再重试，直到正文改变
+    # 进程重启或者运行rerender.py时会再试一次
+    def failed(self, key):
+        return key in self._failed
+
+    # 渲染markdown，返回(html, ok)，ok为False表示渲染超时或出错，html是降级后的纯文本
+    # incremental为True时按块渲染，只渲染缓存里没有的块
+    async def render(self, content, incremental=False):
+        start = time.time()
+        if incremental:
+            html = await self._render_blocks(content)
+        else:
+            html = await self._run(content, len(content), render_markdown, content)
+        if html is None:
+            return plain_html(content), False
+        self._latencies.append(time.time() - start)
+        return html, True
+
+    # 按块增量渲染：分块和渲染缺少的块都是CPU计算，按各自处理的长度决定是否交给进程池
+    # 当前进程里只做缓存查找和拼接，块的缓存在当前进程，子进程渲染出的html传回来再放进缓存
+    async def _render_blocks(self, content):
+        split = await self._run(content, len(content), split_markdown, content)
+        if split is None:
+            return None
+        blocks, links = split
+        if links is None:
+            return blocks  # 不能按块渲染，子进程已经整篇渲染好了
+        missing = _blocks.missing(blocks, links)
+        htmls = await self._run(content, sum(map(len, missing)), render_blocks, missing, links) if missing else []
+        if htmls is None:
+            return None
+        return _blocks.assemble(blocks, links, zip(missing, htmls))
+
+    # 执行fn，size小于inline_threshold时在当前进程执行，否则交给进程池，超时或出错时返回None
+    async def _run(self, content, size, fn, *args):
+        if size < self.inline_threshold:
+            self.counts['inline'] += 1
+            return fn(*args)
+        self.counts['offloaded'] += 1
+        return await self._offload(content, fn, *args)
+
+    # 在进程池里执行fn，超时或出错时返回None
+    async def _offload(self, content, fn, *args):
+        self.pending += 1
+        try:
+            return await asyncio.wait_for(self._loop.run_in_executor(self._executor, fn, *args), self.timeout)
+        except asyncio.TimeoutError:
+            # 注意：已经开始执行的任务无法取消，子进程会继续把它算完
+            self.counts['timeouts'] += 1
+            logging.warning('markdown渲染超时(%s字符, %.1f秒)，降级为纯文本', len(content), self.timeout)
+        except Exception as e:
+            self.counts['errors'] += 1
+            logging.exception(e)
+        finally:
+            self.pending -= 1
+        return None
+
+    # 返回渲染服务的统计信息：队列深度、各类计数以及最近渲染耗时的分位数(毫秒)
+    def stats(self):
+        samples = sorted(self._latencies)
+        def percentile(p):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+        return dict(self.counts, pending=self.pending, failed=len(self._failed), samples=len(samples),
+                    p50_ms=percentile(0.5), p95_ms=percentile(0.95), p99_ms=percentile(0.99),
+                    max_ms=samples[-1] * 1000 if samples else 0.0, blocks=_blocks.stats())
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+# 全局渲染服务，在app.py的init函数中创建
+# 没有创建时(比如在脚本里使用)，所有渲染都在当前进程中完成
+_service = None
+
+
+# slow_ms不为None时，记录渲染耗时超过slow_ms毫秒的文章在各个阶段的耗时，用来找出慢在哪一步
+# 要在创建进程池之前设置，子进程是fork出来的，会继承这个设置
+def init_service(loop, slow_ms=None, **kw):
+    global _service
+    if slow_ms is not None:
+        markdown2.Markdown.profiler = markdown2.ProfileLogger(threshold=slow_ms / 1000.0, logger=logging.getLogger(__name__), level=logging.WARNING)
+    logging.info('创建markdown渲染进程池...')
+    _service = RenderService(loop, **kw)
+    return _service
+
+
+def stats():
+    if _service is None:
+        return None
+    return _service.stats()
+
+
+# 判断博客保存的html是否需要重新渲染
+# 渲染超时降级成纯文本的正文不算过期，否则每次访问都会把同一篇慢文章再提交一次
+def is_stale(blog):
+    if not blog.get('html_content'):
+        return True
+    h = content_hash(blog.content)
+    return blog.get('content_hash') != h and not (_service is not None and _service.failed(h))
+
+
+# 渲染博客正文，把结果和hash写回blog对象，保存到数据库由调用者负责
+# 如果渲染超时降级成了纯文本，content_hash会置空，正文改变、进程重启或者运行rerender.py时会再次尝试渲染
+# incremental为True时按块增量渲染，适合修改博客：没有改动的段落直接用缓存的html
+async def render_blog(blog, incremental=False):
+    h = content_hash(blog.content)
+    if _service is None:
+        html = _blocks.convert(blog.content) if incremental else render_markdown(blog.content)
+        ok = True
+    else:
+        html, ok = await _service.render_once(h, blog.content, incremental)
+    blog.html_content = html
+    blog.content_hash = h if ok else ''
+    return blog
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Re-render the html of all blogs in batches.
+
+Run it after upgrading markdown2 or changing render.MARKDOWN_EXTRAS / render.RENDER_VERSION:
+
+    python3 rerender.py [--batch-size 100] [--force] [--dry-run]
+'''
+
+import argparse, asyncio, logging, time
+
+import orm
+import render
+from models import Blog
+from config import configs
+
+
+async def rerender(loop, batch_size, force=False, dry_run=False):
+    await orm.create_pool(loop=loop, **configs.db)
+    total = await Blog.findNumber('count(id)')
+    logging.info('共有%s篇博客', total)
+    checked = rendered = 0
+    offset = 0
+    start = time.time()
+    while True:
+        # 按创建时间分批取出，重新渲染过程中博客的created_at不会变，所以offset分页不会漏掉或重复
+        blogs = await Blog.findAll(orderBy='created_at, id', limit=(offset, batch_size))
+        if not blogs:
+            break
+        offset += len(blogs)
+        changed = []
+        for blog in blogs:
+            checked += 1
+            if not force and not render.is_stale(blog):
+                continue
+            rendered += 1
+            if dry_run:
+                logging.info('需要重新渲染：%s %s', blog.id, blog.name)
+                continue
+            await render.render_blog(blog)
+            changed.append(blog)
+        # 一批博客渲染完以后在同一个事务里写回，只提交一次
+        async with orm.transaction():
+            for blog in changed:
+                await blog.update()
+        logging.info('进度：%s/%s，已渲染%s篇', checked, total, rendered)
+    logging.info('完成：检查%s篇，渲染%s篇，用时%.1f秒', checked, rendered, time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-render blog html after a renderer change.')
+    parser.add_argument('--batch-size', type=int, default=100, help='number of blogs loaded per query')
+    parser.add_argument('--force', action='store_true', help='re-render every blog even if its hash is up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only report which blogs are stale')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(rerender(loop, args.batch_size, args.force, args.dry_run))
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -29,11 +29,17 @@ create table blogs (
     `name` varchar(50) not null,
     `summary` varchar(200) not null,
     `content` mediumtext not null,
+    `html_content` mediumtext not null,
+    `content_hash` varchar(50) not null,
     `created_at` real not null,
     key `idx_created_at` (`created_at`),
     primary key (`id`)
 ) engine=innodb default charset=utf8;
 
+-- 已有数据库升级：
+-- alter table blogs add column `html_content` mediumtext not null, add column `content_hash` varchar(50) not null default '';
+-- 然后运行 python3 rerender.py 渲染已有的博客
+
 create table comments (
     `id` varchar(50) not null,
     `blog_id` varchar(50) not null,
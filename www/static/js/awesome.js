@@ -124,6 +124,12 @@ function gotoPage(i) {
     location.assign('?' + $.param(r));
 }
 
+function gotoCursor(cursor) {
+    var r = parseQueryString();
+    r.cursor = cursor;
+    location.assign('?' + $.param(r));
+}
+
 function refresh() {
     var
         t = new Date().getTime(),
@@ -366,6 +372,14 @@ if (typeof(Vue)!=='undefined') {
                 '<li v-if="has_next"><a v-attr="onclick:\'gotoPage(\' + (page_index+1) + \')\'" href="#0"><i class="uk-icon-angle-double-right"></i></a></li>' +
             '</ul>'
     });
+    Vue.component('cursor-pagination', {
+        template: '<ul class="uk-pagination">' +
+                '<li v-if="! has_previous" class="uk-disabled"><span><i class="uk-icon-angle-double-left"></i></span></li>' +
+                '<li v-if="has_previous"><a v-attr="onclick:\'gotoCursor(\\\'\' + prev_cursor + \'\\\')\'" href="#0"><i class="uk-icon-angle-double-left"></i></a></li>' +
+                '<li v-if="! has_next" class="uk-disabled"><span><i class="uk-icon-angle-double-right"></i></span></li>' +
+                '<li v-if="has_next"><a v-attr="onclick:\'gotoCursor(\\\'\' + next_cursor + \'\\\')\'" href="#0"><i class="uk-icon-angle-double-right"></i></a></li>' +
+            '</ul>'
+    });
 }
 
 function redirect(url) {
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Tests of logsetup.py.
+
+    python3 -m pytest test_logsetup.py
+'''
+
+import logging, os, shutil, tempfile, unittest
+
+from concurrent.futures import ProcessPoolExecutor
+
+import logsetup
+
+
+def log_in_worker():
+    logging.getLogger('render').warning('from worker')
+
+
+class SetupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'app.log')
+        self.handlers = logging.getLogger().handlers[:]
+
+    def tearDown(self):
+        logsetup._stop_listener()
+        root = logging.getLogger()
+        for h in root.handlers[:]:
+            root.removeHandler(h)
+            h.close()
+        for h in self.handlers:
+            root.addHandler(h)
+        shutil.rmtree(self.dir)
+
+    def read_log(self):
+        logsetup._stop_listener()
+        with open(self.filename, encoding='utf-8') as f:
+            return f.read()
+
+    def test_forked_worker_logs(self):
+        logsetup.setup(level='INFO', queued=True, filename=self.filename)
+        logging.warning('from parent')
+        with ProcessPoolExecutor(max_workers=1, initializer=logsetup.setup_worker) as executor:
+            executor.submit(log_in_worker).result()
+        log = self.read_log()
+        self.assertIn('from parent', log)
+        self.assertIn('from worker', log)
+
+    def test_setup_twice(self):
+        logsetup.setup(level='INFO', queued=True, filename=self.filename)
+        logsetup.setup(level='INFO', queued=True, filename=self.filename)
+        logging.warning('after second setup')
+        self.assertIn('after second setup', self.read_log())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Tests of markdown2.py changes made for the blog.
+
+    python3 -m pytest test_markdown2.py
+'''
+
+import random, unittest
+
+import markdown2
+
+
+class BlockRendererTest(unittest.TestCase):
+
+    def assertSameAsMarkdown(self, text):
+        self.assertEqual(markdown2.BlockRenderer().convert(text), markdown2.markdown(text))
+
+    def test_literal_empty_paragraph_block(self):
+        self.assertSameAsMarkdown('before\n\n<p></p>\n\nafter\n')
+        self.assertSameAsMarkdown('<p></p>\n\nafter\n')
+
+    def test_link_definitions_only(self):
+        self.assertSameAsMarkdown('[a]: http://example.com/\n')
+        self.assertSameAsMarkdown('[a]: http://example.com/\n\nsee [the link][a]\n')
+
+    # Fragments that have tripped up the splitter, combined at random.
+    FRAGMENTS = ['para text', '![i][a]', '![i][a]\n[a]: /u', '[a]: /u', '[b]: /v "t"', '[link][b]', 'x *em', '`code`',
+                 '<div>\nx\n</div>', '<div>', '</div>', '<pre>', '</pre>', '<div markdown="1">', '<span>', '</span>',
+                 '<p></p>', '<!-- c -->', '<!--', '-->', '```', '```python', '```\ncode\n```', '```python\ncode\n```',
+                 '~~~', '    indented', '\tindented', '    ```', '* item', '1. item', '- [x]', '  cont', '> quote',
+                 '# h', '***', 'a\nb', 'text <b', '>', '| a | b |\n|---|---|\n| 1 | 2 |', '']
+
+    def random_document(self, rnd):
+        return ''.join(rnd.choice(self.FRAGMENTS) + '\n' * rnd.choice([1, 1, 2, 2, 3])
+                       for _ in range(rnd.randint(1, 10)))
+
+    def assertSameOnRandomDocuments(self, count, extras=None):
+        rnd = random.Random(0)
+        for _ in range(count):
+            text = self.random_document(rnd)
+            self.assertEqual(markdown2.BlockRenderer(extras=extras).convert(text),
+                             markdown2.markdown(text, extras=extras), text)
+
+    def test_random_documents(self):
+        self.assertSameOnRandomDocuments(2000)
+
+    def test_random_documents_with_extras(self):
+        self.assertSameOnRandomDocuments(1000, extras=['fenced-code-blocks', 'tables'])
+
+    def test_counts_each_block_once(self):
+        renderer = markdown2.BlockRenderer()
+        text = 'one\n\ntwo\n'
+        blocks, links = renderer.split(text)
+        missing = renderer.missing(blocks, links)
+        self.assertEqual(missing, blocks)
+        html = renderer.assemble(blocks, links, [(b, renderer.convert_block(b, links)) for b in missing])
+        self.assertEqual(html, markdown2.markdown(text))
+        stats = renderer.stats()
+        self.assertEqual((stats['blocks_converted'], stats['blocks_reused']), (2, 0))
+        self.assertEqual((stats['hits'], stats['misses']), (0, 0))
+        renderer.convert('one\n\nthree\n')
+        stats = renderer.stats()
+        self.assertEqual((stats['blocks_converted'], stats['blocks_reused']), (3, 1))
+
+
+class BackslashEscapeTest(unittest.TestCase):
+
+    def test_backslash_before_code_span_text(self):
+        # Code spans used to be added to the escape table, so "\\" followed
+        # by the text of an earlier code span was taken for an escape and the
+        # backslash was dropped. A backslash before a character that isn't
+        # escapable is kept.
+        self.assertEqual(markdown2.markdown('Use `foo` here, and \\foo there.\n'),
+                         '<p>Use <code>foo</code> here, and \\foo there.</p>\n')
+        self.assertEqual(markdown2.markdown('`x` \\x\n'), '<p><code>x</code> \\x</p>\n')
+
+    def test_escaped_special_char_after_code_span(self):
+        self.assertEqual(markdown2.markdown('Code `*` then \\* star\n'),
+                         '<p>Code <code>*</code> then * star</p>\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Tests of orm.py that don't need a database: the connection pool is
+replaced by one that records the statements it is asked to run.
+
+    python3 -m pytest test_orm.py
+'''
+
+import asyncio, unittest
+
+import orm
+from models import Blog, Comment
+
+
+class FakeCursor(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def execute(self, sql, args=()):
+        self.conn.log.append(sql.split(' ')[0] + ' ' + sql.split('`')[1])
+        # insert ... values (...), (...)：每组values一行；delete ... in (...)：每个参数一行；其他一行
+        if sql.startswith('insert'):
+            self.rowcount = sql.count('), (') + 1
+        elif sql.startswith('delete'):
+            self.rowcount = len(args)
+        else:
+            self.rowcount = 1
+
+    async def fetchall(self):
+        return []
+
+    async def fetchmany(self, size):
+        return []
+
+
+class FakeConnection(object):
+
+    def __init__(self, log):
+        self.log = log
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def cursor(self, *args):
+        return FakeCursor(self)
+
+    async def begin(self):
+        self.log.append('BEGIN')
+
+    async def commit(self):
+        self.log.append('COMMIT')
+
+    async def rollback(self):
+        self.log.append('ROLLBACK')
+
+
+class FakePool(object):
+    size = freesize = 0
+    maxsize = 10
+
+    def __init__(self):
+        self.log = []
+
+    async def acquire(self):
+        return FakeConnection(self.log)
+
+    def release(self, conn):
+        pass
+
+
+class PoolTest(unittest.TestCase):
+
+    def run_async(self, coro):
+        return asyncio.new_event_loop().run_until_complete(coro)
+
+    def test_release_closes_connections_over_maxsize(self):
+        async def run():
+            pool = FakePool()
+            db = orm.DbPool('primary', pool)
+            conn = await db.acquire()
+            # 最大连接数调小以后，打开的连接比maxsize多，放回时关掉
+            pool.size = 3
+            db.set_maxsize(2)
+            db.release(conn)
+            self.assertTrue(conn.closed)
+            conn = await db.acquire()
+            pool.size = 2
+            db.release(conn)
+            self.assertFalse(conn.closed)
+            self.assertEqual(db.in_use, 0)
+        self.run_async(run())
+
+    def test_maxsize_limits_connections_in_use(self):
+        async def run():
+            db = orm.DbPool('primary', FakePool(), maxsize=1)
+            first = await db.acquire()
+            waiting = asyncio.ensure_future(db.acquire())
+            await asyncio.sleep(0)
+            self.assertFalse(waiting.done())
+            db.release(first)
+            second = await waiting
+            # 调大以后等待的协程马上可以取到连接
+            waiting = asyncio.ensure_future(db.acquire())
+            await asyncio.sleep(0)
+            self.assertFalse(waiting.done())
+            db.set_maxsize(2)
+            await waiting
+            self.assertEqual(db.in_use, 2)
+        self.run_async(run())
+
+    def test_controller_resizes_without_touching_aiomysql(self):
+        db = orm.DbPool('primary', FakePool(), maxsize=4)
+        controller = orm.PoolController(db, min_size=2, max_size=8, target_wait_ms=5.0)
+        db._recent_waits = [0.1] * 20
+        controller.adjust()
+        self.assertEqual(db.maxsize, 6)
+        controller.adjust()
+        self.assertEqual(db.maxsize, 5)
+        # 不超过aiomysql连接池的maxsize
+        db.set_maxsize(20)
+        self.assertEqual(db.maxsize, 10)
+
+
+class CreatePoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = orm._open_pool, orm._replicas
+        orm._replicas = orm.ReplicaSet()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        if orm._replicas._task is not None:
+            orm._replicas._task.cancel()
+            self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        orm._open_pool, orm._replicas = self.saved
+
+    def test_unreachable_replica_starts_unhealthy(self):
+        async def open_pool(loop, kw):
+            # 连不上的从库：建立连接时出错，minsize=0时不建立连接，不会出错
+            if kw.get('host') == 'down' and kw.get('minsize', 1):
+                raise OSError('connection refused')
+            return FakePool()
+        orm._open_pool = open_pool
+        self.loop.run_until_complete(orm.create_pool(self.loop, user='u', password='p', db='d',
+                                                     replicas=[{'host': 'up'}, {'host': 'down'}]))
+        up, down = orm._replicas.pools
+        self.assertTrue(up.healthy)
+        self.assertFalse(down.healthy)
+        self.assertEqual(down.last_error, 'connection refused')
+        self.assertIs(orm._replicas.choose(), up)
+
+
+class SeekTest(unittest.TestCase):
+
+    def run_async(self, coro):
+        return asyncio.new_event_loop().run_until_complete(coro)
+
+    def test_model_without_created_at(self):
+        class Tag(orm.Model):
+            __table__ = 'tags'
+            id = orm.StringField(primary_key=True, ddl='varchar(50)')
+            name = orm.StringField(ddl='varchar(50)')
+        with self.assertRaises(ValueError):
+            self.run_async(Tag.findAll(seek=None, limit=10))
+
+    def test_bad_seek(self):
+        with self.assertRaises(ValueError):
+            self.run_async(Blog.findAll(seek=('sideways', 1.0, 'x'), limit=10))
+
+
+def new_blog():
+    return Blog(user_id='u', user_name='n', user_image='about:blank', name='t', summary='s', content='c')
+
+
+class TransactionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FakePool()
+        setattr(orm, '__pool', orm.DbPool('primary', self.pool))
+
+    def run_async(self, coro):
+        return asyncio.new_event_loop().run_until_complete(coro)
+
+    def test_deferred_save_fills_defaults(self):
+        async def run():
+            async with orm.transaction():
+                blog = new_blog()
+                await blog.save()
+                # 插入要到提交时才执行，但是id和created_at现在就可以用
+                self.assertTrue(blog.id)
+                self.assertTrue(blog.created_at)
+                self.assertEqual(self.pool.log, ['BEGIN'])
+        self.run_async(run())
+
+    def test_raw_writes_keep_order(self):
+        async def run():
+            async with orm.transaction():
+                await new_blog().save()
+                await orm.execute('update `comments` set `content`=? where `blog_id`=?', ['x', 'y'])
+                await orm.execute_batch([('update `users` set `admin`=?', [True])])
+        self.run_async(run())
+        self.assertEqual(self.pool.log, ['BEGIN', 'insert blogs', 'update comments', 'update users', 'COMMIT'])
+
+    def test_grouped_flush(self):
+        async def run():
+            async with orm.transaction():
+                for _ in range(3):
+                    await Comment(blog_id='b', user_id='u', user_name='n', user_image='i', content='c').save()
+                blog = new_blog()
+                await blog.save()
+                await blog.remove()
+        self.run_async(run())
+        self.assertEqual(self.pool.log, ['BEGIN', 'insert comments', 'insert blogs', 'delete blogs', 'COMMIT'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Tests of the shared query cache server in ormcache.py.
+
+    python3 -m pytest test_ormcache.py
+'''
+
+import asyncio, os, shutil, socket, stat, tempfile, unittest
+
+import ormcache
+
+
+class QueryCacheServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cache.sock')
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        # 让服务器处理完客户端断开，连接处理协程退出后再关闭事件循环
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.loop.close()
+        shutil.rmtree(self.dir)
+
+    def test_socket_only_accessible_by_owner(self):
+        async def run():
+            server = ormcache.QueryCacheServer(self.path)
+            await server.start()
+            try:
+                self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+                cache = ormcache.SocketQueryCache(self.path)
+                rows, token = await cache.lookup('blogs', 'k')
+                await cache.store('blogs', 'k', [(1,)], token)
+                self.assertEqual((await cache.lookup('blogs', 'k'))[0], [(1,)])
+                await cache.close()
+            finally:
+                server.close()
+        self.loop.run_until_complete(run())
+
+    def test_cancelled_call_does_not_leave_reply_behind(self):
+        async def run():
+            server = ormcache.QueryCacheServer(self.path)
+            await server.start()
+            try:
+                cache = ormcache.SocketQueryCache(self.path)
+                _, token = await cache.lookup('blogs', 'k1')
+                await cache.store('blogs', 'k1', [('secret-blog',)], token)
+                # 请求已经发出，还没读到回复时被取消
+                task = asyncio.ensure_future(cache.lookup('blogs', 'k1'))
+                await asyncio.sleep(0)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                self.assertEqual(await cache.lookup('users', 'other'), (None, 0))
+                await cache.close()
+            finally:
+                server.close()
+        self.loop.run_until_complete(run())
+
+    def test_refuses_to_replace_live_server(self):
+        async def run():
+            server = ormcache.QueryCacheServer(self.path)
+            await server.start()
+            try:
+                with self.assertRaises(RuntimeError):
+                    await ormcache.QueryCacheServer(self.path).start()
+            finally:
+                server.close()
+        self.loop.run_until_complete(run())
+
+    def test_replaces_stale_socket(self):
+        # 服务器没有正常退出时留下的socket文件，没人监听，可以替换
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.close()
+        async def run():
+            server = ormcache.QueryCacheServer(self.path)
+            await server.start()
+            server.close()
+        self.loop.run_until_complete(run())
+
+
+if __name__ == '__main__':
+    unittest.main()